@@ -0,0 +1,242 @@
+# empirical aging curves from the career batting stats
+# pistachio.py projects OPS+ to ages 21 and 27 with age-to-age growth factors and compares OPS+ with a track for the player's
+# position group; both are hard-coded, and fit() derives them from the league instead, in one pass over every player-season:
+# - growth at an age is the change in OPS+ from one season to the next (same player, same level) for players that age in the
+#   later season, each pair weighted by the harmonic mean of its two seasons' pa (the delta method)
+# - a group's plateau is its players' pa-weighted MLB OPS+ at the peak ages, and its track deflates the plateau by the growth
+#   still to come before 27, as the hard-coded tracks do
+# ages and groups with too little data keep the hard-coded values
+# the fit is saved beside the stats cubes and reused until the career stats or the players change; a chunked run adds up each
+# batch's sums() so no more than one batch's stats are held
+# check() fits a league simulated on given curves, which the fit should give back - pistachio.py runs it on the hard-coded ones
+import hashlib
+import os
+import numpy as np
+
+import cube
+import model
+
+
+AGING_PATH = os.path.join(cube.CUBE_DIR, 'aging.npz')
+
+# the ages growth and tracks are held for (pistachio.py's track_ages) - younger and older players take the end values
+AGES = np.arange(14, 51)
+
+# tracks rise to the plateau at this age and stay there
+PEAK_AGE = 27
+
+# ages whose MLB seasons measure a group's plateau
+PEAK_AGES = (27, 30)
+
+# OOTP position codes in each of pistachio.py's position groups
+GROUP_POSITIONS = {
+    'groupA': [3, 10],      # 1B, DH
+    'groupB': [2, 6, 8],    # C, SS, CF
+    'groupC': [4, 5, 7, 9], # 2B, 3B, LF, RF
+}
+
+# pa (harmonic mean pa for growth) an age or a group needs before its fitted value replaces the hard-coded one
+MIN_WEIGHT = 2000
+
+# loaded fit, checked against the signature of what it was fitted from
+_cache = {}
+
+
+def season_ops_plus(batting_cube):
+    """
+    Returns player_id, year, level_id, pa and OPS+ of every season (all pa, each level on its own) in a batting stats cube,
+    with OPS+ worked out from the season's rates per pa - singles are hits less extra-base hits, as the cube's h counts every hit.
+    """
+    selected = batting_cube['split_id'] == cube.ALL_SPLITS
+    pa = batting_cube['stat_pa'][selected].astype(float)
+    counts = {stat: batting_cube['stat_' + stat][selected] for stat in ['bb', 'k', 'h', 'd', 't', 'hr']}
+    counts['singles'] = counts['h'] - counts['d'] - counts['t'] - counts['hr']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rates = {rate: counts[stat] / pa for rate, stat in [('bb', 'bb'), ('k', 'k'), ('1b', 'singles'), ('2b', 'd'), ('3b', 't'), ('hr', 'hr')]}
+    return {
+        'player_id': batting_cube['player_id'][selected],
+        'year': batting_cube['year'][selected].astype(np.int64),
+        'level_id': batting_cube['level_id'][selected].astype(np.int64),
+        'pa': pa,
+        'ops_plus': model.batting_summary(rates, per_pa=True)['ops_plus'],
+    }
+
+
+def sums(batting_cube, player_ids, ages, positions, season):
+    """
+    Returns the weighted sums fit() works from, for a batting stats cube and its players' current ages and positions, where
+    season is the current season. A league split by player into batches is fitted from the sums of each batch added up.
+    """
+    seasons = season_ops_plus(batting_cube)
+    order = np.argsort(player_ids, kind='stable')
+    sorted_ids = np.asarray(player_ids)[order]
+    found = np.clip(np.searchsorted(sorted_ids, seasons['player_id']), 0, max(len(sorted_ids) - 1, 0))
+    known = (sorted_ids[found] == seasons['player_id']) if len(sorted_ids) else np.zeros(len(found), dtype=bool)
+    player_row = order[found]
+    age = np.where(known, np.asarray(ages, dtype=float)[player_row] - (season - seasons['year']), np.nan)
+    position = np.where(known, np.asarray(positions)[player_row], 0)
+    usable = (seasons['pa'] > 0) & ~np.isnan(seasons['ops_plus']) & ~np.isnan(age)
+
+    # each season paired with the same player's next season at the same level - cells are sorted by player, year and level
+    key = (seasons['player_id'] * 10000 + seasons['year']) * 100 + seasons['level_id']
+    next_row = np.minimum(np.searchsorted(key, key + 100), max(len(key) - 1, 0))
+    paired = usable & (key[next_row] == key + 100) & usable[next_row]
+    first, second = np.flatnonzero(paired), next_row[paired]
+    weight = 2 / (1 / seasons['pa'][first] + 1 / seasons['pa'][second])
+    pair_age = np.clip(age[second], AGES[0], AGES[-1]).astype(int) - AGES[0]
+
+    peak = usable & (seasons['level_id'] == cube.MLB) & (age >= PEAK_AGES[0]) & (age <= PEAK_AGES[1])
+    in_groups = [peak & np.isin(position, codes) for codes in GROUP_POSITIONS.values()]
+    return {
+        'before': np.bincount(pair_age, weight * seasons['ops_plus'][first], minlength=len(AGES)),
+        'after': np.bincount(pair_age, weight * seasons['ops_plus'][second], minlength=len(AGES)),
+        'growth_weight': np.bincount(pair_age, weight, minlength=len(AGES)),
+        'plateau': np.array([(seasons['pa'][in_group] * seasons['ops_plus'][in_group]).sum() for in_group in in_groups]),
+        'plateau_weight': np.array([seasons['pa'][in_group].sum() for in_group in in_groups]),
+    }
+
+
+def fit(batch_sums, growth, plateaus):
+    """
+    Returns growth (one factor per age in AGES) and each group's plateau, fitted from the sums() of every batch of the league
+    (one for the whole league), where growth and plateaus are the defaults kept where there is too little data. The weights
+    behind each value are returned alongside.
+    """
+    total = None
+    for part in batch_sums:
+        total = dict(part) if total is None else {name: total[name] + values for name, values in part.items()}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fitted_growth = np.where(total['growth_weight'] >= MIN_WEIGHT, total['after'] / total['before'] - 1, growth)
+        fitted_plateaus = total['plateau'] / total['plateau_weight']
+    return {
+        'growth': fitted_growth,
+        'growth_weight': total['growth_weight'],
+        'plateaus': {group: float(fitted_plateaus[i]) if total['plateau_weight'][i] >= MIN_WEIGHT else plateaus[group]
+                     for i, group in enumerate(GROUP_POSITIONS)},
+        'plateau_weights': {group: float(total['plateau_weight'][i]) for i, group in enumerate(GROUP_POSITIONS)},
+    }
+
+
+def track(plateau, growth):
+    """Returns a group's track (OPS+ by age, over AGES): the plateau from PEAK_AGE on, deflated by the growth still to come before it."""
+    still_to_come = np.ones(len(AGES))
+    for i in range(PEAK_AGE - AGES[0] - 1, -1, -1):
+        still_to_come[i] = still_to_come[i + 1] * (1 + growth[i + 1])
+    return np.round(plateau / still_to_come).astype(int)
+
+
+def grow(ops_plus, age, growth, to_age):
+    """
+    Returns OPS+ grown from each player's age to to_age by the growth factors (over AGES), rounded down - players already
+    to_age or older keep their OPS+. The factors are applied one year at a time, as pistachio.py always has.
+    """
+    age = np.asarray(age)
+    projected = np.asarray(ops_plus, dtype=float).copy()
+    for next_age in range(AGES[0], to_age + 1):
+        grows = age < next_age
+        projected[grows] *= 1 + growth[next_age - AGES[0]]
+    return np.where(age >= to_age, ops_plus, np.floor(projected))
+
+
+def _simulated_league(growth, plateaus, players=4000, season=2030, seed=0):
+    # a league whose every season's OPS+ is on its player's group track (unrounded) times the player's talent: players come in
+    # pairs of talent 1 + e and 1 - e with the same seasons and pa, so a group's pa-weighted peak OPS+ is its plateau exactly
+    # and each age's growth is the same for every player - returns sums()' arguments
+    rng = np.random.default_rng(seed)
+    codes = np.concatenate(list(GROUP_POSITIONS.values()))
+    group_of = {code: group for group, group_codes in GROUP_POSITIONS.items() for code in group_codes}
+    still_to_come = np.ones(len(AGES))
+    for i in range(PEAK_AGE - AGES[0] - 1, -1, -1):
+        still_to_come[i] = still_to_come[i + 1] * (1 + growth[i + 1])
+
+    positions = np.repeat(rng.choice(codes, players // 2), 2)
+    ages = np.repeat(rng.integers(20, 41, players // 2), 2)
+    spread = rng.uniform(0, 0.2, players // 2)
+    talent = np.column_stack([1 + spread, 1 - spread]).ravel()
+    rows = {'player_id': [], 'year': [], 'level_id': [], 'pa': [], 'ops_plus': []}
+    for pair in range(players // 2):
+        first_age, debut_age = int(rng.integers(17, 25)), int(rng.integers(20, 26))
+        season_ages = np.arange(min(first_age, ages[2 * pair]), ages[2 * pair] + 1)
+        pa = rng.integers(100, 651, len(season_ages)).astype(float)
+        curve = plateaus[group_of[positions[2 * pair]]] / still_to_come[np.clip(season_ages, AGES[0], AGES[-1]) - AGES[0]]
+        for player in (2 * pair, 2 * pair + 1):
+            rows['player_id'].append(np.full(len(season_ages), player))
+            rows['year'].append(season - (ages[player] - season_ages))
+            rows['level_id'].append(np.where(season_ages >= debut_age, cube.MLB, cube.MLB + 1))
+            rows['pa'].append(pa)
+            rows['ops_plus'].append(talent[player] * curve)
+    rows = {name: np.concatenate(values) for name, values in rows.items()}
+
+    # a batting line for each OPS+: OPS+ is linear in the hit rates at a fixed walk rate, so a base line's hit rates are scaled
+    base = {'bb': 0.08, 'k': 0.2, '1b': 0.15, '2b': 0.045, '3b': 0.005, 'hr': 0.03}
+    hits = ['1b', '2b', '3b', 'hr']
+    no_hits, base_ops_plus = model.batting_summary({rate: base[rate] * (np.array([0.0, 1.0]) if rate in hits else np.ones(2)) for rate in base},
+                                                   per_pa=True)['ops_plus']
+    scale = (rows['ops_plus'] - no_hits) / (base_ops_plus - no_hits)
+    counts = {stat: rows['pa'] * base[rate] * (scale if rate in hits else 1) for stat, rate in [('bb', 'bb'), ('k', 'k'), ('d', '2b'), ('t', '3b'), ('hr', 'hr')]}
+    counts['h'] = rows['pa'] * base['1b'] * scale + counts['d'] + counts['t'] + counts['hr']
+    batting_cube = {
+        'player_id': rows['player_id'], 'year': rows['year'], 'level_id': rows['level_id'],
+        'split_id': np.full(len(rows['pa']), cube.ALL_SPLITS), 'stat_pa': rows['pa'],
+        **{'stat_' + stat: values for stat, values in counts.items()},
+    }
+    return batting_cube, np.arange(players), ages, positions, season
+
+
+def check(growth, plateaus):
+    """
+    Fits a league simulated to follow growth and plateaus (see _simulated_league) and returns the largest difference from them
+    of the fitted growth and of the fitted plateaus - both should be close to 0, otherwise fit() measures OPS+ differently from
+    the curves it replaces.
+    """
+    curves = fit([sums(*_simulated_league(growth, plateaus))], growth, plateaus)
+    return (float(np.max(np.abs(curves['growth'] - growth))),
+            max(abs(curves['plateaus'][group] - plateaus[group]) for group in GROUP_POSITIONS))
+
+
+def _signature(batting_signature, player_ids, ages, positions, season, growth, plateaus):
+    # the career stats' signature (see cube.source_signature), the season and a digest of the players and the defaults
+    digest = hashlib.sha1()
+    for values in [player_ids, ages, positions]:
+        digest.update(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(growth, dtype=float).tobytes())
+    digest.update(np.array([plateaus[group] for group in GROUP_POSITIONS], dtype=float).tobytes())
+    return np.r_[batting_signature, season, int.from_bytes(digest.digest()[:8], 'little', signed=True)].astype(np.int64)
+
+
+def load_or_fit(batting_signature, batch_sums, player_ids, ages, positions, season, growth, plateaus):
+    """
+    Returns fit()'s curves, from reports/cubes/aging.npz if they were fitted from the same career stats (batting_signature, see
+    cube.source_signature), players, season and defaults, otherwise fitted and saved for next time. batch_sums yields the
+    sums() of each batch and is only run through when the curves are fitted, so it can load one batch's stats at a time.
+    A fit is checked (see check()) against the defaults when it is made, and the 'check' result saved with it.
+    """
+    signature = _signature(batting_signature, player_ids, ages, positions, season, growth, plateaus)
+    cached = _cache.get('fit')
+    if cached is not None and np.array_equal(cached['signature'], signature):
+        return cached
+    if os.path.exists(AGING_PATH):
+        with np.load(AGING_PATH) as data:
+            saved = {name: data[name] for name in data.files}
+        # a fit saved without its check is from before checks were saved, and is made again
+        if np.array_equal(saved['signature'], signature) and 'check' in saved:
+            curves = {
+                'signature': signature, 'growth': saved['growth'], 'growth_weight': saved['growth_weight'],
+                'plateaus': {group: float(saved['plateau_' + group]) for group in GROUP_POSITIONS},
+                'plateau_weights': {group: float(saved['plateau_weight_' + group]) for group in GROUP_POSITIONS},
+                'check': tuple(float(error) for error in saved['check']),
+            }
+            _cache['fit'] = curves
+            return curves
+
+    curves = fit(batch_sums, growth, plateaus)
+    curves['signature'] = signature
+    curves['check'] = check(growth, plateaus)
+    os.makedirs(cube.CUBE_DIR, exist_ok=True)
+    tmp_path = AGING_PATH + '.tmp.npz'
+    np.savez(tmp_path, signature=signature, growth=curves['growth'], growth_weight=curves['growth_weight'], check=np.array(curves['check']),
+             **{'plateau_' + group: value for group, value in curves['plateaus'].items()},
+             **{'plateau_weight_' + group: value for group, value in curves['plateau_weights'].items()})
+    os.replace(tmp_path, AGING_PATH)
+    _cache['fit'] = curves
+    return curves
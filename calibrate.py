@@ -0,0 +1,177 @@
+# refits the batting model's rating -> rate coefficients (model.RATE_PARTS) against the league's career MLB stats
+# every player with enough MLB plate appearances is one sample, weighted by their career pa; the rates are measured the way
+# model.batting_line applies them (hr% and k% per pa less walks, hits per ball in play), which is not how the *_mlb columns in
+# pistachio.py are measured, so they are worked out here from the raw counts
+# each rate's parts are fitted jointly by weighted least squares over one-hot segment columns, with a light ridge pull towards
+# the current coefficients so sparse segments (and the split of the intercept between parts) stay put, and each breakpoint is
+# searched over every whole rating between its neighbours with all the candidate fits solved as one batch
+#
+#   python calibrate.py --output config/rate_coefficients.json
+#
+# then set rate_coefficients = "config/rate_coefficients.json" in config/settings.toml to project with the new table
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import toml
+import model
+
+
+# career MLB plate appearances a player needs to be part of the fit
+MIN_PA = 300
+
+# strength of the pull towards the current coefficients, relative to each coefficient's share of the data
+RIDGE = 0.01
+
+# passes over the breakpoints (each pass re-searches every breakpoint with the others held fixed)
+BREAKPOINT_PASSES = 2
+
+# scouted batting ratings behind each of model.batting_inputs' arguments
+RATING_COLUMNS = {
+    'eye': 'batting_ratings_overall_eye',
+    'avoidk': 'batting_ratings_overall_strikeouts',
+    'power': 'batting_ratings_overall_power',
+    'gap': 'batting_ratings_overall_gap',
+    'babip': 'batting_ratings_overall_babip',
+}
+
+
+def load_sample(csv_path, scout_id, min_pa=MIN_PA):
+    """
+    Returns (inputs, targets, weights) for every player scouted by scout_id with at least min_pa career MLB plate appearances:
+    the model's named inputs (see model.batting_inputs), a dict of rate -> career rate, and the career pa of each player.
+    """
+    ratings = pd.read_csv(os.path.join(csv_path, 'players_scouted_ratings.csv'), usecols=['player_id', 'scouting_coach_id'] + list(RATING_COLUMNS.values()))
+    ratings = ratings[ratings['scouting_coach_id'] == scout_id].drop(columns='scouting_coach_id')
+    ratings[list(RATING_COLUMNS.values())] = ratings[list(RATING_COLUMNS.values())].replace(model.RATING_SCALE_MAP)
+
+    stats = pd.read_csv(os.path.join(csv_path, 'players_career_batting_stats.csv'), usecols=['player_id', 'level_id', 'split_id', 'pa', 'bb', 'k', 'h', 'd', 't', 'hr'])
+    stats = stats[(stats['level_id'] == 1) & (stats['split_id'] == 1)]
+    stats = stats.groupby('player_id')[['pa', 'bb', 'k', 'h', 'd', 't', 'hr']].sum().reset_index()
+    stats = stats[stats['pa'] >= min_pa]
+
+    sample = pd.merge(stats, ratings, on='player_id').dropna()
+    pa, bb, k, h, d, t, hr = (sample[column].to_numpy(float) for column in ['pa', 'bb', 'k', 'h', 'd', 't', 'hr'])
+    # same order of operations as model.batting_line: walks, then home runs and strikeouts, then hits on balls in play
+    with np.errstate(divide='ignore', invalid='ignore'):
+        targets = {
+            'bb': bb / pa,
+            'k': k / (pa - bb),
+            'hr': hr / (pa - bb),
+            '2b': d / (pa - bb - hr - k),
+            '3b': t / (pa - bb - hr - k),
+            '1b': (h - d - t - hr) / (pa - bb - hr - k - d - t),
+        }
+    inputs = model.batting_inputs(*(sample[RATING_COLUMNS[name]] for name in ['eye', 'avoidk', 'power', 'gap', 'babip']))
+    return inputs, targets, pa
+
+
+def _columns(inputs, rate_parts, bounds):
+    # design matrix over the one-hot segments of every part: (x, 1) for the segment a player's input falls in, 0 elsewhere
+    # bounds is a list (per part) of arrays of candidate bounds (candidates x segments-1), so this returns candidates x players x coefficients
+    blocks = []
+    for (name, offset, segments), part_bounds in zip(rate_parts, bounds):
+        x = inputs[name]
+        lower = -np.inf
+        for s in range(len(segments)):
+            upper = part_bounds[:, s][:, None] if s < len(segments) - 1 else np.inf
+            inside = ((x > lower) & (x <= upper)).astype(float)
+            inside = np.broadcast_to(inside, (len(part_bounds), len(x)))
+            blocks += [inside * x, inside]
+            lower = upper
+    return np.stack(blocks, axis=-1)
+
+
+def _coefficients(rate_parts):
+    return np.array([value for name, offset, segments in rate_parts for bound, slope, intercept in segments for value in (slope, intercept)])
+
+
+def _fit(design, target, weights, prior):
+    # batched weighted ridge regression towards prior; returns (coefficients, weighted sse) per candidate
+    gram = np.einsum('cnk,n,cnl->ckl', design, weights, design)
+    moment = np.einsum('cnk,n,n->ck', design, weights, target)
+    penalty = RIDGE * np.diagonal(gram, axis1=1, axis2=2) + 1e-9 * weights.sum()
+    gram = gram + penalty[:, :, None] * np.eye(design.shape[-1])
+    coefficients = np.linalg.solve(gram, (moment + penalty * prior)[:, :, None])[:, :, 0]
+    residual = target - np.einsum('cnk,ck->cn', design, coefficients)
+    return coefficients, (weights * residual ** 2).sum(axis=1)
+
+
+def _rebuild(rate_parts, coefficients, bounds):
+    values = iter(coefficients)
+    fitted = []
+    for (name, offset, segments), part_bounds in zip(rate_parts, bounds):
+        new_segments = []
+        for s in range(len(segments)):
+            bound = float(part_bounds[s]) if s < len(segments) - 1 else None
+            new_segments.append((bound, float(next(values)), float(next(values))))
+        fitted.append((name, offset, new_segments))
+    return fitted
+
+
+def fit_rate(inputs, target, weights, rate_parts):
+    """Returns the refitted parts of one rate (same inputs, offsets and number of segments as rate_parts)."""
+    # the parts' offsets are constants, so they move onto the target
+    target = target + sum(offset for name, offset, segments in rate_parts)
+    prior = _coefficients(rate_parts)
+    bounds = [np.array([bound for bound, slope, intercept in segments[:-1]], dtype=float) for name, offset, segments in rate_parts]
+
+    for _ in range(BREAKPOINT_PASSES):
+        for p, part_bounds in enumerate(bounds):
+            for s in range(len(part_bounds)):
+                # every whole rating strictly between the neighbouring breakpoints (or the ends of the scale)
+                low = part_bounds[s - 1] if s > 0 else 0
+                high = part_bounds[s + 1] if s < len(part_bounds) - 1 else model.STRIKEOUT_CAP if rate_parts[p][0] == 'avoidk_adjusted' else 250
+                candidates = np.arange(low + 1, high)
+                trial = [np.tile(b, (len(candidates), 1)) for b in bounds]
+                trial[p][:, s] = candidates
+                coefficients, sse = _fit(_columns(inputs, rate_parts, trial), target, weights, prior)
+                part_bounds[s] = candidates[np.argmin(sse)]
+
+    coefficients, sse = _fit(_columns(inputs, rate_parts, [b[None, :] for b in bounds]), target, weights, prior)
+    return _rebuild(rate_parts, coefficients[0], bounds)
+
+
+def calibrate(inputs, targets, weights, parts=model.RATE_PARTS):
+    """Returns a refitted coefficient table in the RATE_PARTS layout, one rate at a time over the players that have that rate."""
+    fitted = {}
+    for rate, rate_parts in parts.items():
+        valid = np.isfinite(targets[rate])
+        fitted[rate] = fit_rate({name: x[valid] for name, x in inputs.items()}, targets[rate][valid], weights[valid], rate_parts)
+    return fitted
+
+
+def rmse(inputs, targets, weights, parts):
+    """Returns the pa-weighted root mean squared error of each rate under a coefficient table."""
+    rates = model.batting_rates(*(inputs[name] for name in ['eye', 'avoidk', 'power', 'gap', 'babip']), parts=parts)
+    errors = {}
+    for rate, target in targets.items():
+        valid = np.isfinite(target)
+        errors[rate] = float(np.sqrt(np.average((rates[rate][valid] - target[valid]) ** 2, weights=weights[valid])))
+    return errors
+
+
+if __name__ == '__main__':
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, 'config', 'settings.toml')) as file:
+        settings = toml.load(file)['Settings']
+
+    parser = argparse.ArgumentParser(description='Refit the batting model coefficients against career MLB stats.')
+    parser.add_argument('--csv-path', default=settings['csv_path'])
+    parser.add_argument('--scout-id', type=int, default=settings['scout_id'])
+    parser.add_argument('--min-pa', type=int, default=MIN_PA)
+    parser.add_argument('--output', default=os.path.join('config', 'rate_coefficients.json'))
+    args = parser.parse_args()
+
+    inputs, targets, weights = load_sample(args.csv_path, args.scout_id, args.min_pa)
+    print(f"fitting {len(weights)} players with at least {args.min_pa} MLB pa")
+    fitted = calibrate(inputs, targets, weights)
+
+    before, after = rmse(inputs, targets, weights, model.RATE_PARTS), rmse(inputs, targets, weights, fitted)
+    for rate in fitted:
+        print(f"{rate:>3}  rmse {before[rate]:.4f} -> {after[rate]:.4f}")
+
+    output = os.path.join(base_dir, args.output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    model.save_rate_parts(fitted, output)
+    print(f"wrote {args.output}")
@@ -0,0 +1,108 @@
+# per-player row fingerprints for each published report version, so the UI can fetch only what changed since its last sync
+# every export is given a new version number and its fingerprints are kept in reports/changes for the last KEEP_VERSIONS exports
+import os
+import re
+import numpy as np
+import pandas as pd
+
+import snapshots
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHANGES_DIR = os.path.join(BASE_DIR, 'reports', 'changes')
+REPORT_FILES = {'batter': 'batter_sWAR.csv', 'pitcher': 'pitcher_sWAR.csv'}
+
+# number of past versions a client can sync from before it has to download the full report again
+KEEP_VERSIONS = 30
+
+
+def _path(version):
+    return os.path.join(CHANGES_DIR, f'v{version}.npz')
+
+
+def versions():
+    """Returns the retained versions, oldest first."""
+    if not os.path.isdir(CHANGES_DIR):
+        return []
+    found = (re.fullmatch(r'v(\d+)\.npz', name) for name in os.listdir(CHANGES_DIR))
+    return sorted(int(match.group(1)) for match in found if match)
+
+
+def latest_version():
+    retained = versions()
+    return retained[-1] if retained else 0
+
+
+def fingerprints(report):
+    """Returns a uint64 fingerprint of every row of a report, in row order."""
+    return pd.util.hash_pandas_object(report, index=False).to_numpy(dtype=np.uint64)
+
+
+def record(reports):
+    """
+    Records the fingerprints of a newly published set of reports (a dict of kind -> DataFrame keyed by player_id).
+    Returns the new version number.
+    """
+    # a version is never reused, even if reports/changes has been cleared, as the snapshot published under it is served as immutable
+    version = max([latest_version(), snapshots.latest_version(), *snapshots.versions()]) + 1
+    arrays = {}
+    for kind, report in reports.items():
+        arrays[kind + '_player_id'] = report['player_id'].to_numpy(dtype=np.int64)
+        arrays[kind + '_fingerprint'] = fingerprints(report)
+
+    os.makedirs(CHANGES_DIR, exist_ok=True)
+    tmp_path = _path(version) + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, _path(version))
+
+    for old in versions()[:-KEEP_VERSIONS]:
+        os.remove(_path(old))
+    return version
+
+
+def _load(version, kind):
+    with np.load(_path(version)) as data:
+        return data[kind + '_player_id'], data[kind + '_fingerprint']
+
+
+def _json_records(frame):
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def changes_since(kind, since):
+    """
+    Returns the rows of the current report that were added or changed since a version, and the player_ids removed.
+    If that version is no longer retained (or is 0) every row is returned as added and 'reset' is set.
+    The current report is the latest snapshot's (see snapshots.py), so it is always the one its fingerprints were recorded
+    from, even while a run is writing the next one - before the first snapshot, the reports folder is read.
+    """
+    version = snapshots.latest_version()
+    path = snapshots.path(version, kind) if version else None
+    if path is None:
+        version = latest_version()
+        path = os.path.join(BASE_DIR, 'reports', REPORT_FILES[kind])
+    result = {'version': version, 'since': since, 'reset': False, 'added': [], 'changed': [], 'removed': []}
+
+    if version == 0 or since == version:
+        return result
+    report = pd.read_csv(path)
+    retained = versions()
+    if since not in retained or version not in retained:
+        result['reset'] = True
+        result['added'] = _json_records(report)
+        return result
+
+    old_ids, old_fp = _load(since, kind)
+    new_ids, new_fp = _load(version, kind)
+
+    old_order = np.argsort(old_ids)
+    pos = np.clip(np.searchsorted(old_ids, new_ids, sorter=old_order), 0, max(len(old_ids) - 1, 0))
+    matched = old_order[pos] if len(old_ids) else pos
+    existed = (old_ids[matched] == new_ids) if len(old_ids) else np.zeros(len(new_ids), dtype=bool)
+
+    added = ~existed
+    changed = existed & (old_fp[matched] != new_fp)
+    result['added'] = _json_records(report[added])
+    result['changed'] = _json_records(report[changed])
+    result['removed'] = old_ids[~np.isin(old_ids, new_ids)].tolist()
+    return result
@@ -0,0 +1,124 @@
+# stats cube over the career stats exports (players_career_batting_stats.csv, players_career_pitching_stats.csv)
+# each export is scanned once into cells keyed by (player, year, level, split) - stints with the same key are summed - held
+# sorted by player as a handful of arrays, so career, single-season, rolling-window and per-level totals are a mask over the
+# cells and one segmented sum per stat, with no regrouping
+# the cube is saved beside the reports and reused until the export it was built from changes
+import os
+import numpy as np
+import pandas as pd
+
+
+CUBE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'cubes')
+
+# the columns that key a row rather than count something
+KEY_COLUMNS = ['player_id', 'year', 'level_id', 'split_id']
+NON_STATS = KEY_COLUMNS + ['team_id', 'league_id', 'sub_league_id']
+
+# OOTP's level and split ids, for reference: level 1 is MLB; split 1 is all pa, 2 vs LHP and 3 vs RHP
+MLB = 1
+ALL_SPLITS = 1
+
+# loaded cubes, checked against the file's modification time
+_cache = {}
+
+
+def build(path):
+    """Returns the stats cube of one career stats csv."""
+    frame = pd.read_csv(path)
+    stats = [column for column in frame.columns if column not in NON_STATS and pd.api.types.is_numeric_dtype(frame[column])]
+    keys = {column: frame[column].to_numpy(dtype=np.int64) for column in KEY_COLUMNS}
+
+    order = np.lexsort((keys['split_id'], keys['level_id'], keys['year'], keys['player_id']))
+    keys = {column: values[order] for column, values in keys.items()}
+    new_cell = np.ones(len(order), dtype=bool)
+    if len(order):
+        new_cell[1:] = np.any([values[1:] != values[:-1] for values in keys.values()], axis=0)
+    starts = np.flatnonzero(new_cell)
+
+    cube = {
+        'player_id': keys['player_id'][starts],
+        'year': keys['year'][starts].astype(np.int16),
+        'level_id': keys['level_id'][starts].astype(np.int8),
+        'split_id': keys['split_id'][starts].astype(np.int8),
+        'stats': np.array(stats, dtype=str),
+    }
+    for stat in stats:
+        values = frame[stat].to_numpy()[order]
+        # missing counts are taken as 0, as a groupby sum would
+        if np.issubdtype(values.dtype, np.floating):
+            values = np.where(np.isnan(values), 0, values)
+        cube['stat_' + stat] = np.add.reduceat(values, starts) if len(starts) else values[:0]
+    return cube
+
+
+def _cube_path(path):
+    return os.path.join(CUBE_DIR, os.path.splitext(os.path.basename(path))[0] + '.npz')
+
+
+def source_signature(path):
+    """Returns the signature a cube built from a career stats csv is saved with: the file's size and modification time."""
+    source = os.stat(path)
+    return np.array([source.st_size, source.st_mtime_ns], dtype=np.int64)
+
+
+def load_or_build(path, save=True):
+    """
+    Returns the stats cube of a career stats csv, from reports/cubes if it was saved from the same export (same size and
+    modification time), otherwise built and, if save, saved for next time.
+    """
+    signature = source_signature(path)
+    cube_path = _cube_path(path)
+
+    cached = _cache.get(cube_path)
+    if cached is not None and np.array_equal(cached['signature'], signature):
+        return cached
+    if save and os.path.exists(cube_path):
+        with np.load(cube_path) as data:
+            cube = {name: data[name] for name in data.files}
+        if np.array_equal(cube['signature'], signature):
+            _cache[cube_path] = cube
+            return cube
+
+    cube = build(path)
+    cube['signature'] = signature
+    if save:
+        os.makedirs(CUBE_DIR, exist_ok=True)
+        tmp_path = cube_path + '.tmp.npz'
+        np.savez(tmp_path, **cube)
+        os.replace(tmp_path, cube_path)
+        _cache[cube_path] = cube
+    return cube
+
+
+def _selected(cube, level, split, years):
+    selected = np.ones(len(cube['player_id']), dtype=bool)
+    if level is not None:
+        selected &= np.isin(cube['level_id'], np.atleast_1d(level))
+    if split is not None:
+        selected &= np.isin(cube['split_id'], np.atleast_1d(split))
+    if years is not None:
+        first, last = years if isinstance(years, tuple) else (years, years)
+        selected &= (cube['year'] >= first) & (cube['year'] <= last)
+    return selected
+
+
+def latest_year(cube, level=MLB, split=ALL_SPLITS):
+    """Returns the latest year with stats at a level and split (None levels or splits take them all), or NaN if there are none."""
+    years = cube['year'][_selected(cube, level, split, None)]
+    return int(years.max()) if len(years) else np.nan
+
+
+def totals(cube, stats, level=MLB, split=ALL_SPLITS, years=None):
+    """
+    Returns a DataFrame of player_id and the summed stats of every player with stats in the slice, sorted by player_id.
+    level and split are an id or a list of ids (None for all); years is None for the career, a year, or a (first, last)
+    range of years, eg (2023, 2025) for a three-year rolling window.
+    """
+    selected = _selected(cube, level, split, years)
+    player_ids = cube['player_id'][selected]
+    starts = np.flatnonzero(np.r_[True, player_ids[1:] != player_ids[:-1]]) if len(player_ids) else np.empty(0, dtype=np.int64)
+    result = {'player_id': player_ids[starts]}
+    for stat in stats:
+        values = cube['stat_' + stat][selected]
+        result[stat] = np.add.reduceat(values, starts) if len(starts) else values[:0]
+    return pd.DataFrame(result)
@@ -0,0 +1,86 @@
+# writers for the files pistachio.py publishes in the 'reports' folder
+# every file is written to a temp file next to its destination, fsynced and then renamed into place,
+# so the Flask server (or anything else reading the folder) only ever sees a complete report
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pa_parquet
+
+
+def _arrow_table(frame):
+    # object columns can mix numbers and blanks (eg ip, HR_mlb) - write those as numbers with blanks left empty, anything else as strings
+    columns = {}
+    for column in frame.columns[frame.dtypes == object]:
+        values = frame[column].replace('', None)
+        numbers = pd.to_numeric(values, errors='coerce')
+        columns[column] = numbers if numbers.notna().sum() == values.notna().sum() else frame[column].astype('string')
+    return pa.Table.from_pandas(frame.assign(**columns), preserve_index=False)
+
+
+def _csv_text(series):
+    # a column as DataFrame.to_csv writes it, as Arrow strings with nulls for blanks: Arrow formats numbers (much faster than the
+    # numpy formatting to_csv does), fixed up to match - floats keep a trailing .0 and very large or small ones numpy's notation
+    kind = series.dtype.kind
+    if kind == 'f':
+        values = series.to_numpy(na_value=np.nan)
+        text = pc.cast(pa.array(values, from_pandas=True), pa.string())
+        with np.errstate(invalid='ignore'):
+            plain = ((np.abs(values) >= 1e-4) & (np.abs(values) < 1e10)) | (values == 0)
+        text = pc.if_else(plain & (values == np.floor(values)), pc.binary_join_element_wise(text, '.0', ''), text)
+        other = ~plain & ~np.isnan(values)
+        return pc.replace_with_mask(text, other, pa.array(values[other].astype(str))) if other.any() else text
+    if kind in 'iu':
+        return pc.cast(pa.array(series, from_pandas=True), pa.string())
+    text = pa.array(np.where(series.isna().to_numpy(), '', series.to_numpy(dtype=object).astype(str)))
+    needs_quotes = pc.match_substring_regex(text, '[,"\r\n]')
+    return pc.if_else(needs_quotes, pc.binary_join_element_wise('"', pc.replace_substring(text, '"', '""'), '"', ''), text)
+
+
+def csv_bytes(frame):
+    """
+    Returns a DataFrame as csv, byte for byte what frame.to_csv(index=False) returns, for serving straight from memory.
+    Frames with columns Arrow isn't used for (float32, dates and the like) and single-column frames (a blank row is written as "")
+    go through to_csv itself.
+    """
+    if len(frame.columns) < 2 or any(series.dtype.kind not in 'fiubO' or series.dtype == np.float32 for _, series in frame.items()):
+        return frame.to_csv(index=False).encode()
+    header = [str(name) for name in frame.columns]
+    header = ['"' + name.replace('"', '""') + '"' if re.search('[,"\r\n]', name) else name for name in header]
+    lines = [','.join(header)]
+    if len(frame):
+        columns = [_csv_text(series) for _, series in frame.items()]
+        lines += pc.binary_join_element_wise(*columns, ',', null_handling='replace', null_replacement='').to_pylist()
+    return (os.linesep.join(lines) + os.linesep).encode()
+
+
+def _replace(tmp_path, path):
+    with open(tmp_path, 'r+b') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_csv(frame, path):
+    """Writes a DataFrame to csv in DataFrame.to_csv's format, atomically replacing path."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(csv_bytes(frame))
+    _replace(tmp_path, path)
+
+
+def write_reports(reports):
+    """Writes a dict of path -> DataFrame as csv files in parallel, each one atomically."""
+    with ThreadPoolExecutor(max_workers=len(reports)) as pool:
+        for future in [pool.submit(write_csv, frame, path) for path, frame in reports.items()]:
+            future.result()
+
+
+def write_parquet(frame, path):
+    """Writes a DataFrame as zstd-compressed parquet, atomically replacing path."""
+    tmp_path = path + '.tmp'
+    pa_parquet.write_table(_arrow_table(frame), tmp_path, compression='zstd')
+    _replace(tmp_path, path)
@@ -0,0 +1,134 @@
+# append-only history of the projections published by each run of pistachio.py
+# each report kind is stored as one compressed .npz of columns sorted by (player_id, date), holding only the rows that changed
+# since that player's previous entry, so a player's trajectory is a contiguous slice found with a binary search
+import os
+import numpy as np
+
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'history')
+
+# report columns tracked for each kind of report
+COLUMNS = {
+    'batter': ['best', 'bestP', 'OPS+', 'OPS+_p', 'Tpct', 'toWAR', 'toWARP'],
+    'pitcher': ['sp', 'rp', 'spP', 'rpP', 'FIP', 'FIP_pot'],
+}
+
+# loaded stores, keyed by kind and checked against the file's modification time
+_cache = {}
+
+
+def _path(kind):
+    return os.path.join(HISTORY_DIR, kind + '.npz')
+
+
+def load(kind):
+    """Returns the stored history for a report kind as a dict of column arrays (empty if nothing has been recorded yet)."""
+    path = _path(kind)
+    if not os.path.exists(path):
+        return _empty(kind)
+
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(kind)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with np.load(path) as data:
+        store = {name: data[name] for name in data.files}
+    _cache[kind] = (mtime, store)
+    return store
+
+
+def _empty(kind):
+    store = {
+        'player_id': np.empty(0, dtype=np.int64),
+        'date': np.empty(0, dtype='datetime64[D]'),
+        'club': np.empty(0, dtype='U8'),
+        'club_order': np.empty(0, dtype=np.int64),
+    }
+    for column in COLUMNS[kind]:
+        store[column] = np.empty(0, dtype=np.float32)
+    return store
+
+
+def _same(a, b):
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def append(kind, report, date):
+    """
+    Appends a published report to the history of its kind, keyed by player_id and in-game date.
+    Only players that are new or whose club or tracked values changed since their last entry are stored.
+    Re-running on the same in-game date replaces that date's entries.
+    Returns the number of rows written.
+    """
+    columns = COLUMNS[kind]
+    date = np.datetime64(date, 'D')
+    store = load(kind)
+
+    # a re-run on the same in-game date supersedes the earlier one
+    keep = store['date'] != date
+    store = {name: values[keep] for name, values in store.items() if name != 'club_order'}
+
+    new = {
+        'player_id': report['player_id'].to_numpy(dtype=np.int64),
+        'club': report['club'].fillna('').to_numpy(dtype='U8'),
+    }
+    for column in columns:
+        new[column] = report[column].to_numpy(dtype=np.float32)
+    new['date'] = np.full(len(report), date)
+
+    # latest stored entry for each player is the last row of their (player_id, date) sorted run
+    pids = store['player_id']
+    is_last = np.r_[pids[1:] != pids[:-1], True] if len(pids) else np.empty(0, dtype=bool)
+    latest = np.flatnonzero(is_last)
+    latest_pids = pids[latest]
+
+    pos = np.clip(np.searchsorted(latest_pids, new['player_id']), 0, max(len(latest_pids) - 1, 0))
+    changed = np.ones(len(report), dtype=bool)
+    if len(latest):
+        row = latest[pos]
+        unchanged = (latest_pids[pos] == new['player_id']) & (store['club'][row] == new['club'])
+        for column in columns:
+            unchanged &= _same(store[column][row], new[column])
+        changed = ~unchanged
+
+    merged = {name: np.concatenate([store[name], new[name][changed]]) for name in store}
+    order = np.lexsort((merged['date'], merged['player_id']))
+    merged = {name: values[order] for name, values in merged.items()}
+    # secondary index so a club's trajectory is also a contiguous slice
+    merged['club_order'] = np.lexsort((merged['date'], merged['player_id'], merged['club']))
+
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    tmp_path = _path(kind) + '.tmp.npz'
+    np.savez_compressed(tmp_path, **merged)
+    os.replace(tmp_path, _path(kind))
+    _cache[kind] = (os.path.getmtime(_path(kind)), merged)
+    return int(changed.sum())
+
+
+def _records(store, kind, rows):
+    records = []
+    for i in rows:
+        record = {'player_id': int(store['player_id'][i]), 'date': str(store['date'][i]), 'club': str(store['club'][i])}
+        for column in COLUMNS[kind]:
+            value = float(store[column][i])
+            record[column] = None if np.isnan(value) else round(value, 3)
+        records.append(record)
+    return records
+
+
+def player_trajectory(kind, player_id):
+    """Returns one player's history entries in date order, as a list of dicts."""
+    store = load(kind)
+    pids = store['player_id']
+    start, stop = np.searchsorted(pids, player_id, 'left'), np.searchsorted(pids, player_id, 'right')
+    return _records(store, kind, range(start, stop))
+
+
+def club_trajectory(kind, club):
+    """Returns the history entries recorded for a club's players, ordered by player and date."""
+    store = load(kind)
+    order = store['club_order']
+    clubs = store['club'][order]
+    start, stop = np.searchsorted(clubs, club, 'left'), np.searchsorted(clubs, club, 'right')
+    return _records(store, kind, order[start:stop])
@@ -0,0 +1,131 @@
+# out-of-core ingest for chunked runs of pistachio.py (chunk_size in settings.toml), for leagues too big to hold in memory
+# the csv exports pistachio.py reads per player are streamed once and split by player_id into batches on disk; each batch is a
+# folder laid out like the game's import_export/csv folder holding just its players' rows, so pistachio.py projects a batch by
+# reading its folder exactly as it reads the full export
+# rows the projection never uses (retired players, other scouts' ratings, minor league and split stats) are dropped on the way,
+# apart from the copies a fitted_aging run keeps for its fit (AGING_FILES)
+import csv
+import math
+import os
+import shutil
+import tempfile
+
+
+# the files split into batches, and the rows of each that pistachio.py keeps (see its read cells): a list of (column, value,
+# whether the row must equal it), where a value of None stands for the scouting coach id
+BATCH_FILES = {
+    'players.csv': [('retired', 1, False)],
+    'players_scouted_ratings.csv': [('scouting_coach_id', None, True)],
+    'players_career_batting_stats.csv': [('level_id', 1, True), ('split_id', 1, True)],
+    'players_career_pitching_stats.csv': [('level_id', 1, True), ('split_id', 1, True)],
+}
+
+# the single-season stats come from the league's latest year, which a batch can't see on its own
+SEASON_FILES = {'batting': 'players_career_batting_stats.csv', 'pitching': 'players_career_pitching_stats.csv'}
+
+# the files split for a fitted_aging run (see aging.py), which is fitted batch by batch from every player's seasons at every
+# level: {batch file: (league file, rows kept)}
+AGING_FILES = {
+    'aging_players.csv': ('players.csv', []),
+    'aging_batting_stats.csv': ('players_career_batting_stats.csv', [('split_id', 1, True)]),
+}
+
+# small files every batch folder gets a copy of
+SHARED_FILES = ['leagues.csv']
+
+# rows held per batch before they are appended to its file
+FLUSH_ROWS = 10000
+
+
+def _equals(value, number):
+    try:
+        return float(value) == float(number)
+    except ValueError:
+        return False
+
+
+def _count_rows(path):
+    with open(path, 'rb') as file:
+        return sum(block.count(b'\n') for block in iter(lambda: file.read(1 << 20), b'')) - 1
+
+
+def _split(source, paths, conditions):
+    # streams one csv into the batch files by player_id, returning the latest year seen in the kept rows (if it has a year)
+    buffers = [[] for _ in paths]
+    pending = 0
+    latest_year = None
+
+    def flush():
+        for path, rows in zip(paths, buffers):
+            if rows:
+                with open(path, 'a', newline='', encoding='utf-8') as file:
+                    csv.writer(file).writerows(rows)
+                rows.clear()
+
+    with open(source, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        for path in paths:
+            with open(path, 'w', newline='', encoding='utf-8') as out:
+                csv.writer(out).writerow(header)
+        columns = {name: i for i, name in enumerate(header)}
+        player_column, year_column = columns['player_id'], columns.get('year')
+        conditions = [(columns[name], value, equal) for name, value, equal in conditions]
+
+        for values in reader:
+            if not values or not all(_equals(values[i], value) == equal for i, value, equal in conditions):
+                continue
+            buffers[int(float(values[player_column])) % len(paths)].append(values)
+            if year_column is not None:
+                year = int(float(values[year_column]))
+                latest_year = year if latest_year is None else max(latest_year, year)
+            pending += 1
+            if pending >= FLUSH_ROWS * len(paths):
+                flush()
+                pending = 0
+    flush()
+    return latest_year
+
+
+def partition(csv_path, chunk_size, scout_id, aging=False):
+    """
+    Splits the league's csv exports into batches of about chunk_size players (by player_id) in a temporary folder, with the
+    AGING_FILES as well if aging. Returns a list of batches, each a dict with the 'path' of its csv folder, the league's
+    'max_year' of 'batting' and 'pitching' stats and the 'folders' of every batch; batches with no players are left out (but
+    not from 'folders'). remove() deletes the folder.
+    """
+    n_batches = max(1, math.ceil(_count_rows(os.path.join(csv_path, 'players.csv')) / chunk_size))
+    root = tempfile.mkdtemp(prefix='pistachio-batches-')
+    folders = [os.path.join(root, str(i)) for i in range(n_batches)]
+    for folder in folders:
+        os.makedirs(folder)
+        for name in SHARED_FILES:
+            if os.path.exists(os.path.join(csv_path, name)):
+                shutil.copy(os.path.join(csv_path, name), folder)
+
+    max_year = {}
+    for name, conditions in BATCH_FILES.items():
+        conditions = [(column, scout_id if value is None else value, equal) for column, value, equal in conditions]
+        latest_year = _split(os.path.join(csv_path, name), [os.path.join(folder, name) for folder in folders], conditions)
+        for kind, season_file in SEASON_FILES.items():
+            if season_file == name:
+                max_year[kind] = latest_year
+    if aging:
+        for name, (source, conditions) in AGING_FILES.items():
+            _split(os.path.join(csv_path, source), [os.path.join(folder, name) for folder in folders], conditions)
+
+    batches = []
+    for folder in folders:
+        # a batch needs both players and their scouted ratings to project anyone
+        if all(_count_rows(os.path.join(folder, name)) > 0 for name in ['players.csv', 'players_scouted_ratings.csv']):
+            batches.append({'path': folder, 'root': root, 'folders': folders, 'max_year': max_year})
+    if not batches:
+        shutil.rmtree(root)
+        raise ValueError('No scouted players to project in ' + csv_path)
+    return batches
+
+
+def remove(batches):
+    """Deletes the temporary folder written by partition()."""
+    if batches:
+        shutil.rmtree(batches[0]['root'], ignore_errors=True)
@@ -0,0 +1,89 @@
+# player_id joins for pistachio.py
+# merged_df's player_ids are sorted once into an index, and every side table (career and season stats) is aligned onto it
+# with one searchsorted and one gather per column, so adding a table's columns costs the same however wide merged_df is
+# small code tables (eg organization_id -> club) are looked up directly by code
+import numpy as np
+import pandas as pd
+
+
+# codes up to this are looked up through a directly addressed array rather than a search
+MAX_DIRECT_CODE = 1 << 20
+
+
+def index(keys):
+    """Returns the join index of a frame's key column (the sort order of its keys, and the keys in that order)."""
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    return {'order': order, 'sorted': keys[order], 'size': len(keys)}
+
+
+def _check_unique(table_keys, name):
+    sorted_keys = np.sort(table_keys)
+    if len(sorted_keys) and (sorted_keys[1:] == sorted_keys[:-1]).any():
+        raise ValueError(f'{name} has more than one row for some keys')
+
+
+def align(key_index, table_keys):
+    """Returns, for every row of the indexed frame, the row of table_keys with the same key (-1 where there is none)."""
+    table_keys = np.asarray(table_keys)
+    _check_unique(table_keys, 'The side table')
+    rows = np.full(key_index['size'], -1, dtype=np.int64)
+    if not key_index['size']:
+        return rows
+    sorted_keys = key_index['sorted']
+    start = np.searchsorted(sorted_keys, table_keys, 'left')
+    stop = np.searchsorted(sorted_keys, table_keys, 'right')
+    # a table row goes to every frame row holding its key (keys are unique in the table, not necessarily in the frame)
+    counts = stop - start
+    table_rows = np.repeat(np.arange(len(table_keys)), counts)
+    positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    rows[key_index['order'][positions]] = table_rows
+    return rows
+
+
+def take(values, rows):
+    """Gathers values at rows, with -1 giving a missing value - ints become floats only if something is missing, as in pd.merge."""
+    return pd.api.extensions.take(np.asarray(values), rows, allow_fill=True)
+
+
+def left(frame, key_index, table, key='player_id'):
+    """Adds table's columns (other than key) to frame in place, aligned by key as a left join would; returns frame."""
+    rows = align(key_index, table[key].to_numpy())
+    for column in table.columns:
+        if column != key:
+            frame[column] = take(table[column].to_numpy(), rows)
+    return frame
+
+
+def inner(frame, table, key='player_id', suffix='_y'):
+    """
+    Returns the rows of frame that have a key in table, in frame's order, with table's columns alongside.
+    Where both have a column, frame's keeps its name and table's gets the suffix.
+    """
+    rows = align(index(frame[key].to_numpy()), table[key].to_numpy())
+    kept = rows >= 0
+    rows = rows[kept]
+    joined = frame[kept].reset_index(drop=True)
+    columns = {}
+    for column in table.columns:
+        if column != key:
+            columns[column + suffix if column in frame.columns else column] = table[column].to_numpy()[rows]
+    return pd.concat([joined, pd.DataFrame(columns)], axis=1)
+
+
+def lookup(codes, table_codes, values):
+    """Returns the value for each code from a small code table (eg organization_id -> club), missing where a code isn't in it."""
+    codes = np.asarray(codes)
+    table_codes = np.asarray(table_codes)
+    _check_unique(table_codes, 'The code table')
+    if len(table_codes) and np.issubdtype(table_codes.dtype, np.integer) and 0 <= table_codes.min() and table_codes.max() < MAX_DIRECT_CODE:
+        # direct addressing: row of each code, -1 for codes not in the table (including missing and out of range codes)
+        table_rows = np.full(int(table_codes.max()) + 1, -1, dtype=np.int64)
+        table_rows[table_codes] = np.arange(len(table_codes))
+        valid = ~pd.isna(codes)
+        valid[valid] = (codes[valid] >= 0) & (codes[valid] < len(table_rows)) & (codes[valid] == np.floor(codes[valid].astype(float)))
+        rows = np.full(len(codes), -1, dtype=np.int64)
+        rows[valid] = table_rows[codes[valid].astype(np.int64)]
+    else:
+        rows = align(index(codes), table_codes)
+    return take(values, rows)
@@ -0,0 +1,93 @@
+# league-wide top-K leaderboards over the published reports
+# every ranked column is sorted once when pistachio.py exports, and the orders are saved to reports/leaderboards.npz with the
+# few columns the leaderboards can be filtered on, so a query is a boolean mask over the rows walked in pre-sorted order
+# the orders are full sorts rather than partial top-K ones (np.argpartition): a club, minor or age filter can leave out any
+# number of the leaders, so the top K of a filtered query can come from anywhere in the order - and a full sort of a report is
+# a few milliseconds once per export
+import os
+import numpy as np
+
+
+LEADERBOARDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'leaderboards.npz')
+
+# report columns that can be ranked, for each kind of report
+METRICS = {
+    'batter': ['best', 'bestP', 'c', '1b', '2b', '3b', 'ss', 'lf', 'cf', 'rf', 'dh',
+               'cP', '1bP', '2bP', '3bP', 'ssP', 'lfP', 'cfP', 'rfP', 'dhP', 'OPS+_p', 'Pscore'],
+    'pitcher': ['sp', 'rp', 'spP', 'rpP'],
+}
+
+# report columns kept alongside the orders for filtering
+FILTER_COLUMNS = ['minor', 'age', 'club']
+
+DEFAULT_LIMIT = 50
+
+# loaded index, checked against the file it was loaded from and its modification time
+_cache = {}
+
+
+def _descending(values):
+    # stable order, highest first, leaving out missing values
+    values = np.asarray(values, dtype=float)
+    rows = np.flatnonzero(~np.isnan(values))
+    return rows[np.argsort(-values[rows], kind='stable')].astype(np.int32)
+
+
+def build(reports, version):
+    """
+    Returns the leaderboard index for a set of reports (a dict of kind -> DataFrame), tagged with the report version.
+    Each metric's order holds the report's row positions sorted by that column, highest first, without the rows missing it.
+    """
+    index = {'version': np.int64(version)}
+    for kind, report in reports.items():
+        index[kind + '_minor'] = report['minor'].to_numpy(dtype=np.int8)
+        index[kind + '_age'] = report['age'].to_numpy(dtype=float)
+        index[kind + '_club'] = report['club'].fillna('').to_numpy(dtype=str)
+        for metric in METRICS[kind]:
+            index[kind + '_order_' + metric] = _descending(report[metric])
+    return index
+
+
+def save(index):
+    """Saves a leaderboard index to reports/leaderboards.npz, atomically replacing the previous one."""
+    os.makedirs(os.path.dirname(LEADERBOARDS_PATH), exist_ok=True)
+    tmp_path = LEADERBOARDS_PATH + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, LEADERBOARDS_PATH)
+    _cache['index'] = (LEADERBOARDS_PATH, os.path.getmtime(LEADERBOARDS_PATH), index)
+
+
+def load(path=LEADERBOARDS_PATH):
+    """Returns the saved leaderboard index, or None if pistachio.py hasn't exported one yet."""
+    if not os.path.exists(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    cached = _cache.get('index')
+    if cached is not None and cached[:2] == (path, mtime):
+        return cached[2]
+
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    _cache['index'] = (path, mtime, index)
+    return index
+
+
+def top(index, kind, metric, limit=DEFAULT_LIMIT, minor=None, club=None, min_age=None, max_age=None):
+    """
+    Returns the report row positions of the top players by a metric, best first.
+    minor (0 or 1), club and the age range filter the candidates; players with no value for the metric are left out.
+    """
+    order = index[kind + '_order_' + metric]
+    selected = np.ones(len(index[kind + '_minor']), dtype=bool)
+    if minor is not None:
+        selected &= index[kind + '_minor'] == minor
+    if club is not None:
+        selected &= index[kind + '_club'] == club
+    if min_age is not None:
+        selected &= index[kind + '_age'] >= min_age
+    if max_age is not None:
+        selected &= index[kind + '_age'] <= max_age
+
+    rows = order[selected[order]]
+    return rows[:limit]
@@ -0,0 +1,137 @@
+# best possible lineup, rotation and bullpen for every club, from the positional sWAR columns of the published reports
+# the lineup is an exact assignment: a dynamic programme over which of the 9 lineup slots are filled (2^9 states),
+# run for all clubs at once with each club's candidates as a padded row of the same arrays
+import numpy as np
+
+
+LINEUP_POSITIONS = ['c', '1b', '2b', '3b', 'ss', 'lf', 'cf', 'rf', 'dh']
+FULL_LINEUP = (1 << len(LINEUP_POSITIONS)) - 1
+
+# any optimal lineup only uses, at each position, one of the club's top 9 players there
+CANDIDATES_PER_POSITION = len(LINEUP_POSITIONS)
+
+
+def _rank_within(groups, values):
+    """Returns each row's 0-based rank by descending value within its group."""
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    starts = np.r_[0, np.flatnonzero(sorted_groups[1:] != sorted_groups[:-1]) + 1]
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - group_start
+    return ranks
+
+
+def assign_lineups(clubs, values, n_clubs):
+    """
+    Solves the lineup assignment for every club at once.
+    clubs is an int code (0..n_clubs-1) per player and values a players x 9 array of sWAR by LINEUP_POSITIONS.
+    Returns (totals, slots): the best lineup sWAR per club and a n_clubs x 9 array of the player row chosen per slot (-1 if unfilled).
+    """
+    values = np.where(np.isnan(values), -np.inf, values)
+
+    candidate = np.zeros(len(clubs), dtype=bool)
+    for p in range(len(LINEUP_POSITIONS)):
+        candidate |= _rank_within(clubs, values[:, p]) < CANDIDATES_PER_POSITION
+    rows = np.flatnonzero(candidate)
+    rows = rows[np.argsort(clubs[rows], kind='stable')]
+
+    # padded candidate x position x club weights - clubs are the innermost axis so every update below is one contiguous block
+    cand_clubs = clubs[rows]
+    cand_rank = _rank_within(cand_clubs, np.zeros(len(rows)))
+    width = int(cand_rank.max()) + 1 if len(rows) else 0
+    weights = np.full((width, len(LINEUP_POSITIONS), n_clubs), -np.inf)
+    weights[cand_rank, :, cand_clubs] = values[rows]
+    players = np.full((width, n_clubs), -1)
+    players[cand_rank, cand_clubs] = rows
+
+    # viewing the states as (high bits, bit p, low bits) splits them into pairs without and with slot p filled
+    def by_slot(array, p):
+        return array.reshape(1 << (len(LINEUP_POSITIONS) - 1 - p), 2, 1 << p, n_clubs)
+
+    best = np.full((FULL_LINEUP + 1, n_clubs), -np.inf)
+    best[0] = 0
+    choices = np.full((width, FULL_LINEUP + 1, n_clubs), -1, dtype=np.int8)
+    for i in range(width):
+        new = best.copy()
+        for p in range(len(LINEUP_POSITIONS)):
+            candidate_total = by_slot(best, p)[:, 0] + weights[i, p]
+            filled = by_slot(new, p)[:, 1]
+            better = candidate_total > filled
+            np.copyto(filled, candidate_total, where=better)
+            np.copyto(by_slot(choices[i], p)[:, 1], p, where=better)
+        best = new
+
+    # prefer the fullest lineup a club can field, then the highest total
+    states = np.arange(FULL_LINEUP + 1)
+    popcount = np.array([bin(state).count('1') for state in states])
+    finite = np.isfinite(best)
+    key = np.where(finite, popcount[:, None] * 1e6 + np.where(finite, best, 0), -np.inf)
+    club_idx = np.arange(n_clubs)
+    state = key.argmax(axis=0)
+    totals = best[state, club_idx]
+
+    slots = np.full((n_clubs, len(LINEUP_POSITIONS)), -1)
+    for i in range(width - 1, -1, -1):
+        p = choices[i][state, club_idx]
+        chosen = p >= 0
+        slots[club_idx[chosen], p[chosen]] = players[i, club_idx[chosen]]
+        state[chosen] ^= 1 << p[chosen].astype(np.int64)
+    return totals, slots
+
+
+def top_per_club(clubs, values, eligible, size):
+    """Returns a boolean mask of the size highest-valued eligible rows within each club."""
+    ranked = np.where(eligible, values, -np.inf)
+    return eligible & (_rank_within(clubs, ranked) < size)
+
+
+def best_rosters(batters, pitchers, potential=False, rotation_size=5, bullpen_size=8):
+    """
+    Returns the best lineup, rotation and bullpen for every club in the reports, as a list of dicts ordered by total sWAR.
+    potential=True uses the potential columns (cP..dhP, spP, rpP). Pitchers picked for the staff are left out of the lineup.
+    """
+    suffix = 'P' if potential else ''
+    sp, rp = 'sp' + suffix, 'rp' + suffix
+
+    club_names = np.unique(np.concatenate([batters['club'].dropna().to_numpy(str), pitchers['club'].dropna().to_numpy(str)]))
+    pitchers = pitchers[pitchers['club'].notna()]
+    pitcher_clubs = np.searchsorted(club_names, pitchers['club'].to_numpy(str))
+
+    rotation = top_per_club(pitcher_clubs, pitchers[sp].to_numpy(float), pitchers[sp].to_numpy(float) != 0, rotation_size)
+    relievers = (pitchers[rp].to_numpy(float) != 0) & ~rotation
+    bullpen = top_per_club(pitcher_clubs, pitchers[rp].to_numpy(float), relievers, bullpen_size)
+    staff_ids = pitchers['player_id'].to_numpy()[rotation | bullpen]
+
+    batters = batters[batters['club'].notna() & ~batters['player_id'].isin(staff_ids)]
+    batter_clubs = np.searchsorted(club_names, batters['club'].to_numpy(str))
+    values = batters[[pos + suffix for pos in LINEUP_POSITIONS]].to_numpy(float)
+    totals, slots = assign_lineups(batter_clubs, values, len(club_names))
+
+    names, ids = batters['name'].to_numpy(), batters['player_id'].to_numpy()
+    p_names, p_ids = pitchers['name'].to_numpy(), pitchers['player_id'].to_numpy()
+    rosters = []
+    for c, club in enumerate(club_names):
+        lineup = {}
+        for p, pos in enumerate(LINEUP_POSITIONS):
+            row = slots[c, p]
+            if row >= 0:
+                lineup[pos] = {'player_id': int(ids[row]), 'name': names[row], 'sWAR': round(float(values[row, p]), 2)}
+        staff = {}
+        for role, chosen, column in (('rotation', rotation, sp), ('bullpen', bullpen, rp)):
+            rows = np.flatnonzero(chosen & (pitcher_clubs == c))
+            rows = rows[np.argsort(-pitchers[column].to_numpy(float)[rows])]
+            staff[role] = [{'player_id': int(p_ids[row]), 'name': p_names[row], 'sWAR': round(float(pitchers[column].iloc[row]), 2)} for row in rows]
+        lineup_total = float(totals[c]) if np.isfinite(totals[c]) else 0.0
+        rotation_total = sum(p['sWAR'] for p in staff['rotation'])
+        bullpen_total = sum(p['sWAR'] for p in staff['bullpen'])
+        rosters.append({
+            'club': str(club),
+            'lineup_sWAR': round(lineup_total, 2),
+            'rotation_sWAR': round(rotation_total, 2),
+            'bullpen_sWAR': round(bullpen_total, 2),
+            'total_sWAR': round(lineup_total + rotation_total + bullpen_total, 2),
+            'lineup': lineup,
+            **staff
+        })
+    return sorted(rosters, key=lambda roster: -roster['total_sWAR'])
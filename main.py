@@ -1,121 +1,489 @@
-from flask import Flask, jsonify, send_from_directory, request
+import time
+STARTED = time.perf_counter()
+
+from flask import Flask, jsonify, redirect, send_from_directory, request
 from flask_cors import CORS
+from werkzeug.serving import make_server
+import copy
+import hashlib
+import importlib
+import mimetypes
+import runpy
 import subprocess
+import threading
 import toml
 import os
 
 app = Flask(__name__)
 CORS(app)
 
+# heavy modules (pandas, numpy, pyarrow and the projection helpers) are imported by a background warm-up thread
+# once the server is listening, so /health answers straight away and the first run doesn't pay the import cost
+WARM_UP_MODULES = ['numpy', 'pandas', 'pyarrow', 'pyarrow.csv', 'pyarrow.parquet', 'model', 'history', 'ingest', 'joins', 'cube', 'changes', 'export', 'lineups', 'leaderboards', 'search', 'roles', 'aging', 'snapshots', 'similar', 'uncertainty', 'whatif']
+warm_up = {'state': 'pending', 'serving_seconds': None, 'warm_up_seconds': None, 'error': None}
+
+# the config version is bumped on every config write (see write_config); each run is handed the cached settings and their
+# version, and records the version once it has finished, so /health can say whether the reports were projected from the
+# current config
+pipeline = {'config_version': 0, 'run_config_version': None}
+
+# one run at a time: runs share the reports folder and the report version counter (see changes.py), so a second /runNotebook
+# while one is in progress is turned away rather than left to publish over it
+run_lock = threading.Lock()
+
+
+def run_warm_up():
+    warm_up['state'] = 'warming'
+    try:
+        for module in WARM_UP_MODULES:
+            importlib.import_module(module)
+        for name in CONFIG_FILES:
+            if os.path.exists(config_path(name)):
+                read_config(name)
+        warm_up['state'] = 'ready'
+    except Exception as e:
+        warm_up['state'] = 'failed'
+        warm_up['error'] = str(e)
+    warm_up['warm_up_seconds'] = round(time.perf_counter() - STARTED, 3)
+    print(f"Warm-up {warm_up['state']} after {warm_up['warm_up_seconds']}s")
+    log_startup_times()
+
+
+def log_startup_times():
+    # keep a running record of startup times in reports/startup_times.csv so regressions are easy to spot
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    log_path = os.path.join(base_dir, 'reports', 'startup_times.csv')
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    new_file = not os.path.exists(log_path)
+    with open(log_path, 'a') as file:
+        if new_file:
+            file.write('timestamp,serving_seconds,warm_up_seconds,state\n')
+        file.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')},{warm_up['serving_seconds']},{warm_up['warm_up_seconds']},{warm_up['state']}\n")
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    reports_current = pipeline['run_config_version'] == pipeline['config_version'] if pipeline['run_config_version'] is not None else None
+    return jsonify({'status': 'ok', **warm_up, 'config_version': pipeline['config_version'], 'reports_current': reports_current})
+
+
 @app.route('/runNotebook', methods=['POST'])
 def run_notebook():
-    import pistachio
+    # ?dump=1 also writes the full merged_df debug dump for this run, ?simulate=1 adds the uncertainty bands - they are handed to
+    # this run alone (as its run_options), so overlapping requests can't change each other's
+    run_options = {'dump': request.args.get('dump', '0') == '1', 'simulate': request.args.get('simulate', '0') == '1'}
+    if not run_lock.acquire(blocking=False):
+        return jsonify('A run is already in progress'), 409
+    try:
+        # the run projects from a copy of the settings as they are now, so a /setSettings during the run can't reach it
+        with config_lock:
+            config = copy.deepcopy(read_config('settings.toml')['settings'])
+            config_version = pipeline['config_version']
+        runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pistachio.py'),
+                       init_globals={'run_options': run_options, 'config': config, 'config_version': config_version}, run_name='pistachio')
+        pipeline['run_config_version'] = config_version
+    finally:
+        run_lock.release()
     return jsonify('Notebook executed successfully')
 
 
+def send_report(kind, file):
+    # the latest snapshot's copy, so a run in progress never changes what is served, or the reports folder's before the first one
+    import snapshots
+    path = snapshots.path(snapshots.latest_version(), kind)
+    if path is not None:
+        return send_from_directory(os.path.dirname(path), os.path.basename(path))
+    return send_from_directory('reports', file)
+
+
 @app.route('/getBatterReport', methods=['GET'])
 def get_batter_report():
-    return send_from_directory('reports', 'batter_sWar.csv')
+    return send_report('batter', 'batter_sWar.csv')
 
 
 @app.route('/getPitcherReport', methods=['GET'])
 def get_pitcher_report():
-    return send_from_directory('reports', 'pitcher_sWar.csv')
+    # ?gb= gives the report at another minimum groundball threshold, from the latest export's role sweep (see roles.py)
+    if 'gb' in request.args:
+        import export
+        import roles
+        import snapshots
+        gb = request.args.get('gb', type=int)
+        if gb not in roles.GB_RANGE:
+            return jsonify(f'gb must be a whole number from {roles.GB_RANGE.start} to {roles.GB_RANGE.stop - 1}'), 400
+        sweep = roles.load(snapshots.path(snapshots.latest_version(), 'pitcher_sweep') or roles.SWEEP_PATH)
+        if sweep is None:
+            return jsonify('No report published yet'), 404
+        return app.response_class(export.csv_bytes(roles.report(sweep, gb)), mimetype='text/csv')
+    return send_report('pitcher', 'pitcher_sWar.csv')
+
+@app.route('/getPlayerHistory/<int:player_id>', methods=['GET'])
+def get_player_history(player_id):
+    import history
+    kind = request.args.get('kind', 'batter')
+    if kind not in history.COLUMNS:
+        return jsonify('Unknown report kind'), 400
+    return jsonify(history.player_trajectory(kind, player_id))
+
+
+@app.route('/getClubHistory/<club>', methods=['GET'])
+def get_club_history(club):
+    import history
+    kind = request.args.get('kind', 'batter')
+    if kind not in history.COLUMNS:
+        return jsonify('Unknown report kind'), 400
+    return jsonify(history.club_trajectory(kind, club))
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    import changes
+    kind = request.args.get('kind', 'batter')
+    if kind not in changes.REPORT_FILES:
+        return jsonify('Unknown report kind'), 400
+    since = request.args.get('since', 0, type=int)
+    return jsonify(changes.changes_since(kind, since))
+
+# the published reports as DataFrames, double-buffered: readers take whichever snapshot reports_cache['current'] holds (one
+# reference, read without a lock), while a newer snapshot is loaded aside and swapped in whole (read-copy-update)
+# before the first snapshot is published (see snapshots.py), the reports folder is read as changes.py versions it
+reports_cache = {'current': None}
+reports_lock = threading.Lock()
+
+
+def load_reports():
+    import changes
+    import snapshots
+    import pandas as pd
+    version = snapshots.latest_version()
+    if version:
+        paths = {kind: snapshots.path(version, kind) for kind in changes.REPORT_FILES}
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        version = changes.latest_version()
+        paths = {kind: os.path.join(base_dir, 'reports', file) for kind, file in changes.REPORT_FILES.items()}
+    return {'version': version, 'reports': {kind: pd.read_csv(path) for kind, path in paths.items()}}
+
+
+def latest_reports():
+    import changes
+    import snapshots
+    current = reports_cache['current']
+    version = snapshots.latest_version() or changes.latest_version()
+    if current is not None and current['version'] == version:
+        return current['version'], current['reports']
+    # one request loads the new snapshot while the others carry on with the current one (they only wait if there is none yet)
+    if not reports_lock.acquire(blocking=current is None):
+        return current['version'], current['reports']
+    try:
+        current = reports_cache['current']
+        if current is None or current['version'] != version:
+            current = load_reports()
+            reports_cache['current'] = current
+        return current['version'], current['reports']
+    finally:
+        reports_lock.release()
+
+
+# snapshots never change once published, so their versioned URLs can be cached for a year
+SNAPSHOT_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.route('/reports/latest', methods=['GET'])
+def get_latest_snapshot():
+    import snapshots
+    version = snapshots.latest_version()
+    if not version:
+        return jsonify('No report published yet'), 404
+    files = {name: f'/reports/{version}/{name}' for name in snapshots.FILES if snapshots.path(version, name)}
+    response = jsonify({'version': version, 'files': files})
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/reports/latest/<name>', methods=['GET'])
+def get_latest_snapshot_file(name):
+    import snapshots
+    version = snapshots.latest_version()
+    if not version:
+        return jsonify('No report published yet'), 404
+    if name not in snapshots.FILES:
+        return jsonify('Unknown report file'), 400
+    response = redirect(f'/reports/{version}/{name}')
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/reports/<int:version>/<name>', methods=['GET'])
+def get_snapshot_file(version, name):
+    import snapshots
+    path = snapshots.path(version, name)
+    if path is None:
+        return jsonify('Unknown report version or file'), 404
+    response = send_from_directory(os.path.dirname(path), os.path.basename(path), max_age=SNAPSHOT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/getBestLineups', methods=['GET'])
+def get_best_lineups():
+    import lineups
+    try:
+        _, reports = latest_reports()
+    except FileNotFoundError:
+        return jsonify('No report published yet'), 404
+    batters, pitchers = reports['batter'], reports['pitcher']
+    # ?minors=0 leaves out players in the minors, ?club= returns a single club (eg the managed team)
+    if request.args.get('minors', '1') == '0':
+        batters, pitchers = batters[batters['minor'] == 0], pitchers[pitchers['minor'] == 0]
+    rosters = lineups.best_rosters(batters, pitchers, potential=request.args.get('potential', '0') == '1')
+    club = request.args.get('club')
+    if club:
+        rosters = [roster for roster in rosters if roster['club'] == club]
+    return jsonify(rosters)
+
+@app.route('/getLeaderboard', methods=['GET'])
+def get_leaderboard():
+    import leaderboards
+    import snapshots
+    kind = request.args.get('kind', 'batter')
+    if kind not in leaderboards.METRICS:
+        return jsonify('Unknown report kind'), 400
+    metric = request.args.get('metric', 'best' if kind == 'batter' else 'sp')
+    if metric not in leaderboards.METRICS[kind]:
+        return jsonify('Unknown leaderboard metric'), 400
+    try:
+        version, reports = latest_reports()
+    except FileNotFoundError:
+        return jsonify('No report published yet'), 404
+
+    # the index is published with the reports (see snapshots.py) - built here, and not saved, if it's missing or from another version
+    index = leaderboards.load(snapshots.path(version, 'leaderboards') or leaderboards.LEADERBOARDS_PATH)
+    if index is None or int(index['version']) != version:
+        index = leaderboards.build(reports, version)
+
+    rows = leaderboards.top(
+        index, kind, metric,
+        limit=request.args.get('limit', leaderboards.DEFAULT_LIMIT, type=int),
+        minor=request.args.get('minor', type=int),
+        club=request.args.get('club'),
+        min_age=request.args.get('min_age', type=float),
+        max_age=request.args.get('max_age', type=float)
+    )
+    board = reports[kind].iloc[rows]
+    return jsonify(board.astype(object).where(board.notna(), None).to_dict('records'))
+
+@app.route('/search', methods=['GET'])
+def search_players():
+    import search
+    import snapshots
+    # the latest snapshot's index, or the reports folder's before the first one (see send_report)
+    index = search.load(snapshots.path(snapshots.latest_version(), 'search') or search.SEARCH_PATH)
+    if index is None:
+        return jsonify('No report published yet'), 404
+    rows = search.search(index, request.args.get('q', ''), limit=request.args.get('limit', search.DEFAULT_LIMIT, type=int))
+    return jsonify([{'player_id': int(index['player_id'][row]), 'name': str(index['name'][row])} for row in rows])
+
+@app.route('/similar', methods=['GET'])
+def similar_players():
+    # the k players whose rating profile (batter or pitcher, see similar.py) is closest to player_id's, with their MLB outcomes
+    import similar
+    import snapshots
+    kind = request.args.get('kind', 'batter')
+    if kind not in similar.FEATURES:
+        return jsonify('Unknown report kind'), 400
+    player_id = request.args.get('player_id', type=int)
+    if player_id is None:
+        return jsonify('player_id is required'), 400
+    index = similar.load(snapshots.path(snapshots.latest_version(), 'similar') or similar.SIMILAR_PATH)
+    if index is None:
+        return jsonify('No report published yet'), 404
+    players = similar.similar(index, kind, player_id, k=request.args.get('k', similar.DEFAULT_K, type=int))
+    if players is None:
+        return jsonify('Unknown player_id'), 404
+    return jsonify(players)
+
+@app.route('/whatIf', methods=['POST'])
+def what_if():
+    # projects hypothetical ratings (see whatif.py for the body) with the settings the next run would use - ?gb= overrides the
+    # minimum groundball threshold
+    import whatif
+    settings = read_config('settings.toml')['settings']['Settings']
+    min_gb = request.args.get('gb', settings['gb_weight'], type=int)
+    rate_coefficients = settings.get('rate_coefficients', '')
+    try:
+        parts = whatif.rate_parts(os.path.join(os.path.dirname(os.path.abspath(__file__)), rate_coefficients) if rate_coefficients else '')
+        return jsonify(whatif.what_if(request.get_json(silent=True), min_gb, parts=parts))
+    except (ValueError, TypeError) as e:
+        return jsonify(str(e)), 400
 
 @app.route('/getLsDir', methods=['GET'])
 def get_lsdir():
     files = os.listdir(os.path.dirname(os.path.abspath(__file__)))
     return jsonify(files)
 
-@app.route('/getSettings', methods=['GET'])
-def get_settings():
-    # list all files in the config directory
-    files = os.listdir(os.getcwd())
-    print(files)
+# config service: settings.toml, the report column lists and flagged.txt are held in memory (settings.toml parsed as well),
+# so GETs are served without touching the files beyond a stat, with an ETag the client can revalidate against
+# writes go through to the file atomically (a temporary file renamed over it) under config_lock, so concurrent POSTs can't
+# interleave; a file edited by hand is picked up by its modification time
+CONFIG_FILES = ['settings.toml', 'batter-columns.txt', 'pitcher-columns.txt', 'flagged.txt']
+config_cache = {}
+config_lock = threading.RLock()
+
+
+def config_path(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', name)
+
+
+def read_config(name):
+    """Returns the cached entry of a config file ('text', 'etag', and 'settings' parsed for settings.toml), reloading it if the file changed."""
+    with config_lock:
+        mtime_ns = os.stat(config_path(name)).st_mtime_ns
+        entry = config_cache.get(name)
+        if entry is None or entry['mtime_ns'] != mtime_ns:
+            with open(config_path(name), 'r') as file:
+                text = file.read()
+            entry = {'text': text, 'etag': hashlib.sha1(text.encode()).hexdigest(), 'mtime_ns': mtime_ns}
+            if name == 'settings.toml':
+                entry['settings'] = toml.loads(text)
+            config_cache[name] = entry
+        return entry
+
+
+def write_config(name, text):
+    """Replaces a config file's contents on disk and in the cache, and tells the pipeline its config changed."""
+    with config_lock:
+        path = config_path(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+        entry = {'text': text, 'etag': hashlib.sha1(text.encode()).hexdigest(), 'mtime_ns': os.stat(path).st_mtime_ns}
+        if name == 'settings.toml':
+            entry['settings'] = toml.loads(text)
+        config_cache[name] = entry
+        pipeline['config_version'] += 1
+
 
+def serve_config(name):
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        with open(base_dir + '/config/settings.toml', 'r') as file:
-            settings_content = file.read()
-            print(settings_content)
-        return send_from_directory(os.path.join(base_dir, 'config'), 'settings.toml')
+        entry = read_config(name)
     except FileNotFoundError:
-        return jsonify('Settings file not found'), 404
+        return jsonify(f'{name} not found'), 404
+    response = app.response_class(entry['text'], mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    response.set_etag(entry['etag'])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
-@app.route('/setSettings', methods=['POST'])
-def set_settings():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    settings_path = os.path.join(base_dir, 'config', 'settings.toml')
+def parse_bool(value):
+    """Returns a setting's true/false value - JSON booleans and numbers as they are, and strings like 'true', 'false', '1' or '0'."""
+    if isinstance(value, str):
+        if value.strip().lower() in ['true', '1', 'yes', 'on']:
+            return True
+        if value.strip().lower() in ['false', '0', 'no', 'off', '']:
+            return False
+        raise ValueError(f'Expected true or false, got {value!r}')
+    return bool(value)
 
-    with open(settings_path, 'r') as file:
-        config = toml.load(file)
 
+@app.route('/getSettings', methods=['GET'])
+def get_settings():
+    return serve_config('settings.toml')
+
+
+@app.route('/setSettings', methods=['POST'])
+def set_settings():
     data = request.get_json()
     print("Received Data:", data)
 
-    if 'csv_path' in data and data['csv_path']:
-        config['Settings']['csv_path'] = data['csv_path']
-    if 'scout_id' in data and data['scout_id']:
-        config['Settings']['scout_id'] = int(data['scout_id'])
-    if 'team_id' in data:
-        config['Settings']['team_id'] = data['team_id']
-    if 'gb_weight' in data and data['gb_weight']:
-        config['Settings']['gb_weight'] = int(data['gb_weight'])
+    # the true/false settings are checked up front, so a value that is neither changes nothing
+    for name in ['dump_merged', 'simulate', 'float32', 'prune', 'verify_prune', 'fitted_aging']:
+        if name in data:
+            try:
+                parse_bool(data[name])
+            except ValueError as e:
+                return jsonify(f'{name}: {e}'), 400
+
+    # read, update and write back under the lock, so two POSTs can't lose each other's changes
+    with config_lock:
+        try:
+            config = copy.deepcopy(read_config('settings.toml')['settings'])
+        except FileNotFoundError:
+            return jsonify('Settings file not found'), 404
+
+        if 'csv_path' in data and data['csv_path']:
+            config['Settings']['csv_path'] = data['csv_path']
+        if 'scout_id' in data and data['scout_id']:
+            config['Settings']['scout_id'] = int(data['scout_id'])
+        if 'team_id' in data:
+            config['Settings']['team_id'] = data['team_id']
+        if 'gb_weight' in data and data['gb_weight']:
+            config['Settings']['gb_weight'] = int(data['gb_weight'])
+        if 'dump_merged' in data:
+            config['Settings']['dump_merged'] = parse_bool(data['dump_merged'])
+        if 'simulate' in data:
+            config['Settings']['simulate'] = parse_bool(data['simulate'])
+        if 'simulation_draws' in data and data['simulation_draws']:
+            config['Settings']['simulation_draws'] = int(data['simulation_draws'])
+        if 'rating_sd' in data and data['rating_sd']:
+            config['Settings']['rating_sd'] = float(data['rating_sd'])
+        if 'rate_coefficients' in data:
+            config['Settings']['rate_coefficients'] = data['rate_coefficients']
+        if 'float32' in data:
+            config['Settings']['float32'] = parse_bool(data['float32'])
+        if 'chunk_size' in data:
+            config['Settings']['chunk_size'] = int(data['chunk_size'] or 0)
+        if 'prune' in data:
+            config['Settings']['prune'] = parse_bool(data['prune'])
+        if 'verify_prune' in data:
+            config['Settings']['verify_prune'] = parse_bool(data['verify_prune'])
+        if 'fitted_aging' in data:
+            config['Settings']['fitted_aging'] = parse_bool(data['fitted_aging'])
 
-    with open(settings_path, 'w') as configfile:
-        toml.dump(config, configfile)
+        write_config('settings.toml', toml.dumps(config))
 
     return jsonify('Settings updated successfully')
 
 
 @app.route('/getBatterColumns', methods=['GET'])
 def get_batter_columns():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    return send_from_directory(base_dir + '/config', 'batter-columns.txt')
+    return serve_config('batter-columns.txt')
 
 
 @app.route('/getPitcherColumns', methods=['GET'])
 def get_pitcher_columns():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    return send_from_directory(base_dir + '/config', 'pitcher-columns.txt')
+    return serve_config('pitcher-columns.txt')
 
 
 @app.route('/setBatterColumns', methods=['POST'])
 def set_batter_columns():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data = request.get_data(as_text=True)
-    with open(base_dir + '/config/batter-columns.txt', 'w') as file:
-        file.write(data)
+    write_config('batter-columns.txt', request.get_data(as_text=True))
     return jsonify('Batter columns updated successfully')
 
 
 @app.route('/setPitcherColumns', methods=['POST'])
 def set_pitcher_columns():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data = request.get_data(as_text=True)
-    with open(base_dir + '/config/pitcher-columns.txt', 'w') as file:
-        file.write(data)
+    write_config('pitcher-columns.txt', request.get_data(as_text=True))
     return jsonify('Pitcher columns updated successfully')
 
 
 @app.route('/getFlagged', methods=['GET'])
 def get_flagged():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    return send_from_directory(base_dir + '/config', 'flagged.txt')
+    return serve_config('flagged.txt')
 
 
 @app.route('/setFlagged', methods=['POST'])
 def set_flagged():
-    data = request.get_data(as_text=True)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    with open(base_dir + '/config/flagged.txt', 'w') as file:
-        file.write(data)
+    write_config('flagged.txt', request.get_data(as_text=True))
     return jsonify('Flagged players updated successfully')
 
 
 if __name__ == '__main__':
-    import threading
-    flask_thread = threading.Thread(target=app.run(host='127.0.0.1', port=5000))
-    flask_thread.daemon = True
-    flask_thread.start()
+    # make_server binds and listens before returning (app.run gives no hook once it is listening), so the time is taken and
+    # the warm-up started only once requests can be accepted
+    server = make_server('127.0.0.1', 5000, app, threaded=True)
+    warm_up['serving_seconds'] = round(time.perf_counter() - STARTED, 3)
+    print(f"Serving after {warm_up['serving_seconds']}s")
+    threading.Thread(target=run_warm_up, daemon=True).start()
+    server.serve_forever()
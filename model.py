@@ -0,0 +1,518 @@
+# vectorized building blocks for the pistachio projection model
+# everything in here works on plain NumPy arrays (or pandas Series) so it can be shared between pistachio.py and the Flask server
+import json
+import os
+import numpy as np
+
+
+# the 20-100 scale ratings exported by OOTP 26 mapped onto the 1-250 scale of the OOTP 2024 export, which the model is based on
+RATING_SCALE_MAP = {
+    20: 6,  25: 20,  30: 35,  35: 52,  40: 69,
+    45: 85,  50: 101,  55: 117,  60: 134,  65: 150,
+    70: 166,  75: 181,  80: 201,  85: 213,  90: 225,
+    95: 238,  100: 250
+}
+
+
+def to_model_scale(ratings):
+    """
+    Returns ratings on the 20-100 scale mapped onto the 1-250 scale via RATING_SCALE_MAP, interpolating between its steps
+    (so whole steps map exactly as pistachio.py's replace does).
+    """
+    return np.interp(floats(ratings), list(RATING_SCALE_MAP), list(RATING_SCALE_MAP.values()))
+
+
+# fielding positions a hitter can 'have', one bit each - the order is the order they are listed in the 'field' column
+POSITIONS = ['C', 'SS', '2B', '3B', 'CF', 'RF', 'LF']
+POSITION_BITS = {pos: 1 << i for i, pos in enumerate(POSITIONS)}
+
+# the 'C, SS, 2B' style label for every possible bitmask, so rendering the field column is a single array lookup
+FIELD_LABELS = np.array([", ".join(pos for pos in POSITIONS if mask & POSITION_BITS[pos]) for mask in range(1 << len(POSITIONS))], dtype=object)
+
+
+def position_mask(framing, if_range, if_arm, of_range):
+    """
+    Returns a uint8 bitmask of the positions each player is eligible for (see POSITION_BITS).
+    Ratings are on the 1-250 scale; the rules are the ones pistachio has always used to decide whether a hitter 'has a position'.
+    """
+    framing, if_range, if_arm, of_range = (np.asarray(r, dtype=float) for r in (framing, if_range, if_arm, of_range))
+
+    rules = {
+        'C': framing >= 150,
+        'SS': if_range > 160,
+        '2B': (if_range > 133) & (if_range < 159),
+        '3B': (if_range > 111) & (if_arm > 133),
+        'CF': of_range > 160,
+        'RF': (of_range > 133) & (of_range < 159),
+        'LF': (of_range > 111) & (of_range < 133),
+    }
+
+    mask = np.zeros(framing.shape, dtype=np.uint8)
+    for pos, eligible in rules.items():
+        mask |= np.where(eligible, POSITION_BITS[pos], 0).astype(np.uint8)
+    return mask
+
+
+def group_mask(positions):
+    """Returns the bitmask covering a list of position labels - labels that are never assigned (eg 1B, DH) contribute nothing."""
+    mask = 0
+    for pos in positions:
+        mask |= POSITION_BITS.get(pos, 0)
+    return mask
+
+
+def render_field(mask):
+    """Renders position bitmasks as the comma-separated 'field' strings used in the reports."""
+    return FIELD_LABELS[np.asarray(mask, dtype=np.intp)]
+
+
+# the twelve pitches OOTP rates, in the order they are held in the arsenal matrix
+PITCHES = ['fastball', 'slider', 'curveball', 'screwball', 'forkball', 'changeup', 'sinker', 'splitter', 'knuckleball', 'cutter', 'circlechange', 'knucklecurve']
+PITCH_INDEX = {pitch: i for i, pitch in enumerate(PITCHES)}
+
+# index of the last axis of the arsenal matrix
+CURRENT, POTENTIAL = 0, 1
+
+
+def arsenal_matrix(current, potential):
+    """
+    Returns the pitch ratings as a contiguous players x 12 x {current, potential} int16 array.
+    current and potential are the 12 pitch rating columns (in PITCHES order); missing ratings count as 0 (no pitch).
+    """
+    current = np.nan_to_num(np.asarray(current, dtype=float))
+    potential = np.nan_to_num(np.asarray(potential, dtype=float))
+    return np.ascontiguousarray(np.stack([current, potential], axis=-1).astype(np.int16))
+
+
+def pitch_counts(arsenal, minimum):
+    """Returns a players x {current, potential} array counting the pitches rated at or above minimum."""
+    return (arsenal >= minimum).sum(axis=1)
+
+
+def arsenal_query(arsenal, pitches=None, count=None, minimum=None, potential=False):
+    """
+    Returns a boolean mask of pitchers whose arsenal satisfies every condition given.
+    pitches is a dict of pitch name -> minimum rating, eg {'slider': 134, 'sinker': 85} for a plus slider and a sinker;
+    count and minimum (given together) ask for at least count pitches rated >= minimum, eg count=3, minimum=101 for three
+    pitches at 50. Ratings are on the same 1-250 scale as the arsenal; potential=True queries the talent ratings instead of the
+    current ones.
+    """
+    if (count is None) != (minimum is None):
+        raise ValueError('arsenal_query needs count and minimum together')
+    ratings = arsenal[:, :, POTENTIAL if potential else CURRENT]
+    selected = np.ones(len(arsenal), dtype=bool)
+    for pitch, rating in (pitches or {}).items():
+        selected &= ratings[:, PITCH_INDEX[pitch]] >= rating
+    if count is not None:
+        selected &= (ratings >= minimum).sum(axis=1) >= count
+    return selected
+
+
+# the MOPS batting model by Sgt Mushroom: each rate (per plate appearance) is a sum of parts, and each part is a piecewise-linear
+# curve of one rating on the 1-250 scale. A curve is a list of (upper bound, slope, intercept) segments, the first segment whose
+# bound the rating is at or under applies and the last one (bound None) covers everything above; a part's offset is subtracted
+# after the curve, so the parts that adjust a rate for a second rating are centred on the league average
+# 'avoidk_adjusted' and 'gap_damped' are the fudge-factored inputs described at STRIKEOUT_CAP and GAP_DAMPING
+RATE_PARTS = {
+    'bb': [
+        ('eye', 0, [(100, 0.0007268758188, 0.001460739), (None, 0.0012280964, -0.0469974639)]),
+    ],
+    'k': [
+        ('avoidk_adjusted', 0, [(100, -0.002454367, 0.4655792299), (None, -0.0016592514, 0.383395059)]),
+    ],
+    'hr': [
+        ('power', 0, [(100, 0.0001965717055, 0.0057097943), (None, 0.0005767110238, -0.0305087264)]),
+    ],
+    '2b': [
+        ('gap_damped', 0, [(None, 0.0005759923464, 0.0046460781)]),
+        ('power', 0.0628, [(100, -0.0000508547503, 0.0669597896), (None, -0.00008542726043, 0.071154717)]),
+        ('avoidk', 0.0628, [(100, -0.0002084865135, 0.0828934273), (220, -0.000008259599351, 0.0708287518), (None, 0, 0.053)]),
+    ],
+    '3b': [
+        ('gap', 0, [(None, 0.00004451978242, 0.00007767274633)]),
+        ('power', 0.0044, [(100, -0.00000206286281, 0.0046134367), (None, -0.000007041275071, 0.0051236727)]),
+        ('avoidk', 0.0044, [(100, -0.00001098275967, 0.0055735013), (220, -0.00000526736139, 0.0048976614), (None, 0, 0.0037)]),
+    ],
+    '1b': [
+        ('babip', 0, [(100, 0.0015140038, 0.1281801944), (None, 0.000964994955, 0.1837822012)]),
+        ('gap', 0.28, [(None, -0.0003887320573, 0.3178756912)]),
+        ('avoidk', 0.28, [(100, 0.000149985378, 0.2648525907), (220, 0.00005179135613, 0.2754044069), (None, 0, 0.286)]),
+    ],
+}
+
+# league average and scale of each rate in the offensive runs created formula
+RATE_WEIGHTS = {'bb': (0.0738, 0.875), 'k': (0.2195, -1.217), 'hr': (0.0272, 0.219), '2b': (0.0628, 0.693), '3b': (0.0044, 0.0519), '1b': (0.28, 0.594)}
+
+# strikeout rating is capped at 180 to prevent sky-high k% projections, then pulled 10% of the way back to 100
+# (fudge factor - high avK players were getting too high an OPS+ projection vs career performance, based on OOTP 24 gameplay)
+STRIKEOUT_CAP = 180
+STRIKEOUT_SHRINK = 0.1
+
+# gap rating is pulled two thirds of the way back to 100 for 2b% (fudge factor to reduce its impact)
+GAP_DAMPING = 0.6666
+
+# fielding model: each position's defence is a sum of parts of the same form, each measured against the league average of 4.6385,
+# and defensive WAR adds a positional adjustment; DH has no defensive value
+LEAGUE_DEF = 4.6385
+DEFENCE_PARTS = {
+    'c': (1.5, [
+        ('framing', [(40, 0, 5.311), (61, -0.0204, 6.125), (None, -0.0028608333, 4.998622222)]),
+        ('catcher_arm', [(None, -0.0006034965035, 4.712621212)]),
+    ]),
+    '1b': (0.5, [
+        ('height', [(None, -0.0014708625, 4.917895105)]),
+        ('if_range', [(None, -0.0001325174825, 4.645893939)]),
+        ('if_error', [(None, -0.0001685314685, 4.658242424)]),
+        ('if_arm', [(None, 0, 4.6385)]),
+        ('turn_dp', [(None, 0, 4.6385)]),
+    ]),
+    '2b': (1.75, [
+        ('turn_dp', [(200, -0.0012715152, 4.825866667), (None, 0, 4.569020596)]),
+        ('if_range', [(None, -0.0016293706, 4.844484848)]),
+        ('if_error', [(160, -0.0006464285714, 4.720428571), (None, 0, 4.628635714)]),
+        ('if_arm', [(None, -0.0002284965035, 4.658287879)]),
+    ]),
+    '3b': (1.8, [
+        ('turn_dp', [(None, 0, 4.6385)]),
+        ('if_range', [(None, -0.0015907343, 4.808545455)]),
+        ('if_error', [(180, -0.0008091666667, 4.748583333), (None, 0, 4.61)]),
+        ('if_arm', [(60, 0, 4.788), (None, -0.0021283333, 4.963644444)]),
+    ]),
+    'ss': (2, [
+        ('turn_dp', [(200, -0.0007603030303, 4.7435333333), (None, 0, 4.597)]),
+        ('if_range', [(60, 0, 4.985), (None, -0.0045308333, 5.330155556)]),
+        ('if_error', [(180, -0.0011291667, 4.793027778), (None, 0, 4.588)]),
+        ('if_arm', [(None, -0.0011823427, 4.809787879)]),
+    ]),
+    'lf': (0.3, [
+        ('of_arm', [(None, -0.000190034965, 4.665287879)]),
+        ('of_range', [(40, 0, 4.9135), (80, -0.000825, 4.9445), (100, -0.01135, 5.787), (180, -0.000625, 4.661), (None, 0, 4.54)]),
+        ('of_error', [(None, 0, 4.6385)]),
+    ]),
+    'cf': (2.5, [
+        ('of_arm', [(None, -0.000190034965, 4.665287879)]),
+        ('of_range', [(80, 0, 4.86), (None, -0.0030625, 5.15075)]),
+        ('of_error', [(None, -0.0001664335664, 4.659636364)]),
+    ]),
+    'rf': (0.6, [
+        ('of_arm', [(60, 0, 4.683), (180, -0.0005428571429, 4.716142857), (None, 0, 4.618)]),
+        ('of_range', [(80, -0.000455, 4.89), (160, -0.004385, 5.1866), (None, 0, 4.5)]),
+        ('of_error', [(None, 0, 4.6385)]),
+    ]),
+}
+
+# every position a hitter is valued at (sWAR), in the order of the report columns
+SWAR_POSITIONS = ['c', '1b', '2b', '3b', 'ss', 'lf', 'cf', 'rf', 'dh']
+
+# games and runs per win used to turn per-game runs into WAR
+GAMES = 162
+RUNS_PER_WIN = 10
+
+# plate appearances in a standard season, and the league OPS that OPS+ is measured against
+SEASON_PA = 650
+LEAGUE_OPS = 0.734
+
+
+def floats(x):
+    """Returns x as a float array, keeping float32 input as float32 (so the model can run in float32, see pistachio.py) and float64 otherwise."""
+    x = np.asarray(x)
+    return x if x.dtype == np.float32 else x.astype(float, copy=False)
+
+
+def piecewise(x, segments):
+    """Evaluates a piecewise-linear curve (see RATE_PARTS) over an array; missing ratings give NaN."""
+    x = floats(x)
+    bound, slope, intercept = segments[-1]
+    result = (x * slope) + intercept
+    for bound, slope, intercept in reversed(segments[:-1]):
+        result = np.where(x <= bound, (x * slope) + intercept, result)
+    return result
+
+
+# the batting rating each RATE_PARTS input is derived from
+INPUT_RATINGS = {'eye': 'eye', 'avoidk': 'avoidk', 'power': 'power', 'gap': 'gap', 'babip': 'babip', 'avoidk_adjusted': 'avoidk', 'gap_damped': 'gap'}
+
+
+def batting_inputs(eye, avoidk, power, gap, babip):
+    """Returns the batting ratings (1-250 scale) as the named inputs RATE_PARTS refers to, including the fudge-factored ones."""
+    eye, avoidk, power, gap, babip = (floats(r) for r in (eye, avoidk, power, gap, babip))
+    capped = np.minimum(avoidk, STRIKEOUT_CAP)
+    return {
+        'eye': eye,
+        'avoidk': avoidk,
+        'power': power,
+        'gap': gap,
+        'babip': babip,
+        'avoidk_adjusted': capped + ((100 - capped) * STRIKEOUT_SHRINK),
+        'gap_damped': gap - ((gap - 100) * GAP_DAMPING),
+    }
+
+
+# the handedness splits OOTP rates batters on, by the suffix of their pistachio.py columns and the name in the ratings export
+# (batting_ratings_vsl_eye etc): vs left-handed and vs right-handed pitching
+SPLITS = {'_vsL': 'vsl', '_vsR': 'vsr'}
+
+
+def stack_ratings(*views):
+    """
+    Stacks dicts of ratings (eg overall, vs LHP and vs RHP batting ratings) into one dict of views x players arrays, so
+    batting_rates and the kernels after it project every view in a single pass; row i of each result is views[i]'s.
+    """
+    return {name: np.stack([floats(view[name]) for view in views]) for name in views[0]}
+
+
+def batting_rates(eye, avoidk, power, gap, babip, parts=RATE_PARTS):
+    """Returns a dict of rate -> array (bb, k, hr, 2b, 3b, 1b per plate appearance) from batting ratings on the 1-250 scale."""
+    inputs = batting_inputs(eye, avoidk, power, gap, babip)
+    rates = {}
+    for rate, rate_parts in parts.items():
+        total = None
+        for name, offset, segments in rate_parts:
+            part = piecewise(inputs[name], segments) - offset if offset else piecewise(inputs[name], segments)
+            total = part if total is None else total + part
+        rates[rate] = total
+    return rates
+
+
+def save_rate_parts(parts, path):
+    """Writes a coefficient table in the RATE_PARTS layout to a json file (see calibrate.py), atomically replacing path."""
+    table = {rate: [{'input': name, 'offset': offset, 'segments': [list(segment) for segment in segments]} for name, offset, segments in rate_parts]
+             for rate, rate_parts in parts.items()}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(table, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_rate_parts(path):
+    """Reads a coefficient table written by save_rate_parts, in the RATE_PARTS layout."""
+    with open(path) as file:
+        table = json.load(file)
+    return {rate: [(part['input'], part['offset'], [tuple(segment) for segment in part['segments']]) for part in rate_parts]
+            for rate, rate_parts in table.items()}
+
+
+def offensive_war(rates, weights=RATE_WEIGHTS):
+    """Returns offensive WAR (toWAR) from batting rates, via offensive runs created per game."""
+    orc_per_game = None
+    for rate, (average, scale) in weights.items():
+        term = (rates[rate] - average) / scale
+        orc_per_game = term if orc_per_game is None else orc_per_game + term
+    return (orc_per_game * GAMES) / RUNS_PER_WIN
+
+
+def offensive_war_bound(current, talent, parts=RATE_PARTS, weights=RATE_WEIGHTS):
+    """
+    Returns an upper bound on both toWAR and toWAR_pot from dicts of batting_rates' arguments. toWAR is a weighted sum of
+    the RATE_PARTS curves, so taking the better of current and talent for each curve on its own can only overshoot both.
+    """
+    inputs_current, inputs_talent = batting_inputs(**current), batting_inputs(**talent)
+    bound = 0
+    for rate, rate_parts in parts.items():
+        average, scale = weights[rate]
+        factor = GAMES / RUNS_PER_WIN / scale
+        for name, offset, segments in rate_parts:
+            bound = bound + np.fmax((piecewise(inputs_current[name], segments) - offset) * factor,
+                                    (piecewise(inputs_talent[name], segments) - offset) * factor)
+        bound = bound - (average * factor)
+    return bound
+
+
+def defence(ratings, parts=DEFENCE_PARTS):
+    """
+    Returns a dict of position -> defence from a dict of fielding ratings (1-250 scale; height in cm for 1B),
+    keyed by the rating names DEFENCE_PARTS uses.
+    """
+    result = {}
+    for pos, (adjustment, pos_parts) in parts.items():
+        total = None
+        for name, segments in pos_parts:
+            part = piecewise(ratings[name], segments)
+            total = LEAGUE_DEF - part if total is None else total + LEAGUE_DEF - part
+        result[pos] = total
+    return result
+
+
+def defensive_war(defence_by_pos, parts=DEFENCE_PARTS):
+    """Returns a dict of position -> defensive WAR (tdWAR) from the defence values, with DH as 0."""
+    war = {pos: ((defence_by_pos[pos] * GAMES) / RUNS_PER_WIN) + adjustment for pos, (adjustment, _) in parts.items()}
+    war['dh'] = 0
+    return war
+
+
+def batting_line(rates):
+    """
+    Returns the per-season batting line (bb650, hr650, k650, 2b, 3b, 1b, obp, slg, ops) implied by a set of rates over SEASON_PA plate appearances.
+    Walks come first, then home runs and strikeouts out of the remaining plate appearances, then hits on balls in play.
+    """
+    bb650 = rates['bb'] * SEASON_PA
+    hr650 = rates['hr'] * (SEASON_PA - bb650)
+    k650 = rates['k'] * (SEASON_PA - bb650)
+    doubles = rates['2b'] * (SEASON_PA - bb650 - hr650 - k650)
+    triples = rates['3b'] * (SEASON_PA - bb650 - hr650 - k650)
+    singles = rates['1b'] * (SEASON_PA - bb650 - hr650 - k650 - doubles - triples)
+    obp = (bb650 + hr650 + doubles + triples + singles) / SEASON_PA
+    slg = (singles + (2 * doubles) + (3 * triples) + (4 * hr650)) / (SEASON_PA - bb650)
+    return {'bb650': bb650, 'hr650': hr650, 'k650': k650, '2b': doubles, '3b': triples, '1b': singles, 'obp': obp, 'slg': slg, 'ops': obp + slg}
+
+
+def batting_summary(rates, per_pa=False):
+    """
+    Returns just hr650, obp and ops_plus (unrounded) of the batting line for a set of rates, in one pass over the rates.
+    The arithmetic is batting_line's, step for step, but it runs in place over four scratch arrays instead of building every
+    intermediate column. per_pa=True reads every rate per plate appearance, as the career *_mlb rates are measured.
+    """
+    bb, k, hr, doubles, triples, singles = (np.asarray(rates[rate]) for rate in ['bb', 'k', 'hr', '2b', '3b', '1b'])
+    dtype = np.result_type(bb, k, hr, doubles, triples, singles, np.float32)
+    shape = np.broadcast_shapes(bb.shape, k.shape, hr.shape, doubles.shape, triples.shape, singles.shape)
+    hr650, obp, ops = np.empty((3,) + shape, dtype=dtype)
+    scratch = np.empty((4,) + shape, dtype=dtype)
+
+    bb650 = np.multiply(bb, SEASON_PA, out=scratch[0])
+    after_bb = np.subtract(SEASON_PA, bb650, out=scratch[1])
+    np.multiply(hr, SEASON_PA if per_pa else after_bb, out=hr650)
+    np.add(bb650, hr650, out=obp)
+    if per_pa:
+        in_play = SEASON_PA
+    else:
+        in_play = np.subtract(after_bb, hr650, out=scratch[3])
+        in_play -= np.multiply(k, after_bb, out=scratch[2])
+
+    d = np.multiply(doubles, in_play, out=scratch[0])
+    obp += d
+    t = np.multiply(triples, in_play, out=scratch[2])
+    obp += t
+    if per_pa:
+        s = np.multiply(singles, SEASON_PA, out=scratch[3])
+    else:
+        s = in_play
+        s -= d
+        s -= t
+        s *= singles
+    obp += s
+    obp /= SEASON_PA
+
+    # slg = (1b + 2 * 2b + 3 * 3b + 4 * hr) / (pa - bb), then OPS+ = (obp + slg) / league OPS * 100
+    d *= 2
+    np.add(s, d, out=ops)
+    t *= 3
+    ops += t
+    ops += np.multiply(hr650, 4, out=scratch[0])
+    ops /= after_bb
+    ops += obp
+    ops /= LEAGUE_OPS
+    ops *= 100
+    return {'hr650': hr650, 'obp': obp, 'ops_plus': ops}
+
+
+def ops_plus(ops):
+    """Returns OPS+ (unrounded) from OPS."""
+    return (ops / LEAGUE_OPS) * 100
+
+
+# pitching model: a blended pitcher rating on the 20-80 scale (v2 weightings) is mapped onto FIP so that ratings of 65, 50 and 45
+# correspond to FIPs of 2.75, 4.1 and 5.45 (league average FIP 4.1), and FIP onto WAR over 180 IP per the OOTP calculator
+PITCHER_WEIGHTS = {'stuff': 0.25, 'control': 0.19, 'hra': 0.51, 'pbabip': 0.05}
+LEAGUE_FIP = 4.1
+STARTER_IP = 180
+
+
+def pitcher_rating(stuff, control, hra, pbabip):
+    """Returns the blended pitcher rating from stuff, control, home runs allowed and pbabip on the 20-80 scale."""
+    return ((PITCHER_WEIGHTS['stuff'] * floats(stuff)) + (PITCHER_WEIGHTS['control'] * floats(control))
+            + (PITCHER_WEIGHTS['hra'] * floats(hra)) + (PITCHER_WEIGHTS['pbabip'] * floats(pbabip)))
+
+
+def fip(rating):
+    """Returns projected FIP from a blended pitcher rating."""
+    rating = floats(rating)
+    return np.where(
+        rating > 50,
+        LEAGUE_FIP - ((rating - 50) * ((4.1 - 2.75) / 15)),
+        LEAGUE_FIP + ((50 - rating) * ((5.45 - 4.1) / 5))
+    )
+
+
+def pitcher_war(fip_values):
+    """Returns standardised WAR over STARTER_IP innings from FIP (relievers are valued at a third of this)."""
+    fipr9 = fip_values + 4.62 - 4.25
+    rpw = ((((12.375 * 4.62) + (5.625 * fipr9)) / 18) + 2) * 1.5
+    return ((((4.62 - fipr9) / rpw) + 0.12) * STARTER_IP) / 9
+
+
+def pitcher_war_bound(current, talent):
+    """
+    Returns an upper bound on both p_sWAR and p_sWAR_pot from dicts of pitcher_rating's arguments. p_sWAR rises with every
+    rating (the rating's weights are positive, FIP falls as it rises and WAR falls as FIP rises), so it is at most its value at
+    the higher of each current and talent rating.
+    """
+    return pitcher_war(fip(pitcher_rating(**{name: np.fmax(floats(current[name]), floats(talent[name])) for name in current})))
+
+
+# pitcher roles, besides being a groundball pitcher (ground_fly of at least gb_weight in settings.toml): a starter needs stamina of
+# 68 on the 1-250 scale (69 for potential), pbabip of 45 on the 20-80 scale and 3 pitches rated 45 or more, and a reliever
+# pbabip of 45 and 2 pitches
+STARTER_STAMINA = {'current': 68, 'potential': 69}
+MIN_PBABIP = 45
+STARTER_PITCHES = 3
+RELIEVER_PITCHES = 2
+
+# a pitch counts towards those from this rating, on the 20-80 scale (pistachio.py's pitch ratings are on the 1-250 scale, so
+# it converts this with to_model_scale)
+PITCH_MINIMUM = 45
+
+
+def role_criteria(stamina, pbabip, pitches=None, potential=False, arsenal=None):
+    """
+    Returns the starter ('sp') and reliever ('rp') criteria other than the groundball test, as boolean arrays.
+    pitches counts each pitcher's pitches rated PITCH_MINIMUM or more; given the arsenal matrix instead, the pitch tests are
+    arsenal queries (see arsenal_query).
+    """
+    stamina_needed = STARTER_STAMINA['potential' if potential else 'current']
+    if arsenal is not None:
+        minimum = to_model_scale(PITCH_MINIMUM)
+        starter_pitches = arsenal_query(arsenal, count=STARTER_PITCHES, minimum=minimum, potential=potential)
+        reliever_pitches = arsenal_query(arsenal, count=RELIEVER_PITCHES, minimum=minimum, potential=potential)
+    else:
+        starter_pitches, reliever_pitches = pitches >= STARTER_PITCHES, pitches >= RELIEVER_PITCHES
+    return {
+        'sp': (stamina >= stamina_needed) & (pbabip >= MIN_PBABIP) & starter_pitches,
+        'rp': reliever_pitches & (pbabip >= MIN_PBABIP),
+    }
+
+
+def projections(batting, talent, fielding, pitching, pitching_talent, parts=RATE_PARTS, splits=None, with_rates=False):
+    """
+    Returns the model's unrounded projections from the ratings alone, keyed by their pistachio.py column names (toWAR,
+    <pos>_tdWAR, <pos>_sWAR, best_sWAR, OPS+, HR, OBP, FIP, p_sWAR and their potential versions).
+    batting and talent are dicts of batting_rates' arguments, fielding as for defence, and pitching and pitching_talent dicts of
+    pitcher_rating's arguments. splits optionally maps SPLITS suffixes to batting ratings, adding toWAR, OPS+ and OBP for each
+    split, and with_rates adds the rates (bb%, bb%_pot and so on). pistachio.py uses this as the float64 reference for a float32
+    run, and whatif.py for hypothetical ratings.
+    """
+    result = {}
+    tdwar = defensive_war(defence(fielding))
+    # current, talent and any splits are stacked (see stack_ratings) and go through the batting kernels in one pass
+    views = [('', '', batting), ('_pot', '_p', talent)] + [(suffix, suffix, ratings) for suffix, ratings in (splits or {}).items()]
+    rates = batting_rates(**stack_ratings(*(ratings for _, _, ratings in views)), parts=parts)
+    towar = offensive_war(rates)
+    summary = batting_summary(rates)
+    for i, (suffix, line_suffix, _) in enumerate(views):
+        result['toWAR' + suffix] = towar[i]
+        result['OPS+' + line_suffix] = summary['ops_plus'][i]
+        result['OBP' + line_suffix] = summary['obp'][i]
+        if suffix in ['', '_pot']:
+            if with_rates:
+                for rate, values in rates.items():
+                    result[rate + '%' + suffix] = values[i]
+            for pos in SWAR_POSITIONS:
+                result[pos + '_sWAR' + suffix] = towar[i] + tdwar[pos]
+            result['best_sWAR' + suffix] = np.fmax.reduce([result[pos + '_sWAR' + suffix] for pos in SWAR_POSITIONS])
+            result['HR' + line_suffix] = summary['hr650'][i]
+    for pos in SWAR_POSITIONS:
+        result[pos + '_tdWAR'] = tdwar[pos] + np.zeros_like(result['toWAR'])
+    fips = fip(pitcher_rating(**stack_ratings(pitching, pitching_talent)))
+    for i, suffix in enumerate(['', '_pot']):
+        result['FIP' + suffix] = fips[i]
+        result['p_sWAR' + suffix] = pitcher_war(fips[i])
+    return result
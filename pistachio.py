@@ -12,6 +12,22 @@ import pandas as pd
 import numpy as np
 import toml
 import os
+import runpy
+import threading
+import model
+import history
+import ingest
+import joins
+import cube
+import changes
+import export
+import leaderboards
+import search
+import roles
+import aging
+import similar
+import snapshots
+import uncertainty
 
 
 
@@ -26,7 +42,12 @@ import os
 
 # specify the folder in which this .ipynb file, flagged.txt and club_lookup.csv are saved
 base_dir = os.path.dirname(os.path.abspath(__file__))
-config = toml.load(base_dir + '/config/settings.toml')
+# a run from the server is handed the settings it started with (config) and their version (config_version, see main.py), and
+# the batches of a chunked run the settings their parent read (see the chunked mode cell), rather than reading the file again,
+# so a settings change mid-run can't project some batches under other settings
+if __name__ != '__batch__':
+    config = globals().get('config') or toml.load(base_dir + '/config/settings.toml')
+    config_version = globals().get('config_version')
 
 filepath = config['Settings']['csv_path']
 
@@ -46,6 +67,72 @@ team_managed = config['Settings']['team_id']
 # setting this to 59 will include groundball and extreme groundball pitchers only; set this lower to include other types of pitchers (54 is league average)
 min_gb = config['Settings']['gb_weight']
 
+# options for this run only, handed in by the server's /runNotebook (see main.py) - eg {'dump': True, 'simulate': True}
+run_options = globals().get('run_options') or {}
+
+# set whether to also write the full merged_df debug dump (reports/merged_df1329.parquet) - this is large and the UI never reads it
+# it can also be turned on for a single run with /runNotebook?dump=1
+dump_merged = config['Settings'].get('dump_merged', False) or run_options.get('dump', False)
+
+# set whether to add Monte Carlo uncertainty bands (p10/p50/p90) to the reports, how many draws to run and how noisy the scouted
+# ratings are taken to be (standard deviation in 1-250 rating points) - it can also be turned on for a single run with /runNotebook?simulate=1
+simulate = config['Settings'].get('simulate', False) or run_options.get('simulate', False)
+simulation_draws = config['Settings'].get('simulation_draws', 1000)
+rating_sd = config['Settings'].get('rating_sd', 10)
+
+# optionally load the batting model's rating -> rate coefficients from a table written by calibrate.py (a path relative to this
+# folder, eg 'config/rate_coefficients.json') - left blank, the built-in coefficients in model.RATE_PARTS are used
+rate_coefficients = config['Settings'].get('rate_coefficients', '')
+rate_parts = model.load_rate_parts(os.path.join(base_dir, rate_coefficients)) if rate_coefficients else model.RATE_PARTS
+
+# set whether to run the model in float32 rather than float64 (half the memory traffic, for very large leagues) - every
+# projection is checked against a float64 re-run at the precision it is published to, see the float32 check below
+float32 = config['Settings'].get('float32', False)
+# the most a float32 projection can be off from float64, relative to the value (or to 1, for values smaller than 1) - twice
+# the largest error measured on a test league
+FLOAT32_ERROR = 2 ** -14
+
+# set a batch size to run in chunked mode, for very large (eg historical) leagues: players are streamed through ingest, the
+# model and the report filters this many at a time (see ingest.py), so memory stays flat however big players.csv is - 0 runs
+# the whole league at once
+chunk_size = config['Settings'].get('chunk_size', 0)
+
+# set whether to prune players who can't reach the report cut-offs before the model runs (see the pruning cell below) -
+# verify_prune runs everyone as usual and lists any reported player pruning would have dropped in reports/prune_check.csv
+prune = config['Settings'].get('prune', False)
+verify_prune = config['Settings'].get('verify_prune', False)
+
+# set whether to fit the OPS+ growth factors and position group tracks from the league's own career stats (see aging.py) rather
+# than use the hard-coded ones below
+fitted_aging = config['Settings'].get('fitted_aging', False)
+
+
+# In[ ]:
+
+
+# in-game date of this export (leagues.csv holds each league's current date), used to key the projection history
+# without one the history is left alone this run rather than keyed by the wall-clock date
+try:
+    game_date = pd.to_datetime(pd.read_csv(filepath + '/leagues.csv', usecols=['current_date'])['current_date']).max()
+except (FileNotFoundError, ValueError):
+    game_date = None
+if pd.isna(game_date):
+    game_date = None
+    print("No in-game date in leagues.csv, the projection history won't be updated this run")
+
+
+# In[ ]:
+
+
+# chunked mode: split the league into batches of players on disk and project the first batch here - the other batches are run
+# through the same cells by the chunked mode cell before the export, as batch runs of this script that are handed their batch
+if __name__ != '__batch__':
+    league_filepath = filepath
+    batches = ingest.partition(filepath, chunk_size, ID, aging=fitted_aging) if chunk_size else []
+    batch = batches[0] if batches else None
+if batch:
+    filepath = batch['path']
+
 
 # In[ ]:
 
@@ -66,29 +153,28 @@ df2 = df2[df2.scouting_coach_id == ID]
 # In[ ]:
 
 
-# merge the dataframes
-merged_df = pd.merge(df1, df2, on='player_id')
-merged_df.rename(columns={'team_id_x': 'team_id'}, inplace=True)
-merged_df.rename(columns={'league_id_x': 'league_id'}, inplace=True)
-merged_df.rename(columns={'position_x': 'position'}, inplace=True)
-merged_df.rename(columns={'role_x': 'role'}, inplace=True)
+# join the scouted ratings onto the players (players this scout hasn't rated are dropped) - where both files have a column
+# (team_id, position, the running ratings...) the players.csv one keeps its name and the scouted one gets a _y suffix
+merged_df = joins.inner(df1, df2, 'player_id')
+
+# the stats tables below are aligned onto merged_df's rows through this one index of its player_ids (see joins.py), adding
+# their columns in place rather than copying the whole frame for every merge
+player_index = joins.index(merged_df['player_id'])
 
 
 # In[ ]:
 
 
-# Read the player career stats csv file for hitters
-stats_df = pd.read_csv(filepath + '/players_career_batting_stats.csv')
+# Read the player career stats csv file for hitters into a stats cube (player x year x level x split, see cube.py)
+# the cube is saved in reports/cubes and reused until the export changes; batches of a chunked run build theirs in memory
+batting_cube = cube.load_or_build(filepath + '/players_career_batting_stats.csv', save=not batch)
 
 
 # In[ ]:
 
 
-# Filtering the dataframe for level_id = 1 and split_id = 1 (this means MLB stats and all pa not just for left or right handers)
-career_stats_df = stats_df[(stats_df['level_id'] == 1) & (stats_df['split_id'] == 1)]
-
-# summing the MLB career stats for each player id
-career_stats_df = career_stats_df.groupby('player_id')[['pa', 'bb', 'k', 'h', 'd', 't', 'hr', 'hp', 'pitches_seen']].sum().reset_index()
+# summing the MLB career stats for each player id (level_id = 1 and split_id = 1, this means MLB stats and all pa not just for left or right handers)
+career_stats_df = cube.totals(batting_cube, ['pa', 'bb', 'k', 'h', 'd', 't', 'hr', 'hp', 'pitches_seen'], level=cube.MLB, split=cube.ALL_SPLITS)
 
 # calculate MLB rate stats (hp = hit by pitch)
 career_stats_df['bb%_mlb'] = career_stats_df['bb'] / career_stats_df['pa']
@@ -110,25 +196,22 @@ career_stats_df = career_stats_df.round(3)
 
 # Merging career_stats_df into merged_df based on player_id
 columns_to_add = ['player_id', 'pa_mlb', 'bb%_mlb', 'k%_mlb', '1b%_mlb', '2b%_mlb', '3b%_mlb', 'hr%_mlb', 'hp%_mlb', 'pitches/plate_appearance_mlb']
-merged_df = merged_df.merge(career_stats_df[columns_to_add], on='player_id', how='left')
+joins.left(merged_df, player_index, career_stats_df[columns_to_add])
 
 
 # In[ ]:
 
 
-# Filter to get the latest year only and where split_id and level_id are both 1 (this means MLB stats and all pa not just for left or right handers)
-stats_df = stats_df[(stats_df['level_id'] == 1) & (stats_df['split_id'] == 1)]
-max_year = stats_df['year'].max()
-stats_df = stats_df[stats_df['year'] == max_year]
-stats_df = stats_df.groupby('player_id')[['ab', 'h', 'k', 'pa', 'pitches_seen', 'g', 'gs', 'd', 't', 'hr', 'r', 'rbi', 'sb', 'cs', 'bb', 'ibb', 'gdp', 'sh', 'sf', 'hp', 'ci', 'wpa', 'stint', 'ubr', 'war']].sum().reset_index()
+# Get the latest year only where split_id and level_id are both 1 (this means MLB stats and all pa not just for left or right handers)
+max_year = batch['max_year']['batting'] if batch else cube.latest_year(batting_cube, level=cube.MLB, split=cube.ALL_SPLITS)
+stats_df = cube.totals(batting_cube, ['ab', 'h', 'k', 'pa', 'pitches_seen', 'g', 'gs', 'd', 't', 'hr', 'r', 'rbi', 'sb', 'cs', 'bb', 'ibb', 'gdp', 'sh', 'sf', 'hp', 'ci', 'wpa', 'stint', 'ubr', 'war'], level=cube.MLB, split=cube.ALL_SPLITS, years=max_year)
 
 
 # In[ ]:
 
 
 # add single-season 'pa' and 'war' to merged_df and standardize war to 650 pa
-merged_df = pd.merge(merged_df, stats_df[['player_id', 'pa', 'war']], on='player_id', how='left')
-merged_df = merged_df.rename(columns={'war': 'WAR_actual'})
+joins.left(merged_df, player_index, stats_df[['player_id', 'pa', 'war']].rename(columns={'war': 'WAR_actual'}))
 merged_df['sWAR_actual'] = (650 / merged_df['pa']) * merged_df['WAR_actual']
 
 
@@ -136,13 +219,10 @@ merged_df['sWAR_actual'] = (650 / merged_df['pa']) * merged_df['WAR_actual']
 
 
 # same idea but pulling out innings pitched for pitchers
-stats_df = pd.read_csv(filepath + '/players_career_pitching_stats.csv')
-stats_df = stats_df[(stats_df['level_id'] == 1) & (stats_df['split_id'] == 1)]
-max_year = stats_df['year'].max()
-stats_df = stats_df[stats_df['year'] == max_year]
-stats_df = stats_df.groupby('player_id')[['ip', 'war', 'ra9war']].sum().reset_index()
-merged_df = pd.merge(merged_df, stats_df[['player_id', 'ip', 'war', 'ra9war']], on='player_id', how='left')
-merged_df = merged_df.rename(columns={'war': 'WAR_actual_p'})
+pitching_cube = cube.load_or_build(filepath + '/players_career_pitching_stats.csv', save=not batch)
+max_year = batch['max_year']['pitching'] if batch else cube.latest_year(pitching_cube, level=cube.MLB, split=cube.ALL_SPLITS)
+stats_df = cube.totals(pitching_cube, ['ip', 'war', 'ra9war'], level=cube.MLB, split=cube.ALL_SPLITS, years=max_year)
+joins.left(merged_df, player_index, stats_df[['player_id', 'ip', 'war', 'ra9war']].rename(columns={'war': 'WAR_actual_p'}))
 merged_df['sWAR_actual_p'] = (180 / merged_df['ip']) * merged_df['WAR_actual_p']
 
 # replace NaN with blank in ip column
@@ -166,8 +246,8 @@ columns_to_drop = [
     "dtd_injury_effect_throw2", "dtd_injury_effect_run2", "prone_overall", "prone_leg",
     "prone_back", "prone_arm", "fatigue_pitches0", "fatigue_pitches1", "fatigue_pitches2",
     "fatigue_pitches3", "fatigue_pitches4", "fatigue_pitches5", "fatigue_points",
-    "fatigue_played_today", "running_ratings_speed_x", "running_ratings_stealing_x",
-    "running_ratings_baserunning_x", "college", "school",
+    "fatigue_played_today", "running_ratings_speed", "running_ratings_stealing",
+    "running_ratings_baserunning", "college", "school",
     "commit_school", "hidden", "turned_coach", "hall_of_fame", "rust", "inducted",
     "strategy_override_team", "strategy_stealing", "strategy_running", "strategy_bunt_for_hit",
     "strategy_sac_bunt", "strategy_hit_run", "strategy_hook_start", "strategy_hook_relief",
@@ -259,13 +339,8 @@ for original_col, new_col in column_mapping.items():
 
 # replace the 20-100 ratings with ratings on a 1-250 scale in line with the export from OOTP 2024, which the calculations below are based on
 
-# Define the find-replace mapping between the 20-100 scale and the 1-250 scale
-replace_map = {
-    20: 6,  25: 20,  30: 35,  35: 52,  40: 69,
-    45: 85,  50: 101,  55: 117,  60: 134,  65: 150,
-    70: 166,  75: 181,  80: 201,  85: 213,  90: 225,
-    95: 238,  100: 250
-}
+# Define the find-replace mapping between the 20-100 scale and the 1-250 scale (kept in model.py, as calibrate.py uses it too)
+replace_map = model.RATING_SCALE_MAP
 
 # List of columns to apply the replacement
 columns_to_replace = [
@@ -274,6 +349,11 @@ columns_to_replace = [
     "batting_ratings_overall_babip", "batting_ratings_talent_eye",
     "batting_ratings_talent_strikeouts", "batting_ratings_talent_power",
     "batting_ratings_talent_gap", "batting_ratings_talent_babip",
+    "batting_ratings_vsl_eye", "batting_ratings_vsl_strikeouts",
+    "batting_ratings_vsl_power", "batting_ratings_vsl_gap",
+    "batting_ratings_vsl_babip", "batting_ratings_vsr_eye",
+    "batting_ratings_vsr_strikeouts", "batting_ratings_vsr_power",
+    "batting_ratings_vsr_gap", "batting_ratings_vsr_babip",
     "fielding_ratings_catcher_ability", "fielding_ratings_catcher_arm", "fielding_ratings_catcher_framing",
     "fielding_ratings_infield_range", "fielding_ratings_infield_error",
     "fielding_ratings_infield_arm", "fielding_ratings_turn_doubleplay",
@@ -303,458 +383,155 @@ merged_df[columns_to_replace] = merged_df[columns_to_replace].replace(replace_ma
 # In[ ]:
 
 
-# calculate standardized WAR for hitters based on the MOPS projection system by Sgt Mushroom
-
-# calculate bb%
-def calculate_bb(row):
-    if row['batting_ratings_overall_eye'] <= 100:
-        return ((row['batting_ratings_overall_eye'] * 0.0007268758188) + 0.001460739)
-    elif row['batting_ratings_overall_eye'] > 100:
-        return ((row['batting_ratings_overall_eye'] * 0.0012280964) - 0.0469974639)
-
-merged_df['bb%'] = merged_df.apply(calculate_bb, axis=1)
-
-
-# In[ ]:
-
-
-# calculate k% (with fudge factor to account for high avK players having too high a OPS+ projection vs career performance - this is based on OOTP 24 gameplay experience)
-# 0.1 is the fudge factor - this is applied here and in the potential calculations
-# strikeout rating also capped at 180 to prevent sky-high k% projections
-# before adding this players with high avK and gap power but low HR power were getting too high of an OPS+ projection
-
-def calculate_k(row):
-    # Cap batting_ratings_overall_strikeouts at 180
-    strikeouts = min(row['batting_ratings_overall_strikeouts'], 180)
-
-    # Adjusted strikeouts calculation
-    adjusted_strikeouts = strikeouts + ((100 - strikeouts) * 0.1)
-
-    # Apply formula based on strikeout level
-    if strikeouts <= 100:
-        return (adjusted_strikeouts * -0.002454367) + 0.4655792299
-    elif 101 <= strikeouts <= 220:
-        return (adjusted_strikeouts * -0.0016592514) + 0.383395059
-    else:
-        return (adjusted_strikeouts * 0) + 0.02385
-
-# Apply function to calculate 'k%'
-merged_df['k%'] = merged_df.apply(calculate_k, axis=1)
-
-
-# In[ ]:
-
-
-# add new function to calculate hr%
-def calculate_hr(row):
-    if row['batting_ratings_overall_power'] <= 100:
-        return (row['batting_ratings_overall_power'] * 0.0001965717055) + 0.0057097943
-    elif row['batting_ratings_overall_power'] > 100:
-        return (row['batting_ratings_overall_power'] * 0.0005767110238) - 0.0305087264
-
-merged_df['hr%'] = merged_df.apply(calculate_hr, axis=1)
-
-
-# In[ ]:
-
-
-# Adjusted function to calculate part1_2b with fudge factor to reduce impact of batting_ratings_overall_gap (0.6666 is the fudge factor)
-def calculate_part1_2b(row):
-    # Reduce impact by adjusting the distance to 100
-    adjusted_gap = row['batting_ratings_overall_gap'] - ((row['batting_ratings_overall_gap'] - 100) * 0.6666)
-    return (adjusted_gap * 0.0005759923464) + 0.0046460781
-
-# Function to calculate part2_2b
-def calculate_part2_2b(row):
-    if row['batting_ratings_overall_power'] <= 100:
-        return (row['batting_ratings_overall_power'] * -0.0000508547503) + 0.0669597896 - 0.0628
-    else:
-        return (row['batting_ratings_overall_power'] * -0.00008542726043) + 0.071154717 - 0.0628
-
-# Function to calculate part3_2b
-def calculate_part3_2b(row):
-    if row['batting_ratings_overall_strikeouts'] <= 100:
-        return (row['batting_ratings_overall_strikeouts'] * -0.0002084865135) + 0.0828934273 - 0.0628
-    elif 101 <= row['batting_ratings_overall_strikeouts'] <= 220:
-        return (row['batting_ratings_overall_strikeouts'] * -0.000008259599351) + 0.0708287518 - 0.0628
-    else:
-        return (row['batting_ratings_overall_strikeouts'] * 0) + 0.053 - 0.0628
-
-# Apply calculations to dataframe
-merged_df['part1_2b'] = merged_df.apply(calculate_part1_2b, axis=1)
-merged_df['part2_2b'] = merged_df.apply(calculate_part2_2b, axis=1)
-merged_df['part3_2b'] = merged_df.apply(calculate_part3_2b, axis=1)
-
-# Compute final 2b% value
-merged_df['2b%'] = merged_df['part1_2b'] + merged_df['part2_2b'] + merged_df['part3_2b']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_2b', 'part2_2b', 'part3_2b'])
-
-
-# In[ ]:
-
-
-# add new function to calculate 3b%
-
-def calculate_part1_3b(row):
-    return (row['batting_ratings_overall_gap'] * 0.00004451978242) + 0.00007767274633
-
-def calculate_part2_3b(row):
-    if row['batting_ratings_overall_power'] <= 100:
-        return (row['batting_ratings_overall_power'] * -0.00000206286281) + 0.0046134367 - 0.0044
-    else:
-        return (row['batting_ratings_overall_power'] * -0.000007041275071) + 0.0051236727 - 0.0044
-
-def calculate_part3_3b(row):
-    if row['batting_ratings_overall_strikeouts'] <= 100:
-        return (row['batting_ratings_overall_strikeouts'] * -0.00001098275967) + 0.0055735013 - 0.0044
-    elif 101 <= row['batting_ratings_overall_strikeouts'] <= 220:
-        return (row['batting_ratings_overall_strikeouts'] * -0.00000526736139) + 0.0048976614 - 0.0044
-    else:
-        return (row['batting_ratings_overall_strikeouts'] * 0) + 0.0037 - 0.0044
-
-merged_df['part1_3b'] = merged_df.apply(calculate_part1_3b, axis=1)
-merged_df['part2_3b'] = merged_df.apply(calculate_part2_3b, axis=1)
-merged_df['part3_3b'] = merged_df.apply(calculate_part3_3b, axis=1)
-
-merged_df['3b%'] = merged_df['part1_3b'] + merged_df['part2_3b'] + merged_df['part3_3b']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_3b', 'part2_3b', 'part3_3b'])
-
-
-# In[ ]:
-
-
-# calculate 1b%
-
-def calculate_part1_1b(row):
-    if row['batting_ratings_overall_babip'] <= 100:
-        return (row['batting_ratings_overall_babip'] * 0.0015140038) + 0.1281801944
-    else:
-        return (row['batting_ratings_overall_babip'] * 0.000964994955) + 0.1837822012
-
-def calculate_part2_1b(row):
-    return (row['batting_ratings_overall_gap'] * -0.0003887320573) + 0.3178756912 - 0.28
-
-def calculate_part3_1b(row):
-    if row['batting_ratings_overall_strikeouts'] <= 100:
-        return (row['batting_ratings_overall_strikeouts'] * 0.000149985378) + 0.2648525907 - 0.28
-    elif 101 <= row['batting_ratings_overall_strikeouts'] <= 220:
-        return (row['batting_ratings_overall_strikeouts'] * 0.00005179135613) + 0.2754044069 - 0.28
-    else:
-        return (row['batting_ratings_overall_strikeouts'] * 0) + 0.286 - 0.28
-
-merged_df['part1_1b'] = merged_df.apply(calculate_part1_1b, axis=1)
-merged_df['part2_1b'] = merged_df.apply(calculate_part2_1b, axis=1)
-merged_df['part3_1b'] = merged_df.apply(calculate_part3_1b, axis=1)
-
-merged_df['1b%'] = merged_df['part1_1b'] + merged_df['part2_1b'] + merged_df['part3_1b']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_1b', 'part2_1b', 'part3_1b'])
-
-
-# In[ ]:
-
-
-# calculate Offensive Runs Created per game (orc_per_game)
-merged_df['orc_per_game'] = ((merged_df['bb%'] - 0.0738) / 0.875) + ((merged_df['k%'] - 0.2195) / -1.217) + ((merged_df['hr%'] - 0.0272) / 0.219) + ((merged_df['2b%'] - 0.0628) / 0.693) + ((merged_df['3b%'] - 0.0044) / 0.0519) + ((merged_df['1b%'] - 0.28) / 0.594)
-
-
-# In[ ]:
-
-
-# calculate offensive WAR
-merged_df['toWAR'] = (merged_df['orc_per_game'] * 162) / 10
-
-
-# In[ ]:
-
-
-# calculate c_def (catcher defense)
-
-def calculate_part1_c_def(row):
-    if row['fielding_ratings_catcher_framing'] <= 40:
-        return (row['fielding_ratings_catcher_framing'] * 0) + 5.311
-    elif 41 <= row['fielding_ratings_catcher_framing'] <= 61:
-        return (row['fielding_ratings_catcher_framing'] * -0.0204) + 6.125
-    else:
-        return (row['fielding_ratings_catcher_framing'] * -0.0028608333) + 4.998622222
-
-def calculate_part2_c_def(row):
-    return (row['fielding_ratings_catcher_arm'] * -0.0006034965035) + 4.712621212
-
-merged_df['part1_c_def'] = merged_df.apply(calculate_part1_c_def, axis=1)
-merged_df['part2_c_def'] = merged_df.apply(calculate_part2_c_def, axis=1)
-
-merged_df['c_def'] = 4.6385 - merged_df['part1_c_def'] + 4.6385 - merged_df['part2_c_def']
+# the model's rating inputs, under the names the model.py kernels take them by
+batting_columns = {
+    'eye': 'batting_ratings_overall_eye', 'avoidk': 'batting_ratings_overall_strikeouts', 'power': 'batting_ratings_overall_power',
+    'gap': 'batting_ratings_overall_gap', 'babip': 'batting_ratings_overall_babip'
+}
+talent_columns = {name: column.replace('_overall_', '_talent_') for name, column in batting_columns.items()}
+# the current ratings vs left- and right-handed pitching (see model.SPLITS), eg split_columns['_vsL']['eye'] is batting_ratings_vsl_eye
+split_columns = {suffix: {name: column.replace('_overall_', '_' + split + '_') for name, column in batting_columns.items()}
+                 for suffix, split in model.SPLITS.items()}
+fielding_columns = {
+    'framing': 'fielding_ratings_catcher_framing', 'catcher_arm': 'fielding_ratings_catcher_arm', 'height': 'height',
+    'if_range': 'fielding_ratings_infield_range', 'if_error': 'fielding_ratings_infield_error', 'if_arm': 'fielding_ratings_infield_arm',
+    'turn_dp': 'fielding_ratings_turn_doubleplay', 'of_arm': 'fielding_ratings_outfield_arm', 'of_range': 'fielding_ratings_outfield_range',
+    'of_error': 'fielding_ratings_outfield_error'
+}
+pitching_columns = {'stuff': 'stuff2080', 'control': 'ctrl2080', 'hra': 'hra2080', 'pbabip': 'pbabip2080'}
+pitching_talent_columns = {name: column + 'p' for name, column in pitching_columns.items()}
+model_input_columns = [column for columns in [batting_columns, talent_columns, *split_columns.values(), fielding_columns, pitching_columns,
+                                              pitching_talent_columns]
+                       for column in columns.values()]
 
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_c_def', 'part2_c_def'])
+# in float32 mode the inputs are held as float32, and the kernels keep float32 input in float32 all the way through
+# (the ratings are whole numbers, so they are exact either way)
+if float32:
+    merged_df[model_input_columns] = merged_df[model_input_columns].astype(np.float32)
 
 
 # In[ ]:
 
 
-# calculate 1b_def
-
-def calculate_part1_1b_def(row):
-    return (row['height'] * -0.0014708625) + 4.917895105
-
-def calculate_part2_1b_def(row):
-    return (row['fielding_ratings_infield_range'] * -0.0001325174825) + 4.645893939
-
-def calculate_part3_1b_def(row):
-    return (row['fielding_ratings_infield_error'] * -0.0001685314685) + 4.658242424
-
-def calculate_part4_1b_def(row):
-    return (row['fielding_ratings_infield_arm'] * 0) + 4.6385
-
-def calculate_part5_1b_def(row):
-    return (row['fielding_ratings_turn_doubleplay'] * 0) + 4.6385
-
-merged_df['part1_1b_def'] = merged_df.apply(calculate_part1_1b_def, axis=1)
-merged_df['part2_1b_def'] = merged_df.apply(calculate_part2_1b_def, axis=1)
-merged_df['part3_1b_def'] = merged_df.apply(calculate_part3_1b_def, axis=1)
-merged_df['part4_1b_def'] = merged_df.apply(calculate_part4_1b_def, axis=1)
-merged_df['part5_1b_def'] = merged_df.apply(calculate_part5_1b_def, axis=1)
-
-merged_df['1b_def'] = 4.6385 - merged_df['part1_1b_def'] + 4.6385 - merged_df['part2_1b_def'] + 4.6385 - merged_df['part3_1b_def'] + 4.6385 - merged_df['part4_1b_def'] + 4.6385 - merged_df['part5_1b_def']
+# Read names from text file into a list - paste in here players to be flagged (eg players available in draft, or players in a shortlist or player search)
+# read once, before pruning (which always keeps them), and handed to each batch of a chunked run by its parent
+if __name__ != '__batch__':
+    with open(base_dir + '/config/flagged.txt', 'r') as f:
+        flagged_names = f.read().splitlines()
 
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_1b_def', 'part2_1b_def', 'part3_1b_def', 'part4_1b_def', 'part5_1b_def'])
+# match them against the normalized names (see search.normalize), so case and accents don't matter
+merged_df['in_list'] = np.where(search.flagged_mask(merged_df['first_name'] + " " + merged_df['last_name'], flagged_names), 'flagged', '')
 
 
 # In[ ]:
 
 
-# calculate 2b_def
-
-def calculate_part1_2b_def(row):
-    if row['fielding_ratings_turn_doubleplay'] <= 200:
-        return (row['fielding_ratings_turn_doubleplay'] * -0.0012715152) + 4.825866667
-    else:
-        return (row['fielding_ratings_turn_doubleplay'] * 0) + 4.569020596
-
-def calculate_part2_2b_def(row):
-    return (row['fielding_ratings_infield_range'] * -0.0016293706) + 4.844484848
-
-def calculate_part3_2b_def(row):
-    if row['fielding_ratings_infield_error'] <= 160:
-        return (row['fielding_ratings_infield_error'] * -0.0006464285714) + 4.720428571
+# every player's rating profile and MLB outcomes, for the comparable players search (see similar.py) - taken before pruning, as
+# a draft pick or trade target is compared with the whole league rather than just the players who could be reported (the
+# name, club and OPS+_mlb are worked out as the cells below work them out for the reports)
+club_lookup = pd.read_csv(base_dir + '/config/club_lookup.csv')
+comparables = merged_df[[column for column in similar.COLUMNS if column in merged_df]].assign(
+    name=merged_df['first_name'] + " " + merged_df['last_name'],
+    club=joins.lookup(merged_df['organization_id'], club_lookup['club_id'], club_lookup['club']),
+    **{'OPS+_mlb': model.batting_summary({rate: merged_df[rate + '%_mlb'] for rate in model.RATE_PARTS}, per_pa=True)['ops_plus'].round(0)}
+)[similar.COLUMNS]
+# each batch of a chunked run writes its players next to its csv files, for the chunked mode cell to read back once every
+# batch has run, rather than holding them
+if batch:
+    export.write_parquet(comparables, batch['path'] + '/comparables.parquet')
+    del comparables
+
+
+# In[ ]:
+
+
+# bound-based pruning: most players are low-rated minor leaguers who can't reach the report cut-offs (best_sWAR, best_sWAR_pot,
+# sp or rp sWAR of 0.1), so they are bounded cheaply here and only the candidates go through the model below
+# the bounds cover current and potential at once: toWAR with the better of current and talent for each rate curve (see
+# model.offensive_war_bound) plus the best positional tdWAR, and p_sWAR at the higher of each current and talent pitching rating
+# (see model.pitcher_war_bound) - the managed club's players and flagged players are always kept, as they are always reported
+# the cut-off allows for the batter report filtering on sWAR rounded to 2 dp, with room to spare for float32
+prune_cutoff = 0.09
+if prune or verify_prune:
+    batting_bound = model.offensive_war_bound(
+        {name: merged_df[column] for name, column in batting_columns.items()},
+        {name: merged_df[column] for name, column in talent_columns.items()},
+        parts=rate_parts
+    )
+    tdwar = model.defensive_war(model.defence({name: merged_df[column] for name, column in fielding_columns.items()}))
+    batting_bound = batting_bound + np.fmax.reduce([np.broadcast_to(tdwar[pos], len(merged_df)) for pos in model.SWAR_POSITIONS])
+    pitching_bound = model.pitcher_war_bound(
+        {name: merged_df[column] for name, column in pitching_columns.items()},
+        {name: merged_df[column] for name, column in pitching_talent_columns.items()}
+    )
+
+    candidate = np.asarray((batting_bound >= prune_cutoff) | (pitching_bound >= prune_cutoff)
+                           | (joins.lookup(merged_df['organization_id'], club_lookup['club_id'], club_lookup['club']) == team_managed)
+                           | (merged_df['in_list'] == 'flagged'))
+    print(f"pruning: {int(candidate.sum())} of {len(merged_df)} players are candidates for the reports")
+
+    if prune and not verify_prune:
+        merged_df = merged_df[candidate].reset_index(drop=True)
     else:
-        return (row['fielding_ratings_infield_error'] * 0) + 4.628635714
-
-def calculate_part4_2b_def(row):
-    return (row['fielding_ratings_infield_arm'] * -0.0002284965035) + 4.658287879
-
-merged_df['part1_2b_def'] = merged_df.apply(calculate_part1_2b_def, axis=1)
-merged_df['part2_2b_def'] = merged_df.apply(calculate_part2_2b_def, axis=1)
-merged_df['part3_2b_def'] = merged_df.apply(calculate_part3_2b_def, axis=1)
-merged_df['part4_2b_def'] = merged_df.apply(calculate_part4_2b_def, axis=1)
-
-merged_df['2b_def'] = 4.6385 - merged_df['part1_2b_def'] + 4.6385 - merged_df['part2_2b_def'] + 4.6385 - merged_df['part3_2b_def'] + 4.6385 - merged_df['part4_2b_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_2b_def', 'part2_2b_def', 'part3_2b_def', 'part4_2b_def'])
+        pruned_ids = merged_df['player_id'].to_numpy()[~candidate]
 
 
 # In[ ]:
 
 
-# calculate 3b_def
-
-def calculate_part1_3b_def(row):
-    return (row['fielding_ratings_turn_doubleplay'] * 0) + 4.6385
-
-def calculate_part2_3b_def(row):
-    return (row['fielding_ratings_infield_range'] * -0.0015907343) + 4.808545455
-
-def calculate_part3_3b_def(row):
-    if row['fielding_ratings_infield_error'] <= 180:
-        return (row['fielding_ratings_infield_error'] * -0.0008091666667) + 4.748583333
-    else:
-        return (row['fielding_ratings_infield_error'] * 0) + 4.61
-
-def calculate_part4_3b_def(row):
-    if row['fielding_ratings_infield_arm'] <= 60:
-        return (row['fielding_ratings_infield_arm'] * 0) + 4.788
-    else:
-        return (row['fielding_ratings_infield_arm'] * -0.0021283333) + 4.963644444
-
-merged_df['part1_3b_def'] = merged_df.apply(calculate_part1_3b_def, axis=1)
-merged_df['part2_3b_def'] = merged_df.apply(calculate_part2_3b_def, axis=1)
-merged_df['part3_3b_def'] = merged_df.apply(calculate_part3_3b_def, axis=1)
-merged_df['part4_3b_def'] = merged_df.apply(calculate_part4_3b_def, axis=1)
-
-merged_df['3b_def'] = 4.6385 - merged_df['part1_3b_def'] + 4.6385 - merged_df['part2_3b_def'] + 4.6385 - merged_df['part3_3b_def'] + 4.6385 - merged_df['part4_3b_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_3b_def', 'part2_3b_def', 'part3_3b_def', 'part4_3b_def'])
-
+# calculate standardized WAR for hitters based on the MOPS projection system by Sgt Mushroom
+# bb%, k%, hr%, 2b%, 3b% and 1b% are each a sum of piecewise-linear curves of the batting ratings, held in model.RATE_PARTS
+# (along with the fudge factors: avoid K capped at 180 and pulled 10% back to 100, and gap pulled two thirds back to 100 for 2b%)
+# each curve is evaluated over all players at once
+# the overall ratings are stacked with the vs LHP and vs RHP ones (see model.stack_ratings), so the split rates come out of the
+# same pass - row 0 is the overall view and row i the i-th of model.SPLITS
+batting_views = model.stack_ratings(
+    {name: merged_df[column] for name, column in batting_columns.items()},
+    *({name: merged_df[column] for name, column in columns.items()} for columns in split_columns.values())
+)
+rates_by_view = model.batting_rates(**batting_views, parts=rate_parts)
+rates = {rate: values[0] for rate, values in rates_by_view.items()}
+for rate, values in rates.items():
+    merged_df[rate + '%'] = values
+for i, suffix in enumerate(model.SPLITS, 1):
+    for rate in ['bb', 'k', 'hr']:
+        merged_df[rate + '%' + suffix] = rates_by_view[rate][i]
 
 
 # In[ ]:
 
 
-# calculate ss_def
-
-def calculate_part1_ss_def(row):
-    if row['fielding_ratings_turn_doubleplay'] <= 200:
-        return (row['fielding_ratings_turn_doubleplay'] * -0.0007603030303) + 4.7435333333
-    else:
-        return (row['fielding_ratings_turn_doubleplay'] * 0) + 4.597
-
-def calculate_part2_ss_def(row):
-    if row['fielding_ratings_infield_range'] <= 60:
-        return (row['fielding_ratings_infield_range'] * 0) + 4.985
-    else:
-        return (row['fielding_ratings_infield_range'] * -0.0045308333) + 5.330155556
-
-def calculate_part3_ss_def(row):
-    if row['fielding_ratings_infield_error'] <= 180:
-        return (row['fielding_ratings_infield_error'] * -0.0011291667) + 4.793027778
-    else:
-        return (row['fielding_ratings_infield_error'] * 0) + 4.588
-
-def calculate_part4_ss_def(row):
-    return (row['fielding_ratings_infield_arm'] * -0.0011823427) + 4.809787879
-
-merged_df['part1_ss_def'] = merged_df.apply(calculate_part1_ss_def, axis=1)
-merged_df['part2_ss_def'] = merged_df.apply(calculate_part2_ss_def, axis=1)
-merged_df['part3_ss_def'] = merged_df.apply(calculate_part3_ss_def, axis=1)
-merged_df['part4_ss_def'] = merged_df.apply(calculate_part4_ss_def, axis=1)
-
-merged_df['ss_def'] = 4.6385 - merged_df['part1_ss_def'] + 4.6385 - merged_df['part2_ss_def'] + 4.6385 - merged_df['part3_ss_def'] + 4.6385 - merged_df['part4_ss_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_ss_def', 'part2_ss_def', 'part3_ss_def', 'part4_ss_def'])
+# calculate offensive WAR from Offensive Runs Created per game, overall and vs LHP / vs RHP
+towar_by_view = model.offensive_war(rates_by_view)
+merged_df['toWAR'] = towar_by_view[0]
+for i, suffix in enumerate(model.SPLITS, 1):
+    merged_df['toWAR' + suffix] = towar_by_view[i]
 
 
 # In[ ]:
 
 
-# calculate lf_def
-
-def calculate_part1_lf_def(row):
-    return (row['fielding_ratings_outfield_arm'] * -0.000190034965) + 4.665287879
-
-def calculate_part2_lf_def(row):
-    if row['fielding_ratings_outfield_range'] <= 40:
-        return (row['fielding_ratings_outfield_range'] * 0) + 4.9135
-    elif 41 <= row['fielding_ratings_outfield_range'] <= 80:
-        return (row['fielding_ratings_outfield_range'] * -0.000825) + 4.9445
-    elif 81 <= row['fielding_ratings_outfield_range'] <= 100:
-        return (row['fielding_ratings_outfield_range'] * -0.01135) + 5.787
-    elif 101 <= row['fielding_ratings_outfield_range'] <= 180:
-        return (row['fielding_ratings_outfield_range'] * -0.000625) + 4.661
-    else:
-        return (row['fielding_ratings_outfield_range'] * 0) + 4.54
-
-def calculate_part3_lf_def(row):
-    return (row['fielding_ratings_outfield_error'] * 0) + 4.6385
-
-merged_df['part1_lf_def'] = merged_df.apply(calculate_part1_lf_def, axis=1)
-merged_df['part2_lf_def'] = merged_df.apply(calculate_part2_lf_def, axis=1)
-merged_df['part3_lf_def'] = merged_df.apply(calculate_part3_lf_def, axis=1)
-
-merged_df['lf_def'] = 4.6385 - merged_df['part1_lf_def'] + 4.6385 - merged_df['part2_lf_def'] + 4.6385 - merged_df['part3_lf_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_lf_def', 'part2_lf_def', 'part3_lf_def'])
+# calculate defence at each position from the fielding ratings (see model.DEFENCE_PARTS), measured against the league average of 4.6385
+fielding_ratings = {name: merged_df[column] for name, column in fielding_columns.items()}
+defence = model.defence(fielding_ratings)
+for pos, values in defence.items():
+    merged_df[pos + '_def'] = values
 
 
 # In[ ]:
 
 
-# calculate cf_def
-
-def calculate_part1_cf_def(row):
-    return (row['fielding_ratings_outfield_arm'] * -0.000190034965) + 4.665287879
-
-def calculate_part2_cf_def(row):
-    if row['fielding_ratings_outfield_range'] <= 80:
-        return (row['fielding_ratings_outfield_range'] * 0) + 4.86
-    else:
-        return (row['fielding_ratings_outfield_range'] * -0.0030625) + 5.15075
-
-def calculate_part3_cf_def(row):
-    return (row['fielding_ratings_outfield_error'] * -0.0001664335664) + 4.659636364
-
-merged_df['part1_cf_def'] = merged_df.apply(calculate_part1_cf_def, axis=1)
-merged_df['part2_cf_def'] = merged_df.apply(calculate_part2_cf_def, axis=1)
-merged_df['part3_cf_def'] = merged_df.apply(calculate_part3_cf_def, axis=1)
-
-merged_df['cf_def'] = 4.6385 - merged_df['part1_cf_def'] + 4.6385 - merged_df['part2_cf_def'] + 4.6385 - merged_df['part3_cf_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_cf_def', 'part2_cf_def', 'part3_cf_def'])
-
-
-# In[ ]:
-
-
-# calculate rf_def
-
-def calculate_part1_rf_def(row):
-    if row['fielding_ratings_outfield_arm'] <= 60:
-        return (row['fielding_ratings_outfield_arm'] * 0) + 4.683
-    elif 61 <= row['fielding_ratings_outfield_arm'] <= 180:
-        return (row['fielding_ratings_outfield_arm'] * -0.0005428571429) + 4.716142857
-    else:
-        return (row['fielding_ratings_outfield_arm'] * 0) + 4.618
-
-def calculate_part2_rf_def(row):
-    if row['fielding_ratings_outfield_range'] <= 80:
-        return (row['fielding_ratings_outfield_range'] * -0.000455) + 4.89
-    elif 81 <= row['fielding_ratings_outfield_range'] <= 160:
-        return (row['fielding_ratings_outfield_range'] * -0.004385) + 5.1866
-    else:
-        return (row['fielding_ratings_outfield_range'] * 0) + 4.5
-
-def calculate_part3_rf_def(row):
-    return (row['fielding_ratings_outfield_error'] * 0) + 4.6385
-
-merged_df['part1_rf_def'] = merged_df.apply(calculate_part1_rf_def, axis=1)
-merged_df['part2_rf_def'] = merged_df.apply(calculate_part2_rf_def, axis=1)
-merged_df['part3_rf_def'] = merged_df.apply(calculate_part3_rf_def, axis=1)
-
-merged_df['rf_def'] = 4.6385 - merged_df['part1_rf_def'] + 4.6385 - merged_df['part2_rf_def'] + 4.6385 - merged_df['part3_rf_def']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_rf_def', 'part2_rf_def', 'part3_rf_def'])
-
-
-# In[ ]:
-
-
-# calculate defensive WAR (tdWAR) for each position
-merged_df['c_tdWAR'] = ((merged_df['c_def'] * 162) / 10) + 1.5
-merged_df['1b_tdWAR'] = ((merged_df['1b_def'] * 162) / 10) + 0.5
-merged_df['2b_tdWAR'] = ((merged_df['2b_def'] * 162) / 10) + 1.75
-merged_df['3b_tdWAR'] = ((merged_df['3b_def'] * 162) / 10) + 1.8
-merged_df['ss_tdWAR'] = ((merged_df['ss_def'] * 162) / 10) + 2
-merged_df['lf_tdWAR'] = ((merged_df['lf_def'] * 162) / 10) + 0.3
-merged_df['cf_tdWAR'] = ((merged_df['cf_def'] * 162) / 10) + 2.5
-merged_df['rf_tdWAR'] = ((merged_df['rf_def'] * 162) / 10) + 0.6
-merged_df['dh_tdWAR'] = 0
+# calculate defensive WAR (tdWAR) for each position, including the positional adjustment (DH is 0)
+for pos, values in model.defensive_war(defence).items():
+    merged_df[pos + '_tdWAR'] = values
 
 
 # In[ ]:
 
 
 # calculate standardised WAR (sWAR) at each position
-merged_df['c_sWAR'] = merged_df['toWAR'] + merged_df['c_tdWAR']
-merged_df['1b_sWAR'] = merged_df['toWAR'] + merged_df['1b_tdWAR']
-merged_df['2b_sWAR'] = merged_df['toWAR'] + merged_df['2b_tdWAR']
-merged_df['3b_sWAR'] = merged_df['toWAR'] + merged_df['3b_tdWAR']
-merged_df['ss_sWAR'] = merged_df['toWAR'] + merged_df['ss_tdWAR']
-merged_df['lf_sWAR'] = merged_df['toWAR'] + merged_df['lf_tdWAR']
-merged_df['cf_sWAR'] = merged_df['toWAR'] + merged_df['cf_tdWAR']
-merged_df['rf_sWAR'] = merged_df['toWAR'] + merged_df['rf_tdWAR']
-merged_df['dh_sWAR'] = merged_df['toWAR'] + merged_df['dh_tdWAR']
+for pos in model.SWAR_POSITIONS:
+    merged_df[pos + '_sWAR'] = merged_df['toWAR'] + merged_df[pos + '_tdWAR']
 
 
 # In[ ]:
@@ -777,179 +554,32 @@ merged_df['name'] = merged_df['first_name'] + " " + merged_df['last_name']
 # In[ ]:
 
 
-# following cells recalculate the MOPS methodology for all batters, but using talent not overall ratings
-
-# add new function to calculate bb%_potential
-def calculate_bb_pot(row):
-    if row['batting_ratings_talent_eye'] <= 100:
-        return ((row['batting_ratings_talent_eye'] * 0.0007268758188) + 0.001460739)
-    elif row['batting_ratings_talent_eye'] >= 101:
-        return ((row['batting_ratings_talent_eye'] * 0.0012280964) - 0.0469974639)
-
-merged_df['bb%_pot'] = merged_df.apply(calculate_bb_pot, axis=1)
-
-
-# In[ ]:
-
-
-# k%_potential (using the same 'fudge factor' adjustments as for k%)
-def calculate_k_pot(row):
-    # Cap batting_ratings_talent_strikeouts at 180
-    strikeouts = min(row['batting_ratings_talent_strikeouts'], 180)
-
-    # Adjusted strikeouts calculation
-    adjusted_strikeouts = strikeouts + ((100 - strikeouts) * 0.1)
-
-    # Apply formula based on strikeout level
-    if strikeouts <= 100:
-        return (adjusted_strikeouts * -0.002454367) + 0.4655792299
-    elif 101 <= strikeouts <= 220:
-        return (adjusted_strikeouts * -0.0016592514) + 0.383395059
-    else:
-        return (adjusted_strikeouts * 0) + 0.02385
-
-# Apply function to calculate 'k%_pot'
-merged_df['k%_pot'] = merged_df.apply(calculate_k_pot, axis=1)
-
-
-# In[ ]:
-
-
-# calculate hr%_potential
-def calculate_hr_pot(row):
-    if row['batting_ratings_talent_power'] <= 100:
-        return (row['batting_ratings_talent_power'] * 0.0001965717055) + 0.0057097943
-    elif row['batting_ratings_talent_power'] > 100:
-        return (row['batting_ratings_talent_power'] * 0.0005767110238) - 0.0305087264
-
-merged_df['hr%_pot'] = merged_df.apply(calculate_hr_pot, axis=1)
-
-
-# In[ ]:
-
-
-# calculate 2b% potential with same fudge factor adjustment as 2b%
-def calculate_part1_2b_pot(row):
-    # Reduce impact by adjusting the distance to 100 (multiplying by 0.6666 instead of direct value)
-    adjusted_gap = row['batting_ratings_talent_gap'] - ((row['batting_ratings_talent_gap'] - 100) * 0.6666)
-    return (adjusted_gap * 0.0005759923464) + 0.0046460781
-
-# Function to calculate part2_2b_pot
-def calculate_part2_2b_pot(row):
-    if row['batting_ratings_talent_power'] <= 100:
-        return (row['batting_ratings_talent_power'] * -0.0000508547503) + 0.0669597896 - 0.0628
-    else:
-        return (row['batting_ratings_talent_power'] * -0.00008542726043) + 0.071154717 - 0.0628
-
-# Function to calculate part3_2b_pot
-def calculate_part3_2b_pot(row):
-    if row['batting_ratings_talent_strikeouts'] <= 100:
-        return (row['batting_ratings_talent_strikeouts'] * -0.0002084865135) + 0.0828934273 - 0.0628
-    elif 101 <= row['batting_ratings_talent_strikeouts'] <= 220:
-        return (row['batting_ratings_talent_strikeouts'] * -0.000008259599351) + 0.0708287518 - 0.0628
-    else:
-        return (row['batting_ratings_talent_strikeouts'] * 0) + 0.053 - 0.0628
-
-# Apply calculations to dataframe
-merged_df['part1_2b_pot'] = merged_df.apply(calculate_part1_2b_pot, axis=1)
-merged_df['part2_2b_pot'] = merged_df.apply(calculate_part2_2b_pot, axis=1)
-merged_df['part3_2b_pot'] = merged_df.apply(calculate_part3_2b_pot, axis=1)
-
-# Compute final 2b%_pot value
-merged_df['2b%_pot'] = merged_df['part1_2b_pot'] + merged_df['part2_2b_pot'] + merged_df['part3_2b_pot']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_2b_pot', 'part2_2b_pot', 'part3_2b_pot'])
-
-
-# In[ ]:
-
-
-# calculate 3b%_potential
-
-def calculate_part1_3b_pot(row):
-    return (row['batting_ratings_talent_gap'] * 0.00004451978242) + 0.00007767274633
-
-def calculate_part2_3b_pot(row):
-    if row['batting_ratings_talent_power'] <= 100:
-        return (row['batting_ratings_talent_power'] * -0.00000206286281) + 0.0046134367 - 0.0044
-    else:
-        return (row['batting_ratings_talent_power'] * -0.000007041275071) + 0.0051236727 - 0.0044
-
-def calculate_part3_3b_pot(row):
-    if row['batting_ratings_talent_strikeouts'] <= 100:
-        return (row['batting_ratings_talent_strikeouts'] * -0.00001098275967) + 0.0055735013 - 0.0044
-    elif 101 <= row['batting_ratings_talent_strikeouts'] <= 220:
-        return (row['batting_ratings_talent_strikeouts'] * -0.00000526736139) + 0.0048976614 - 0.0044
-    else:
-        return (row['batting_ratings_talent_strikeouts'] * 0) + 0.0037 - 0.0044
-
-merged_df['part1_3b_pot'] = merged_df.apply(calculate_part1_3b_pot, axis=1)
-merged_df['part2_3b_pot'] = merged_df.apply(calculate_part2_3b_pot, axis=1)
-merged_df['part3_3b_pot'] = merged_df.apply(calculate_part3_3b_pot, axis=1)
-
-merged_df['3b%_pot'] = merged_df['part1_3b_pot'] + merged_df['part2_3b_pot'] + merged_df['part3_3b_pot']
-
-# Drop the intermediate calculations from the dataframe
-merged_df = merged_df.drop(columns=['part1_3b_pot', 'part2_3b_pot', 'part3_3b_pot'])
-
-
-# In[ ]:
-
-
-# calculate 1b%_pot
-
-def calculate_part1_1b_pot(row):
-    if row['batting_ratings_talent_babip'] <= 100:
-        return (row['batting_ratings_talent_babip'] * 0.0015140038) + 0.1281801944
-    else:
-        return (row['batting_ratings_talent_babip'] * 0.000964994955) + 0.1837822012
-
-def calculate_part2_1b_pot(row):
-    return (row['batting_ratings_talent_gap'] * -0.0003887320573) + 0.3178756912 - 0.28
-
-def calculate_part3_1b_pot(row):
-    if row['batting_ratings_talent_strikeouts'] <= 100:
-        return (row['batting_ratings_talent_strikeouts'] * 0.000149985378) + 0.2648525907 - 0.28
-    elif 101 <= row['batting_ratings_talent_strikeouts'] <= 220:
-        return (row['batting_ratings_talent_strikeouts'] * 0.00005179135613) + 0.2754044069 - 0.28
-    else:
-        return (row['batting_ratings_talent_strikeouts'] * 0) + 0.286 - 0.28
-
-merged_df['part1_1b_pot'] = merged_df.apply(calculate_part1_1b_pot, axis=1)
-merged_df['part2_1b_pot'] = merged_df.apply(calculate_part2_1b_pot, axis=1)
-merged_df['part3_1b_pot'] = merged_df.apply(calculate_part3_1b_pot, axis=1)
-
-merged_df['1b%_pot'] = merged_df['part1_1b_pot'] + merged_df['part2_1b_pot'] + merged_df['part3_1b_pot']
-
-
-# In[ ]:
-
-
-# calculate Offensive Runs Created Potential per game (orc_per_game_pot)
-merged_df['orc_per_game_pot'] = ((merged_df['bb%_pot'] - 0.0738) / 0.875) + ((merged_df['k%_pot'] - 0.2195) / -1.217) + ((merged_df['hr%_pot'] - 0.0272) / 0.219) + ((merged_df['2b%_pot'] - 0.0628) / 0.693) + ((merged_df['3b%_pot'] - 0.0044) / 0.0519) + ((merged_df['1b%_pot'] - 0.28) / 0.594)
+# following cells recalculate the MOPS methodology for all batters, but using talent not overall ratings (with the same fudge factors)
+rates_pot = model.batting_rates(
+    merged_df['batting_ratings_talent_eye'],
+    merged_df['batting_ratings_talent_strikeouts'],
+    merged_df['batting_ratings_talent_power'],
+    merged_df['batting_ratings_talent_gap'],
+    merged_df['batting_ratings_talent_babip'],
+    parts=rate_parts
+)
+for rate, values in rates_pot.items():
+    merged_df[rate + '%_pot'] = values
 
 
 # In[ ]:
 
 
 # calculate offensive WAR potential
-merged_df['toWAR_pot'] = (merged_df['orc_per_game_pot'] * 162) / 10
+merged_df['toWAR_pot'] = model.offensive_war(rates_pot)
 
 
 # In[ ]:
 
 
 # calculate standardised WAR potential (sWAR_pot) at each position
-merged_df['c_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['c_tdWAR']
-merged_df['1b_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['1b_tdWAR']
-merged_df['2b_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['2b_tdWAR']
-merged_df['3b_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['3b_tdWAR']
-merged_df['ss_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['ss_tdWAR']
-merged_df['lf_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['lf_tdWAR']
-merged_df['cf_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['cf_tdWAR']
-merged_df['rf_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['rf_tdWAR']
-merged_df['dh_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df['dh_tdWAR']
+for pos in model.SWAR_POSITIONS:
+    merged_df[pos + '_sWAR_pot'] = merged_df['toWAR_pot'] + merged_df[pos + '_tdWAR']
 
 
 # In[ ]:
@@ -968,36 +598,16 @@ print(merged_df.head())
 
 
 # calculated modified best position based on fielding ratings - i.e. whether a hitter 'has a position' or is just a 1b/dh
+# eligibility is held as a bitmask per player (see model.POSITION_BITS) and only rendered as the 'C, SS, 2B' string at export
+merged_df['field_mask'] = model.position_mask(
+    merged_df['fielding_ratings_catcher_framing'],
+    merged_df['fielding_ratings_infield_range'],
+    merged_df['fielding_ratings_infield_arm'],
+    merged_df['fielding_ratings_outfield_range']
+)
 
-def determine_positions(row):
-    positions = []  # List to store all eligible positions
-
-    # Apply position rules
-    if row['fielding_ratings_catcher_framing'] >= 150:
-        positions.append('C')
-    if row['fielding_ratings_infield_range'] > 160:
-        positions.append('SS')
-    if 133 < row['fielding_ratings_infield_range'] < 159:
-        positions.append('2B')
-    if row['fielding_ratings_infield_range'] > 111 and row['fielding_ratings_infield_arm'] > 133:
-        positions.append('3B')
-    if row['fielding_ratings_outfield_range'] > 160:
-        positions.append('CF')
-    if 133 < row['fielding_ratings_outfield_range'] < 159:
-        positions.append('RF')
-    if 111 < row['fielding_ratings_outfield_range'] < 133:
-        positions.append('LF')
-
-    # Determine 'has_pos' column (yes if qualified for any position, else blank)
-    has_pos = "yes" if positions else ""
-
-    # Convert list of positions into a string (comma-separated)
-    field_positions = ", ".join(positions) if positions else ""
-
-    return pd.Series([has_pos, field_positions])
-
-# Apply function to dataframe
-merged_df[['has_pos', 'field']] = merged_df.apply(determine_positions, axis=1)
+# 'has_pos' column (yes if qualified for any position, else blank)
+merged_df['has_pos'] = np.where(merged_df['field_mask'] != 0, "yes", "")
 
 
 # In[ ]:
@@ -1005,9 +615,16 @@ merged_df[['has_pos', 'field']] = merged_df.apply(determine_positions, axis=1)
 
 # determining how many pitches with rating over 45 (on 20-80 scale; equivalent to 85 on 0-250 scale) a pitcher has
 # the pitch quality threshold in OOTP 24 was 50; this has been lowered to 45 for OOTP 26 as pitch ratings look lower (1-250 scale 45 = 85, 50 = 101 as per above THIS MAY CHANGE)
-pitch_minimum_rating = 85
+pitch_minimum_rating = model.to_model_scale(model.PITCH_MINIMUM)
 pitch_columns = ['pitching_ratings_pitches_fastball', 'pitching_ratings_pitches_slider', 'pitching_ratings_pitches_curveball', 'pitching_ratings_pitches_screwball', 'pitching_ratings_pitches_forkball', 'pitching_ratings_pitches_changeup', 'pitching_ratings_pitches_sinker', 'pitching_ratings_pitches_splitter', 'pitching_ratings_pitches_knuckleball', 'pitching_ratings_pitches_cutter', 'pitching_ratings_pitches_circlechange', 'pitching_ratings_pitches_knucklecurve']
-merged_df['no_of_pitches'] = merged_df[pitch_columns].apply(lambda row: sum(row >= pitch_minimum_rating), axis=1)
+pitch_pot_columns = ['pitching_ratings_pitches_talent_fastball', 'pitching_ratings_pitches_talent_slider', 'pitching_ratings_pitches_talent_curveball', 'pitching_ratings_pitches_talent_screwball', 'pitching_ratings_pitches_talent_forkball', 'pitching_ratings_pitches_talent_changeup', 'pitching_ratings_pitches_talent_sinker', 'pitching_ratings_pitches_talent_splitter', 'pitching_ratings_pitches_talent_knuckleball', 'pitching_ratings_pitches_talent_cutter', 'pitching_ratings_pitches_talent_circlechange', 'pitching_ratings_pitches_talent_knucklecurve']
+
+# hold current and potential pitch ratings as one players x 12 x 2 array (see model.arsenal_matrix) and count both in one pass
+# the starter and reliever pitch tests below query the same array (see model.arsenal_query), as can other pitch filters, eg
+# for pitchers with a plus slider and a sinker
+arsenal = model.arsenal_matrix(merged_df[pitch_columns], merged_df[pitch_pot_columns])
+no_of_pitches = model.pitch_counts(arsenal, pitch_minimum_rating)
+merged_df['no_of_pitches'] = no_of_pitches[:, model.CURRENT]
 
 
 # In[ ]:
@@ -1015,10 +632,10 @@ merged_df['no_of_pitches'] = merged_df[pitch_columns].apply(lambda row: sum(row
 
 # determining whether a pitcher is a starter (NB needs to be a groundball pitcher with stamina >= 40 on 20-80 scale and at least 3 pitches)
 # new threshold added for OOTP 26 of pbabip >= 45
-merged_df['is_sp'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) &
-                      (merged_df['pitching_ratings_misc_stamina'] >= 68) &
-                      (merged_df['pbabip2080'] >= 45) &
-                      (merged_df['no_of_pitches'] >= 3))
+# the criteria other than the groundball test (see model.role_criteria) are kept in role_criteria, for the groundball threshold
+# sweep (see roles.py)
+role_criteria = model.role_criteria(merged_df['pitching_ratings_misc_stamina'], merged_df['pbabip2080'], arsenal=arsenal)
+merged_df['is_sp'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) & role_criteria['sp'])
 merged_df['is_sp'] = merged_df['is_sp'].astype(int)
 
 
@@ -1027,10 +644,7 @@ merged_df['is_sp'] = merged_df['is_sp'].astype(int)
 
 # determining whether a pitcher is a reliever (NB needs to have at least 2 pitches and be a groundball pitcher, and not a starter as defined above)
 # new threshold added for OOTP 26 of pbabip >= 45
-merged_df['is_rp'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) &
-                      (merged_df['no_of_pitches'] >= 2) &
-                      (merged_df['pbabip2080'] >= 45) &
-                      (merged_df['is_sp'] == 0))
+merged_df['is_rp'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) & role_criteria['rp'] & (merged_df['is_sp'] == 0))
 merged_df['is_rp'] = merged_df['is_rp'].astype(int)
 
 
@@ -1053,14 +667,10 @@ merged_df['donkeyFIP'] = 8.661141 - (0.01747 * merged_df['donkeykong_stuff']) -
 # first calculate blended pitcher rating
 # then map onto FIP scale (roughly so that blended pitcher ratings of 65, 50 and 45 correspond to FIP- of 70, 100 and 130 and FIP of 2.75, 4.1 and 5.45 respectively)
 # assumes league average FIP is 4.1, and a league-leading FIP is about 2.75
-merged_df['pitcher_rtg'] = ((0.25 * merged_df['stuff2080']) + (0.19 * merged_df['ctrl2080']) + (0.51 * merged_df['hra2080']) + (0.05 * merged_df['pbabip2080']))
+merged_df['pitcher_rtg'] = model.pitcher_rating(merged_df['stuff2080'], merged_df['ctrl2080'], merged_df['hra2080'], merged_df['pbabip2080'])
 
-# FIP is one value when pitcher rating above 50 and another when below
-merged_df['FIP'] = np.where(
-    merged_df['pitcher_rtg'] > 50,
-    4.1 - ((merged_df['pitcher_rtg'] - 50) * ((4.1 - 2.75) / 15)),
-    4.1 + ((50 - merged_df['pitcher_rtg']) * ((5.45 - 4.1) / 5))
-)
+# FIP is one value when pitcher rating above 50 and another when below (see model.fip)
+merged_df['FIP'] = model.fip(merged_df['pitcher_rtg'])
 
 
 # In[ ]:
@@ -1076,10 +686,8 @@ merged_df['rp_FIP'] = merged_df['is_rp'] * merged_df['FIP']
 
 # calculate starting pitcher standardised WAR from FIP assuming 180 IP (approach per OOTP calculator)
 
-# Calculate 'fipr9', 'rpw', and 'sp_sWAR'
-merged_df['fipr9'] = merged_df['FIP'] + 4.62 - 4.25
-merged_df['rpw'] = ((((12.375 * 4.62) + (5.625 * merged_df['fipr9'])) / 18) + 2) * 1.5
-merged_df['p_sWAR'] = (((((4.62-merged_df['fipr9']) / merged_df['rpw']) + 0.12) * 180) / 9)
+# FIP is converted to runs per 9 (fipr9) and runs per win (rpw) in model.pitcher_war
+merged_df['p_sWAR'] = model.pitcher_war(merged_df['FIP'])
 merged_df['sp_sWAR'] = merged_df['p_sWAR'] * merged_df['is_sp']
 
 # calculate relief pitcher standardised WAR equal to one-third of sp_sWAR only for pitchers where is_rp is 1
@@ -1089,9 +697,8 @@ merged_df['rp_sWAR'] = (merged_df['p_sWAR'] / 3) * merged_df['is_rp']
 # In[ ]:
 
 
-# determining how many pitches a pitcher potentially has based on minimum potential pitch ratings (same logic as for current ratings)
-pitch_pot_columns = ['pitching_ratings_pitches_talent_fastball', 'pitching_ratings_pitches_talent_slider', 'pitching_ratings_pitches_talent_curveball', 'pitching_ratings_pitches_talent_screwball', 'pitching_ratings_pitches_talent_forkball', 'pitching_ratings_pitches_talent_changeup', 'pitching_ratings_pitches_talent_sinker', 'pitching_ratings_pitches_talent_splitter', 'pitching_ratings_pitches_talent_knuckleball', 'pitching_ratings_pitches_talent_cutter', 'pitching_ratings_pitches_talent_circlechange', 'pitching_ratings_pitches_talent_knucklecurve']
-merged_df['no_of_pitches_pot'] = merged_df[pitch_pot_columns].apply(lambda row: sum(row >= pitch_minimum_rating), axis=1)
+# determining how many pitches a pitcher potentially has based on minimum potential pitch ratings (same logic as for current ratings, counted above)
+merged_df['no_of_pitches_pot'] = no_of_pitches[:, model.POTENTIAL]
 
 
 # In[ ]:
@@ -1099,10 +706,9 @@ merged_df['no_of_pitches_pot'] = merged_df[pitch_pot_columns].apply(lambda row:
 
 # determining whether a pitcher is potentially a starter
 # new threshold added for OOTP 26 of pbabip potential >= 45
-merged_df['is_sp_pot'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) &
-                      (merged_df['pitching_ratings_misc_stamina'] >= 69) &
-                      (merged_df['pbabip2080p'] >= 45) &
-                      (merged_df['no_of_pitches_pot'] >= 3))
+role_criteria.update({role + '_pot': values for role, values in model.role_criteria(
+    merged_df['pitching_ratings_misc_stamina'], merged_df['pbabip2080p'], potential=True, arsenal=arsenal).items()})
+merged_df['is_sp_pot'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) & role_criteria['sp_pot'])
 merged_df['is_sp_pot'] = merged_df['is_sp_pot'].astype(int)
 
 
@@ -1111,10 +717,7 @@ merged_df['is_sp_pot'] = merged_df['is_sp_pot'].astype(int)
 
 # determining whether a pitcher is potentially a reliever
 # new threshold added for OOTP 26 of pbabip potential >= 45
-merged_df['is_rp_pot'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) &
-                      (merged_df['no_of_pitches_pot'] >= 2) &
-                      (merged_df['pbabip2080p'] >= 45) &
-                      (merged_df['is_sp_pot'] == 0))
+merged_df['is_rp_pot'] = ((merged_df['pitching_ratings_misc_ground_fly'] >= min_gb) & role_criteria['rp_pot'] & (merged_df['is_sp_pot'] == 0))
 merged_df['is_rp_pot'] = merged_df['is_rp_pot'].astype(int)
 
 
@@ -1134,12 +737,8 @@ merged_df['donkeykong_movement_pot'] = merged_df['pitching_ratings_talent_moveme
 merged_df['donkeyFIP_pot'] = 8.661141 - (0.01747 * merged_df['donkeykong_stuff_pot']) - (0.03291 * merged_df['donkeykong_movement_pot']) - (0.01737 * merged_df['donkeykong_control_pot'])
 
 # calculate blended pitcher rating and FIP projection based on potential in same way as for current ratings
-merged_df['pitcher_rtg_pot'] = ((0.25 * merged_df['stuff2080p']) + (0.19 * merged_df['ctrl2080p']) + (0.51 * merged_df['hra2080p']) + (0.05 * merged_df['pbabip2080p']))
-merged_df['FIP_pot'] = np.where(
-    merged_df['pitcher_rtg_pot'] > 50,
-    4.1 - ((merged_df['pitcher_rtg_pot'] - 50) * ((4.1 - 2.75) / 15)),
-    4.1 + ((50 - merged_df['pitcher_rtg_pot']) * ((5.45 - 4.1) / 5))
-)
+merged_df['pitcher_rtg_pot'] = model.pitcher_rating(merged_df['stuff2080p'], merged_df['ctrl2080p'], merged_df['hra2080p'], merged_df['pbabip2080p'])
+merged_df['FIP_pot'] = model.fip(merged_df['pitcher_rtg_pot'])
 
 
 # In[ ]:
@@ -1155,10 +754,7 @@ merged_df['rp_FIP_pot'] = merged_df['is_rp_pot'] * merged_df['FIP_pot']
 
 # calculate potential starting pitcher standardised WAR from FIP assuming 180 IP (approach per OOTP calculator)
 
-# Calculate 'fipr9', 'rpw', and 'sp_sWAR'
-merged_df['fipr9_pot'] = merged_df['FIP_pot'] + 4.62 - 4.25
-merged_df['rpw_pot'] = ((((12.375 * 4.62) + (5.625 * merged_df['fipr9_pot'])) / 18) + 2) * 1.5
-merged_df['p_sWAR_pot'] = (((((4.62-merged_df['fipr9_pot']) / merged_df['rpw_pot']) + 0.12) * 180) / 9)
+merged_df['p_sWAR_pot'] = model.pitcher_war(merged_df['FIP_pot'])
 merged_df['sp_sWAR_pot'] = merged_df['p_sWAR_pot'] * merged_df['is_sp_pot']
 
 # calculate relief pitcher standardised WAR equal to one-third of sp_sWAR only for pitchers where is_rp is 1
@@ -1169,51 +765,99 @@ merged_df['rp_sWAR_pot'] = (merged_df['p_sWAR_pot'] / 3) * merged_df['is_rp_pot'
 
 
 # calculate HRs per 650, OBP and OPS+ for both current and future ratings
-merged_df['bb650'] = (merged_df['bb%'] * 650)
-merged_df['hr650'] = (merged_df['hr%'] * ((650 - merged_df['bb650'])))
-merged_df['k650'] = (merged_df['k%'] * ((650 - merged_df['bb650'])))
-merged_df['2b'] = (merged_df['2b%'] * ((650 - merged_df['bb650']-merged_df['hr650']-merged_df['k650'])))
-merged_df['3b'] = (merged_df['3b%'] * ((650 - merged_df['bb650']-merged_df['hr650']-merged_df['k650'])))
-merged_df['1b'] = (merged_df['1b%'] * ((650 - merged_df['bb650']-merged_df['hr650']-merged_df['k650']-merged_df['2b']-merged_df['3b'])))
-merged_df['obp'] = ((merged_df['bb650'] + merged_df['hr650'] + merged_df['2b'] + merged_df['3b'] + merged_df['1b']) / 650)
-merged_df['slg'] = (((merged_df['1b'])+(2*merged_df['2b'])+(3*merged_df['3b'])+(4*merged_df['hr650']))/(650-merged_df['bb650']))
-merged_df['ops'] = (merged_df['obp']+merged_df['slg'])
-merged_df['OPS+'] = (((merged_df['ops'])/0.734)*100).round(0)
-merged_df['HR'] = merged_df['hr650'].round(0)
-merged_df['OBP'] = merged_df['obp'].round(3)
-
-merged_df['bb650_pot'] = (merged_df['bb%_pot'] * 650)
-merged_df['hr650_pot'] = (merged_df['hr%_pot'] * ((650 - merged_df['bb650_pot'])))
-merged_df['k650_pot'] = (merged_df['k%_pot'] * ((650 - merged_df['bb650_pot'])))
-merged_df['2b_pot'] = (merged_df['2b%_pot'] * ((650 - merged_df['bb650_pot']-merged_df['hr650_pot']-merged_df['k650_pot'])))
-merged_df['3b_pot'] = (merged_df['3b%_pot'] * ((650 - merged_df['bb650_pot']-merged_df['hr650_pot']-merged_df['k650_pot'])))
-merged_df['1b_pot'] = (merged_df['1b%_pot'] * ((650 - merged_df['bb650_pot']-merged_df['hr650_pot']-merged_df['k650_pot']-merged_df['2b_pot']-merged_df['3b_pot'])))
-merged_df['obp_pot'] = ((merged_df['bb650_pot'] + merged_df['hr650_pot'] + merged_df['2b_pot'] + merged_df['3b_pot'] + merged_df['1b_pot']) / 650)
-merged_df['slg_pot'] = (((merged_df['1b_pot'])+(2*merged_df['2b_pot'])+(3*merged_df['3b_pot'])+(4*merged_df['hr650_pot']))/(650-merged_df['bb650_pot']))
-merged_df['ops_pot'] = (merged_df['obp_pot']+merged_df['slg_pot'])
-merged_df['OPS+_p'] = (((merged_df['ops_pot'])/0.734)*100).round(0)
-merged_df['HR_p'] = ((merged_df['hr650_pot'])).round(0)
-merged_df['OBP_p'] = merged_df['obp_pot'].round(3)
-
-
-
-# In[ ]:
-
-
-# calculate OPS+ for mlb career for each player_id
-
-merged_df['bb650_mlb'] = (merged_df['bb%_mlb'] * 650)
-merged_df['hr650_mlb'] = (merged_df['hr%_mlb'] * 650)
-merged_df['k650_mlb'] = (merged_df['k%_mlb'] * 650)
-merged_df['2b_mlb'] = (merged_df['2b%_mlb'] * 650)
-merged_df['3b_mlb'] = (merged_df['3b%_mlb'] * 650)
-merged_df['1b_mlb'] = (merged_df['1b%_mlb'] * 650)
-merged_df['obp_mlb'] = ((merged_df['bb650_mlb'] + merged_df['hr650_mlb'] + merged_df['2b_mlb'] + merged_df['3b_mlb'] + merged_df['1b_mlb']) / 650)
-merged_df['slg_mlb'] = (((merged_df['1b_mlb'])+(2*merged_df['2b_mlb'])+(3*merged_df['3b_mlb'])+(4*merged_df['hr650_mlb']))/(650-merged_df['bb650_mlb']))
-merged_df['ops_mlb'] = (merged_df['obp_mlb']+merged_df['slg_mlb'])
-merged_df['OPS+_mlb'] = (((merged_df['ops_mlb'])/0.734)*100).round(0)
-merged_df['HR_mlb'] = merged_df['hr650_mlb'].round(0)
-merged_df['OBP_mlb'] = merged_df['obp_mlb'].round(3)
+# the 650 pa batting line (walks, then hr and k out of the remaining pa, then hits on balls in play) is worked through in place
+# by model.batting_summary, so only HR, OBP and OPS+ are written back
+# (the float32 check below keeps the unrounded values, to tell which rounded ones could round differently in float64)
+unrounded = {}
+for suffix, rate_suffix in [('', '%'), ('_p', '%_pot')]:
+    summary = model.batting_summary({rate: merged_df[rate + rate_suffix] for rate in model.RATE_PARTS})
+    if float32:
+        unrounded.update({'OPS+' + suffix: summary['ops_plus'], 'HR' + suffix: summary['hr650'], 'OBP' + suffix: summary['obp']})
+    # rounded in float64 whatever the model ran in, so a float32 OBP of 0.41999998 is published as 0.42
+    merged_df['OPS+' + suffix] = summary['ops_plus'].astype(float).round(0)
+    merged_df['HR' + suffix] = summary['hr650'].astype(float).round(0)
+    merged_df['OBP' + suffix] = summary['obp'].astype(float).round(3)
+
+# and OBP and OPS+ vs LHP and vs RHP, from the split rows of the stacked rates
+summary = model.batting_summary({rate: values[1:] for rate, values in rates_by_view.items()})
+for i, suffix in enumerate(model.SPLITS):
+    if float32:
+        unrounded.update({'OPS+' + suffix: summary['ops_plus'][i], 'OBP' + suffix: summary['obp'][i]})
+    merged_df['OPS+' + suffix] = summary['ops_plus'][i].astype(float).round(0)
+    merged_df['OBP' + suffix] = summary['obp'][i].astype(float).round(3)
+
+
+# In[ ]:
+
+
+# float32 check: compare every projection with float64 at the precision it is published to (0 dp for OPS+ and HR, 3 for OBP,
+# 2 for the rest) - a float32 value is within FLOAT32_ERROR of float64 (relative to the value, or to 1 for small values), so
+# only players with a value that close to a rounding boundary can round differently, and only they are re-run in float64;
+# any player whose rounded value does differ is listed in reports/float32_check.csv and given the float64 value, so the
+# reports come out exactly as a float64 run would
+if float32:
+    def model_ratings(rows):
+        # the model's arguments for some rows of merged_df, in float64
+        ratings = [{name: merged_df[column].to_numpy(dtype=float)[rows] for name, column in columns.items()}
+                   for columns in [batting_columns, talent_columns, fielding_columns, pitching_columns, pitching_talent_columns]]
+        splits = {suffix: {name: merged_df[column].to_numpy(dtype=float)[rows] for name, column in columns.items()}
+                  for suffix, columns in split_columns.items()}
+        return ratings, splits
+
+    def with_roles(projections, rows):
+        for suffix in ['', '_pot']:
+            is_sp, is_rp = merged_df['is_sp' + suffix].to_numpy()[rows], merged_df['is_rp' + suffix].to_numpy()[rows]
+            projections['sp_FIP' + suffix] = is_sp * projections['FIP' + suffix]
+            projections['rp_FIP' + suffix] = is_rp * projections['FIP' + suffix]
+            projections['sp_sWAR' + suffix] = projections['p_sWAR' + suffix] * is_sp
+            projections['rp_sWAR' + suffix] = (projections['p_sWAR' + suffix] / 3) * is_rp
+        return projections
+
+    # the columns the model projects (a run over no players lists them) and the dp each is published to, and the players
+    # near a rounding boundary in any of them
+    ratings, splits = model_ratings(slice(0, 0))
+    published_dp = {column: 0 if column.startswith(('OPS+', 'HR')) else 3 if column.startswith('OBP') else 2
+                    for column in with_roles(model.projections(*ratings, parts=rate_parts, splits=splits), slice(0, 0))}
+    near = np.zeros(len(merged_df), dtype=bool)
+    for column, decimals in published_dp.items():
+        values = np.asarray(unrounded.get(column, merged_df[column]), dtype=float)
+        scale = 10.0 ** decimals
+        boundary_distance = np.abs(values * scale - np.floor(values * scale) - 0.5) / scale
+        near |= ~(boundary_distance > FLOAT32_ERROR * np.fmax(np.abs(values), 1))
+    rows = np.flatnonzero(near)
+    ratings, splits = model_ratings(rows)
+    reference = with_roles(model.projections(*ratings, parts=rate_parts, splits=splits), rows)
+
+    mismatches = []
+    for column, decimals in published_dp.items():
+        expected = reference[column]
+        computed = merged_df[column].to_numpy(dtype=float, copy=True)
+        rounded, expected_rounded = np.round(computed[rows], decimals), np.round(expected, decimals)
+        differs = ~((rounded == expected_rounded) | (np.isnan(rounded) & np.isnan(expected_rounded)))
+        if differs.any():
+            mismatches.append(pd.DataFrame({
+                'player_id': merged_df['player_id'].to_numpy()[rows[differs]], 'name': merged_df['name'].to_numpy()[rows[differs]],
+                'column': column, 'float32': computed[rows[differs]], 'float64': expected[differs]
+            }))
+        # columns the summary above rounds take the rounded float64 value
+        computed[rows[differs]] = (expected_rounded if column in unrounded else expected)[differs]
+        merged_df[column] = computed
+
+    mismatches = pd.concat(mismatches) if mismatches else pd.DataFrame(columns=['player_id', 'name', 'column', 'float32', 'float64'])
+    if __name__ != '__batch__':
+        mismatches.to_csv(base_dir + '/reports/float32_check.csv', index=False)
+    print(f"float32 check: {len(rows)} of {len(merged_df)} players near a rounding boundary re-run in float64, {len(mismatches)} rounded values "
+          f"differed ({mismatches['player_id'].nunique()} players), float64 values used")
+
+
+# In[ ]:
+
+
+# calculate OPS+ for mlb career for each player_id (career rates are all per pa, so each is simply scaled up to 650 pa)
+summary = model.batting_summary({rate: merged_df[rate + '%_mlb'] for rate in model.RATE_PARTS}, per_pa=True)
+merged_df['OPS+_mlb'] = summary['ops_plus'].round(0)
+merged_df['HR_mlb'] = summary['hr650'].round(0)
+merged_df['OBP_mlb'] = summary['obp'].round(3)
 
 
 # In[ ]:
@@ -1229,23 +873,8 @@ merged_df['minor'] = (merged_df['organization_id'] != merged_df['team_id']).asty
 # look up which club each player plays for based on 'organization_id' and a lookup table
 club_lookup = pd.read_csv(base_dir + '/config/club_lookup.csv')
 
-# Merge the 'club' column to the dataframe
-merged_df = pd.merge(merged_df, club_lookup[['club_id', 'club']], left_on='organization_id', right_on='club_id', how='left')
-
-# Drop the 'club_id' column as it's no longer needed
-merged_df = merged_df.drop(columns='club_id')
-
-
-# In[ ]:
-
-
-# Read names from text file into a list - paste in here players to be flagged (eg players available in draft, or players in a shortlist or player search)
-# convert to lowercase so can read if ALL CAPS (i.e. in a shortlist)
-with open(base_dir + '/config/flagged.txt', 'r') as f:
-    drafted_names = [name.lower() for name in f.read().splitlines()]
-
-# Convert 'name' column to lowercase and check for membership
-merged_df['in_list'] = np.where(merged_df['name'].str.lower().isin(drafted_names), 'flagged', '')
+# look the club up directly by organization_id (see joins.lookup)
+merged_df['club'] = joins.lookup(merged_df['organization_id'], club_lookup['club_id'], club_lookup['club'])
 
 
 # In[ ]:
@@ -1253,7 +882,7 @@ merged_df['in_list'] = np.where(merged_df['name'].str.lower().isin(drafted_names
 
 # This compares a batter's OPS+ against a standard trajectory for a player of their age
 # Players are classified into three growth lanes (low, medium, high) based on their fielding position
-# Instead of using best_sWAR_pos, we now use our multi-position logic (field column)
+# Instead of using best_sWAR_pos, we now use our multi-position logic (field_mask column)
 
 # Position groups:
 groupA = ["1B", "DH"]         # First Base or Designated Hitter (Lowest Priority)
@@ -1286,49 +915,12 @@ for age in range(31, 51):
     groupB_lookup[age] = 90
     groupC_lookup[age] = 100
 
-def get_track_value(row):
-    """
-    Returns a track value based on a player's age and fielding positions.
-    Uses multi-position eligibility (field column) instead of best_sWAR_pos.
-    Clamps age to [14..50].
-    Prioritization: Group B > Group C > Group A.
-    """
-    # Ensure age is an integer
-    age = int(row['age'])
-    # Clamp age to the range [14..50] for lookup
-    if age < 14:
-        age = 14
-    elif age > 50:
-        age = 50
-
-    # Extract eligible positions from the 'field' column
-    positions = row['field'].split(", ") if row['field'] else []
-
-    # Default track value if no valid position found
-    default_growth = 100
-
-    # Determine the best track value based on position groups with the new prioritization
-    if any(pos in groupB for pos in positions):  # Highest priority
-        return groupB_lookup.get(age, 90)
-    elif any(pos in groupC for pos in positions):  # Second priority
-        return groupC_lookup.get(age, 100)
-    elif any(pos in groupA for pos in positions):  # Lowest priority
-        return groupA_lookup.get(age, 110)
-    else:
-        return default_growth  # If no valid position, assign default
-
-# Create the 'track' column using the updated position logic with new prioritization
-merged_df['track'] = merged_df.apply(get_track_value, axis=1)
+# Bitmasks for each position group, checked against the field_mask column
+groupA_mask = model.group_mask(groupA)
+groupB_mask = model.group_mask(groupB)
+groupC_mask = model.group_mask(groupC)
 
-
-# In[ ]:
-
-
-# Calculate the OPS+ at age 21 and 27 for each player based on yearly growth factors for a median trajectory
-
-import math
-
-# Define the growth factors
+# Define the growth factors (median yearly OPS+ growth at each age, used for ops21 and ops27 below)
 growth_factors = {
     14: 0.00,
     15: 0.01,
@@ -1350,90 +942,86 @@ growth_factors = {
 for a in range(29, 51):
     growth_factors[a] = 0.0
 
-def get_ops21(age, current_ops):
-    """
-    Calculate projected OPS+ at age 21 based on yearly growth factors.
-    If age >= 22, returns 0.
-    If age == 21, returns current OPS+.
-    If age < 21, multiplies by growth rates for (age+1) to 21.
-    """
-    if age >= 22:
-        return 0
-    elif age == 21:
-        return current_ops
-
-    projected_ops = float(current_ops)
-    for next_age in range(age + 1, 22):
-        factor = growth_factors.get(next_age, 0.0)
-        projected_ops *= (1 + factor)
-
-    return math.floor(projected_ops)
-
-def get_ops27(age, current_ops):
-    """
-    Calculate projected OPS+ at age 27 based on yearly growth factors.
-    If age >= 27, returns current OPS+ (no growth applied).
-    If age < 27, multiplies by growth rates for (age+1) to 27.
-    """
-    if age >= 27:
-        return current_ops
-    elif age == 27:
-        return current_ops
-
-    projected_ops = float(current_ops)
-    for next_age in range(age + 1, 28):  # Project up to age 27
-        factor = growth_factors.get(next_age, 0.0)
-        projected_ops *= (1 + factor)
-
-    return math.floor(projected_ops)
-
-# Apply functions to create the ops21 and ops27 columns in merged_df
-merged_df['ops21'] = merged_df.apply(
-    lambda row: get_ops21(row['age'], row['OPS+']),
-    axis=1
+# Track values and growth factors as arrays indexed by age (14..50), so the lookup is a single gather
+track_ages = np.arange(14, 51)
+groupA_track = np.array([groupA_lookup[age] for age in track_ages])
+groupB_track = np.array([groupB_lookup[age] for age in track_ages])
+groupC_track = np.array([groupC_lookup[age] for age in track_ages])
+growth = np.array([growth_factors[age] for age in track_ages])
+
+# fitted_aging: the growth factors and tracks are fitted from the league's career stats and players instead, where there is
+# enough data (see aging.py) - the fit is cached until the export changes, and a chunked run fits it once, from each batch's
+# aging files in turn, and hands it to its batches
+# each fit is checked against a league simulated on the hard-coded curves, which it should give back (see aging.check)
+if fitted_aging:
+    if __name__ != '__batch__':
+        def aging_sums():
+            # each batch's sums from its own players and every level's seasons, one batch at a time (the league is one batch
+            # unless chunked)
+            for folder in batch['folders'] if batch else [league_filepath]:
+                players_file, stats_file = ('aging_players.csv', 'aging_batting_stats.csv') if batch else ('players.csv', 'players_career_batting_stats.csv')
+                folder_players = pd.read_csv(folder + '/' + players_file, usecols=['player_id', 'age', 'position'])
+                folder_cube = cube.load_or_build(folder + '/' + stats_file, save=False) if batch else batting_cube
+                if len(folder_players) and len(folder_cube['player_id']):
+                    yield aging.sums(folder_cube, folder_players['player_id'], folder_players['age'], folder_players['position'], aging_season)
+
+        hard_coded_plateaus = {'groupA': groupA_lookup[aging.PEAK_AGE], 'groupB': groupB_lookup[aging.PEAK_AGE], 'groupC': groupC_lookup[aging.PEAK_AGE]}
+        league_players = pd.read_csv(league_filepath + '/players.csv', usecols=['player_id', 'age', 'position'])
+        aging_season = game_date.year if game_date is not None else cube.latest_year(batting_cube, level=None, split=None)
+        aging_curves = aging.load_or_fit(
+            cube.source_signature(league_filepath + '/players_career_batting_stats.csv'), aging_sums(),
+            league_players['player_id'], league_players['age'], league_players['position'], aging_season, growth, hard_coded_plateaus
+        )
+        growth_error, plateau_error = aging_curves['check']
+        print("fitted aging: plateaus " + ", ".join(f"{group} {hard_coded_plateaus[group]} -> {aging_curves['plateaus'][group]:.1f}" for group in aging.GROUP_POSITIONS)
+              + f" (a league on the hard-coded curves fits back to within {growth_error:.1g} growth, {plateau_error:.1g} OPS+)")
+    growth = aging_curves['growth']
+    groupA_track = aging.track(aging_curves['plateaus']['groupA'], growth)
+    groupB_track = aging.track(aging_curves['plateaus']['groupB'], growth)
+    groupC_track = aging.track(aging_curves['plateaus']['groupC'], growth)
+
+# Clamp age to the range [14..50] for lookup
+age_idx = np.clip(merged_df['age'].to_numpy().astype(int), 14, 50) - 14
+field_mask = merged_df['field_mask'].to_numpy()
+
+# Create the 'track' column using multi-position eligibility (field_mask) instead of best_sWAR_pos
+# Prioritization: Group B > Group C > Group A, and 100 if no valid position
+merged_df['track'] = np.select(
+    [(field_mask & groupB_mask) != 0, (field_mask & groupC_mask) != 0, (field_mask & groupA_mask) != 0],
+    [groupB_track[age_idx], groupC_track[age_idx], groupA_track[age_idx]],
+    default=100
 )
 
-merged_df['ops27'] = merged_df.apply(
-    lambda row: get_ops27(row['age'], row['OPS+']),
-    axis=1
-)
+
+# In[ ]:
+
+
+# Calculate the OPS+ at age 21 and 27 for each player based on yearly growth factors for a median trajectory
+# growth is applied a year at a time over all players at once (see aging.grow): ops21 is 0 for players 22 or older and
+# ops27 is the current OPS+ for players 27 or older
+age = merged_df['age'].to_numpy()
+merged_df['ops21'] = np.where(age >= 22, 0, aging.grow(merged_df['OPS+'].to_numpy(), age, growth, 21))
+merged_df['ops27'] = aging.grow(merged_df['OPS+'].to_numpy(), age, growth, 27)
 
 merged_df['Tpct'] = (merged_df['OPS+'] / merged_df['track'].replace(0, float('nan'))).round(2)
 
 # Add the onT column: If Tpct >= 1, set it to "track"
-merged_df['onT'] = merged_df.apply(lambda row: f"{row['club']} track" if row['Tpct'] >= 1 else "", axis=1)
+merged_df['onT'] = np.where(merged_df['Tpct'] >= 1, merged_df['club'].astype(str) + " track", "")
 
 
 # In[ ]:
 
 
-# Function to determine the denominator used to calc PPct based on fielding position (i.e. to gauge how impressive potential OPS+ is)
-def get_divisor(row):
-    """
-    Determines the divisor based on a player's fielding positions.
-    Uses multi-position eligibility (field column) instead of best_sWAR_pos.
-    Prioritization: Group B > Group C > Group A.
-    """
-    positions = row['field'].split(", ") if row['field'] else []
-
-    # Default divisor if no valid position is found
-    default_divisor = 100
-
-    # Determine the divisor based on position groups
-    if any(pos in groupB for pos in positions):  # Highest priority (hardest positions)
-        return 90
-    elif any(pos in groupC for pos in positions):  # Medium priority
-        return 100
-    elif any(pos in groupA for pos in positions):  # Lowest priority (easiest positions)
-        return 110
-    else:
-        return default_divisor  # If no valid position, assign default
+# Determine the denominator used to calc PPct based on fielding position (i.e. to gauge how impressive potential OPS+ is)
+# Prioritization: Group B (hardest positions) > Group C > Group A (easiest positions), and 100 if no valid position
+divisor = np.select(
+    [(field_mask & groupB_mask) != 0, (field_mask & groupC_mask) != 0, (field_mask & groupA_mask) != 0],
+    [90, 100, 110],
+    default=100
+)
 
 # Add the Ppct column: OPS+_p divided by the appropriate divisor based on the new logic
-merged_df['Ppct'] = merged_df.apply(
-    lambda row: (row['OPS+_p'] / get_divisor(row)) if pd.notna(row['OPS+_p']) else None,
-    axis=1
-)
+merged_df['Ppct'] = merged_df['OPS+_p'] / divisor
 
 # Round Ppct to 2 decimal places
 merged_df['Ppct'] = merged_df['Ppct'].round(2)
@@ -1445,8 +1033,49 @@ merged_df['Pscore'] = (merged_df['Tpct'] * merged_df['Ppct']).round(2)
 # In[ ]:
 
 
+# optional uncertainty bands (see uncertainty.py): the scouted ratings are redrawn around their values simulation_draws times and the
+# projections re-run for every draw, giving p10/p50/p90 columns for best_sWAR, OPS+, OPS+_p, FIP and sp/rp sWAR (roles are held fixed)
+band_columns = {'batter': [], 'pitcher': []}
+band_renames = {}
+if simulate:
+    bands = uncertainty.simulate({
+        'current': {
+            'eye': merged_df['batting_ratings_overall_eye'],
+            'avoidk': merged_df['batting_ratings_overall_strikeouts'],
+            'power': merged_df['batting_ratings_overall_power'],
+            'gap': merged_df['batting_ratings_overall_gap'],
+            'babip': merged_df['batting_ratings_overall_babip']
+        },
+        'talent': {
+            'eye': merged_df['batting_ratings_talent_eye'],
+            'avoidk': merged_df['batting_ratings_talent_strikeouts'],
+            'power': merged_df['batting_ratings_talent_power'],
+            'gap': merged_df['batting_ratings_talent_gap'],
+            'babip': merged_df['batting_ratings_talent_babip']
+        },
+        'fielding': {name: values for name, values in fielding_ratings.items() if name != 'height'},
+        'height': merged_df['height'],
+        'pitching': {'stuff': merged_df['stuff2080'], 'control': merged_df['ctrl2080'], 'hra': merged_df['hra2080'], 'pbabip': merged_df['pbabip2080']},
+        'is_sp': merged_df['is_sp'],
+        'is_rp': merged_df['is_rp']
+    }, draws=simulation_draws, rating_sd=rating_sd, parts=rate_parts)
+
+    for column, values in bands.items():
+        for i, percentile in enumerate(uncertainty.PERCENTILES):
+            band = pd.Series(values[:, i], index=merged_df.index)
+            # OPS+ is a whole number in the reports; the rest are rounded to 2 dp like the projections (+ 0 turns -0.0 into 0)
+            merged_df[f'{column}_p{percentile}'] = band.round(0).astype('Int64') if column.startswith('OPS+') else band.round(2) + 0
+
+    band_columns['batter'] = [f'{column}_p{p}' for column in ['best_sWAR', 'OPS+', 'OPS+_p'] for p in uncertainty.PERCENTILES]
+    band_columns['pitcher'] = [f'{column}_p{p}' for column in ['sp_sWAR', 'rp_sWAR', 'FIP'] for p in uncertainty.PERCENTILES]
+    band_renames = {f'{column}_sWAR_p{p}': f'{column}_p{p}' for column in ['best', 'sp', 'rp'] for p in uncertainty.PERCENTILES}
+
+
+# In[ ]:
+
+
 # export a simple dataframe with the pitcher outputs in the 'reports' folder of this pistachio project
-columns = ['name', 'age', 'club', 'minor', 'ip', 'throws', 'sp_sWAR', 'rp_sWAR','sp_sWAR_pot', 'rp_sWAR_pot', 'FIP','FIP_pot', 'in_list']
+columns = ['name', 'age', 'club', 'minor', 'ip', 'throws', 'sp_sWAR', 'rp_sWAR','sp_sWAR_pot', 'rp_sWAR_pot', 'FIP','FIP_pot', 'in_list', 'player_id'] + band_columns['pitcher']
 df = merged_df[columns]
 
 # change 'throws' so that 1 = R, 2 = L
@@ -1458,10 +1087,22 @@ pitchers.rename(columns={
     'sp_sWAR': 'sp',
     'rp_sWAR': 'rp',
     'sp_sWAR_pot': 'spP',
-    'rp_sWAR_pot': 'rpP'
+    'rp_sWAR_pot': 'rpP',
+    **band_renames
 }, inplace=True)
 
-pitchers.to_csv(export_filepath + '/pitcher_sWAR.csv', index=False)
+# the pitcher report is published unrounded, so a float32 run rounds its projections to the 2 dp they were checked at
+if float32:
+    pitchers[['sp', 'rp', 'spP', 'rpP', 'FIP', 'FIP_pot']] = pitchers[['sp', 'rp', 'spP', 'rpP', 'FIP', 'FIP_pot']].round(2)
+
+# keep every pitcher who could make the report at another groundball threshold, with what their roles are worked out from, so
+# the server can give the report at any threshold in roles.GB_RANGE without a rerun (see roles.py)
+pitcher_sweep = roles.candidates(
+    df[['name', 'age', 'club', 'minor', 'ip', 'throws', 'FIP', 'FIP_pot', 'in_list', 'player_id']],
+    merged_df['pitching_ratings_misc_ground_fly'], merged_df['p_sWAR'], merged_df['p_sWAR_pot'], role_criteria,
+    (df['club'] == team_managed) | (df['in_list'] == 'flagged'),
+    decimals=2 if float32 else None
+)
 
 
 # In[ ]:
@@ -1470,21 +1111,21 @@ pitchers.to_csv(export_filepath + '/pitcher_sWAR.csv', index=False)
 # Add new column 'OPS+_pF' based on 'has_pos'
 # this means the output is searchable for batting projections for players that 'have a position' in the field
 # and are not just 1b/dh prospects
-merged_df['OPS+_pF'] = merged_df.apply(lambda row: row['OPS+_p'] if row['has_pos'] == "yes" else -999, axis=1)
+merged_df['OPS+_pF'] = np.where(merged_df['field_mask'] != 0, merged_df['OPS+_p'], -999)
 # same for Pscore
-merged_df['PscoreF'] = merged_df.apply(lambda row: row['Pscore'] if row['has_pos'] == "yes" else -999, axis=1)
+merged_df['PscoreF'] = np.where(merged_df['field_mask'] != 0, merged_df['Pscore'], -999)
 
 
 # In[ ]:
 
 
 # round columns
-round_zero_dp = ['pa', 'HR', 'OPS+', 'HR_p', 'OPS+_p', 'OPS+_pF', 'HR_mlb']
+round_zero_dp = ['pa', 'HR', 'OPS+', 'HR_p', 'OPS+_p', 'OPS+_pF', 'HR_mlb', 'OPS+_vsL', 'OPS+_vsR']
 round_two_dp = [
     'best_sWAR', 'c_sWAR', '1b_sWAR', '2b_sWAR', '3b_sWAR', 'ss_sWAR',
     'lf_sWAR', 'cf_sWAR', 'rf_sWAR', 'dh_sWAR', 'best_sWAR_pot', 'c_sWAR_pot',
     '1b_sWAR_pot', '2b_sWAR_pot', '3b_sWAR_pot', 'ss_sWAR_pot', 'lf_sWAR_pot',
-    'cf_sWAR_pot', 'rf_sWAR_pot', 'dh_sWAR_pot', 'toWAR', 'toWAR_pot',
+    'cf_sWAR_pot', 'rf_sWAR_pot', 'dh_sWAR_pot', 'toWAR', 'toWAR_pot', 'toWAR_vsL', 'toWAR_vsR',
     'c_tdWAR', '1b_tdWAR', '2b_tdWAR', '3b_tdWAR', 'ss_tdWAR',
     'lf_tdWAR', 'cf_tdWAR', 'rf_tdWAR', 'dh_tdWAR', 'sp_sWAR', 'rp_sWAR',
     'sp_FIP', 'rp_FIP', 'sp_sWAR_pot', 'rp_sWAR_pot', 'sp_FIP_pot', 'rp_FIP_pot', 'FIP', 'FIP_pot', 'Pscore', 'PscoreF'
@@ -1519,15 +1160,17 @@ merged_df.rename(columns={
 
 print(merged_df.head())
 
-# export merged_df to csv
-merged_df.to_csv(export_filepath + '/merged_df1329.csv', index=False)
-
 
 # In[ ]:
 
 
+# render the position eligibility bitmask as the 'C, SS, 2B' string shown in the report
+merged_df['field'] = model.render_field(merged_df['field_mask'])
+
 # export a simple dataframe with the batter WAR outputs in the 'reports' folder of this pistachio project
-columns = ['name', 'age', 'club', 'minor', 'pa', 'best_sWAR', 'best_sWAR_pos', 'field', 'bats', 'HR_mlb', 'HR', 'OBP', 'OPS+', 'best_sWAR_pot', 'HR_p', 'OBP_p', 'OPS+_p', 'OPS+_pF', 'Tpct', 'c_sWAR', '1b_sWAR', '2b_sWAR', '3b_sWAR', 'ss_sWAR', 'lf_sWAR', 'cf_sWAR', 'rf_sWAR', 'dh_sWAR', 'c_sWAR_pot', '1b_sWAR_pot', '2b_sWAR_pot', '3b_sWAR_pot', 'ss_sWAR_pot', 'lf_sWAR_pot', 'cf_sWAR_pot', 'rf_sWAR_pot', 'dh_sWAR_pot', 'toWAR', 'toWAR_pot', 'c_tdWAR', '1b_tdWAR', '2b_tdWAR', '3b_tdWAR', 'ss_tdWAR', 'lf_tdWAR', 'cf_tdWAR', 'rf_tdWAR', 'dh_tdWAR', 'in_list']
+columns = ['name', 'age', 'club', 'minor', 'pa', 'best_sWAR', 'best_sWAR_pos', 'field', 'bats', 'HR_mlb', 'HR', 'OBP', 'OPS+', 'best_sWAR_pot', 'HR_p', 'OBP_p', 'OPS+_p', 'OPS+_pF', 'Tpct', 'Pscore', 'c_sWAR', '1b_sWAR', '2b_sWAR', '3b_sWAR', 'ss_sWAR', 'lf_sWAR', 'cf_sWAR', 'rf_sWAR', 'dh_sWAR', 'c_sWAR_pot', '1b_sWAR_pot', '2b_sWAR_pot', '3b_sWAR_pot', 'ss_sWAR_pot', 'lf_sWAR_pot', 'cf_sWAR_pot', 'rf_sWAR_pot', 'dh_sWAR_pot', 'toWAR', 'toWAR_pot', 'c_tdWAR', '1b_tdWAR', '2b_tdWAR', '3b_tdWAR', 'ss_tdWAR', 'lf_tdWAR', 'cf_tdWAR', 'rf_tdWAR', 'dh_tdWAR', 'in_list', 'player_id'] + band_columns['batter']
+# and the platoon view: OPS+, OBP and toWAR vs LHP and vs RHP
+columns += [column + suffix for suffix in model.SPLITS for column in ['OPS+', 'OBP', 'toWAR']]
 df = merged_df[columns]
 
 # change 'bats' so that 1 = R, 2 = L, 3 = S
@@ -1560,11 +1203,115 @@ df = df.rename(columns={
     'cf_sWAR_pot': 'cfP',
     'rf_sWAR_pot': 'rfP',
     'dh_sWAR_pot': 'dhP',
-    'toWAR_pot': 'toWARP'
+    'toWAR_pot': 'toWARP',
+    **band_renames
 })
 
-# Export the DataFrame to a CSV file
-df.to_csv(export_filepath + '/batter_sWAR.csv', index=False)
+
+# In[ ]:
+
+
+# prune check: any player in the reports that pruning would have dropped (there should be none) is listed in reports/prune_check.csv
+if verify_prune:
+    prune_misses = pd.concat([
+        df.loc[np.isin(df['player_id'], pruned_ids), ['player_id', 'name']].assign(report='batter'),
+        pitchers.loc[np.isin(pitchers['player_id'], pruned_ids), ['player_id', 'name']].assign(report='pitcher')
+    ])
+    if __name__ != '__batch__':
+        prune_misses.to_csv(base_dir + '/reports/prune_check.csv', index=False)
+    print(f"prune check: {len(prune_misses)} reported players would have been pruned")
+
+
+# In[ ]:
+
+
+# chunked mode: run every other batch through the cells above and keep only the rows that pass the report filters, so no
+# more than one batch's merged_df is held at a time - the rows come out batch by batch rather than in players.csv order
+if __name__ != '__batch__' and batches:
+    batch_reports = {'batter': [df], 'pitcher': [pitchers], 'sweep': [pitcher_sweep], 'float32': [mismatches] if float32 else [], 'prune': [prune_misses] if verify_prune else []}
+    for other in batches[1:]:
+        result = runpy.run_path(__file__, init_globals={'batch': other, 'config': config, 'flagged_names': flagged_names, 'run_options': run_options, **({'aging_curves': aging_curves} if fitted_aging else {})}, run_name='__batch__')
+        batch_reports['batter'].append(result['df'])
+        batch_reports['pitcher'].append(result['pitchers'])
+        batch_reports['sweep'].append(result['pitcher_sweep'])
+        if float32:
+            batch_reports['float32'].append(result['mismatches'])
+        if verify_prune:
+            batch_reports['prune'].append(result['prune_misses'])
+        del result
+    comparables = pd.concat([pd.read_parquet(other['path'] + '/comparables.parquet') for other in batches], ignore_index=True)
+    ingest.remove(batches)
+
+    df = pd.concat(batch_reports['batter'], ignore_index=True)
+    pitchers = pd.concat(batch_reports['pitcher'], ignore_index=True)
+    pitcher_sweep = pd.concat(batch_reports['sweep'], ignore_index=True)
+    if float32:
+        pd.concat(batch_reports['float32'], ignore_index=True).to_csv(base_dir + '/reports/float32_check.csv', index=False)
+    if verify_prune:
+        pd.concat(batch_reports['prune'], ignore_index=True).to_csv(base_dir + '/reports/prune_check.csv', index=False)
+
+
+# In[ ]:
+
+
+# Export the batter and pitcher DataFrames to CSV files, written in parallel
+# each report goes to a temp file that is fsynced and renamed into place, so a request mid-write never sees a partial file
+# (a batch run stops here, see the cell above)
+if __name__ != '__batch__':
+    export.write_reports({
+        export_filepath + '/batter_sWAR.csv': df,
+        export_filepath + '/pitcher_sWAR.csv': pitchers
+    })
+
+
+# In[ ]:
+
+
+# append this run's projections to the history in reports/history, keyed by player_id and in-game date
+# only players whose values changed since their last entry are stored (see history.py)
+if __name__ != '__batch__':
+    if game_date is not None:
+        history.append('batter', df, game_date)
+        history.append('pitcher', pitchers, game_date)
+
+    # fingerprint every row of the published reports under a new version, so the UI can ask for /changes since its last sync
+    report_version = changes.record({'batter': df, 'pitcher': pitchers})
+
+    # sort every leaderboard column once per export (see leaderboards.py), so the server answers top-K queries without sorting
+    leaderboards.save(leaderboards.build({'batter': df, 'pitcher': pitchers}, report_version))
+
+    # name search index over every player in the reports, for the UI's search box
+    searchable = pd.concat([df[['player_id', 'name', 'in_list']], pitchers[['player_id', 'name', 'in_list']]]).drop_duplicates('player_id')
+    name_index = search.build(searchable['player_id'], searchable['name'], searchable['in_list'] == 'flagged')
+    search.save(name_index)
+    # misspelt flagged.txt names flag nobody - list them with the closest names in the reports, to correct the file by
+    for name, closest in search.unmatched(name_index, flagged_names).items():
+        print(f"flagged.txt: '{name}' matches no player" + (f" - did you mean {', '.join(closest)}?" if closest else ''))
+
+    # pitcher roles at every groundball threshold, for the report at another threshold (see roles.py)
+    roles.save(pitcher_sweep)
+
+    # KD-tree over every player's standardized ratings, for the comparable players of a draft pick or trade target (see similar.py)
+    similar.save(similar.build(comparables))
+
+    # publish the reports and indexes above as an immutable snapshot of this version (see snapshots.py), which the server
+    # swaps in for readers in one step
+    snapshots.publish(report_version)
+    if config_version is not None:
+        print(f"published reports v{report_version}, projected from settings version {config_version}")
+
+
+# In[ ]:
+
+
+# optional debug dump of every column of merged_df, written as compressed parquet by a background thread
+# this runs after the reports above are published so it never delays a refresh (a chunked run only holds its first batch, so has no dump)
+if __name__ != '__batch__' and dump_merged and not batches:
+    dump_thread = threading.Thread(target=export.write_parquet, args=(merged_df, export_filepath + '/merged_df1329.parquet'))
+    dump_thread.start()
+    # a script run has nothing left to do, so wait for the dump here rather than during interpreter shutdown
+    if __name__ == '__main__':
+        dump_thread.join()
 
 
 
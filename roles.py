@@ -0,0 +1,91 @@
+# pitcher roles at every minimum groundball threshold (gb_weight in settings.toml), so the server can answer the pitcher report
+# at another threshold without a rerun
+# is_sp / is_rp and their potential twins are the groundball test plus criteria the threshold doesn't touch (pistachio.py's
+# role_criteria), so each export saves every pitcher who could be in the report at some threshold in GB_RANGE with those
+# criteria and their p_sWAR; sorted by ground_fly, the pitchers passing the groundball test at a threshold are a prefix of that
+# order, so a report is a slice, a mask and the role arithmetic
+import os
+import numpy as np
+import pandas as pd
+
+
+SWEEP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'pitcher_sweep.parquet')
+
+# the thresholds a report can be asked for
+GB_RANGE = range(40, 71)
+
+# report filter, as in pistachio.py
+MIN_SWAR = 0.1
+
+# loaded sweep, checked against the file it was loaded from and its modification time
+_cache = {}
+
+
+def candidates(report, ground_fly, p_swar, p_swar_pot, criteria, always, decimals=None):
+    """
+    Returns the sweep rows for one export: the pitcher report's columns other than sp, rp, spP and rpP (report is the frame
+    before the report filter, in report order) for every pitcher who is always reported or could be at some threshold in
+    GB_RANGE, with their ground_fly, p_sWAR and role_criteria alongside. decimals rounds the projections, as a float32 run does.
+    """
+    if decimals is not None:
+        report = report.assign(FIP=report['FIP'].round(decimals), FIP_pot=report['FIP_pot'].round(decimals))
+    frame = report.assign(
+        ground_fly=np.asarray(ground_fly, dtype=float), p_sWAR=np.asarray(p_swar, dtype=float), p_sWAR_pot=np.asarray(p_swar_pot, dtype=float),
+        **{'criteria_' + role: np.asarray(values, dtype=bool) for role, values in criteria.items()}, always=np.asarray(always, dtype=bool),
+        decimals=-1 if decimals is None else decimals
+    )
+    # the most a pitcher can be valued at in any role is p_sWAR as a starter or a third of it as a reliever
+    best = np.fmax(np.where(frame['criteria_sp'], frame['p_sWAR'], np.where(frame['criteria_rp'], frame['p_sWAR'] / 3, np.nan)),
+                   np.where(frame['criteria_sp_pot'], frame['p_sWAR_pot'], np.where(frame['criteria_rp_pot'], frame['p_sWAR_pot'] / 3, np.nan)))
+    return frame[frame['always'] | ((frame['ground_fly'] >= GB_RANGE.start) & (best >= MIN_SWAR))]
+
+
+def save(sweep):
+    """Saves the sweep rows to reports/pitcher_sweep.parquet, atomically replacing the previous ones."""
+    import export
+    os.makedirs(os.path.dirname(SWEEP_PATH), exist_ok=True)
+    export.write_parquet(sweep.reset_index(drop=True), SWEEP_PATH)
+
+
+def load(path=SWEEP_PATH):
+    """
+    Returns a saved sweep (None if there isn't one) with, for each threshold in GB_RANGE, the rows passing its groundball test.
+    """
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _cache.get('sweep')
+    if cached is not None and (cached['path'], cached['mtime']) == (path, mtime):
+        return cached
+
+    frame = pd.read_parquet(path)
+    ground_fly = frame['ground_fly'].to_numpy()
+    order = np.argsort(-ground_fly, kind='stable')
+    # missing ground_fly sorts last and never passes
+    counts = np.searchsorted(-ground_fly[order], -np.asarray(GB_RANGE, dtype=float), 'right')
+    sweep = {'path': path, 'mtime': mtime, 'frame': frame, 'passing': {gb: order[:count] for gb, count in zip(GB_RANGE, counts)}}
+    _cache['sweep'] = sweep
+    return sweep
+
+
+def report(sweep, gb):
+    """Returns the pitcher report at a groundball threshold in GB_RANGE, as pistachio.py would publish it (without uncertainty bands)."""
+    frame = sweep['frame']
+    passes = np.zeros(len(frame), dtype=bool)
+    passes[sweep['passing'][gb]] = True
+
+    columns = {}
+    for suffix, report_suffix in [('', ''), ('_pot', 'P')]:
+        p_swar = frame['p_sWAR' + suffix].to_numpy()
+        is_sp = (passes & frame['criteria_sp' + suffix].to_numpy()).astype(int)
+        is_rp = (passes & frame['criteria_rp' + suffix].to_numpy() & (is_sp == 0)).astype(int)
+        columns['sp' + report_suffix] = p_swar * is_sp
+        columns['rp' + report_suffix] = (p_swar / 3) * is_rp
+
+    # filtered before rounding, as in pistachio.py
+    kept = frame['always'].to_numpy() | np.any([values >= MIN_SWAR for values in columns.values()], axis=0)
+    decimals = int(frame['decimals'].iloc[0]) if len(frame) else -1
+    if decimals >= 0:
+        columns = {column: values.round(decimals) for column, values in columns.items()}
+    result = frame.assign(**columns)[kept]
+    return result[['name', 'age', 'club', 'minor', 'ip', 'throws', 'sp', 'rp', 'spP', 'rpP', 'FIP', 'FIP_pot', 'in_list', 'player_id']].reset_index(drop=True)
@@ -0,0 +1,189 @@
+# player name search over the published reports
+# names are normalized (accents folded, case and punctuation dropped) and indexed three ways: sorted full names and sorted
+# name tokens for prefix (type-ahead) matches, and trigram postings for fuzzy matches that survive misspellings
+# the same index is used by pistachio.py to match the names in flagged.txt, and to suggest spellings for the ones matching nobody
+import os
+import re
+import unicodedata
+import numpy as np
+
+
+SEARCH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'search.npz')
+
+# typing this in the search box lists the flagged players (see the README)
+FLAG_KEYWORD = 'flag'
+
+DEFAULT_LIMIT = 20
+
+# minimum trigram similarity (shared / combined trigrams) for a fuzzy match
+MIN_SIMILARITY = 0.3
+
+# closest names suggested for a flagged.txt name that matches no player
+SUGGESTIONS = 3
+
+# normalized names only hold a-z, 0-9 and spaces, so a trigram packs into one int
+_ALPHABET = ' abcdefghijklmnopqrstuvwxyz0123456789'
+_CODES = np.zeros(256, dtype=np.int32)
+_CODES[np.frombuffer(_ALPHABET.encode(), dtype=np.uint8)] = np.arange(len(_ALPHABET))
+
+# letters that don't decompose into a base letter and an accent
+_FOLD = str.maketrans({'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ı': 'i'})
+
+# loaded index, checked against the file it was loaded from and its modification time
+_cache = {}
+
+
+def normalize(name):
+    """Returns a name folded for matching, eg 'José Núñez-Peña' -> 'jose nunez pena'."""
+    folded = unicodedata.normalize('NFKD', str(name).lower().translate(_FOLD)).encode('ascii', 'ignore').decode()
+    folded = re.sub(r"['.]", '', folded)
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', folded).split())
+
+
+def _trigrams(normalized):
+    # trigram codes of each name padded as '  name ', returned as (codes, row of each code), one entry per distinct trigram
+    padded = np.array(['  ' + name + ' ' for name in normalized], dtype='S')
+    width = padded.dtype.itemsize
+    chars = _CODES[np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(len(padded), width)]
+    lengths = np.char.str_len(padded)
+    base = len(_ALPHABET)
+    codes = (chars[:, :-2] * base + chars[:, 1:-1]) * base + chars[:, 2:]
+    valid = np.arange(width - 2) < (lengths - 2)[:, None]
+    rows = np.broadcast_to(np.arange(len(padded))[:, None], codes.shape)[valid]
+    codes = codes[valid]
+    pairs = np.unique(codes.astype(np.int64) * len(padded) + rows)
+    return pairs // len(padded), pairs % len(padded)
+
+
+def build(player_ids, names, flagged=None):
+    """
+    Returns the search index for a list of players (player_ids and display names, in the same order).
+    flagged is an optional boolean array marking the players listed in flagged.txt.
+    """
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    names = np.asarray(names, dtype=object).astype(str)
+    normalized = np.array([normalize(name) for name in names], dtype=str)
+
+    codes, rows = _trigrams(normalized) if len(names) else (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+    trigram_codes, starts = np.unique(codes, return_index=True)
+
+    tokens, token_rows = [], []
+    for row, name in enumerate(normalized):
+        for token in name.split():
+            tokens.append(token)
+            token_rows.append(row)
+    tokens = np.array(tokens, dtype=str)
+    token_order = np.argsort(tokens, kind='stable')
+    name_order = np.argsort(normalized, kind='stable')
+
+    return {
+        'player_id': player_ids,
+        'name': names,
+        'normalized': normalized,
+        'flagged': np.zeros(len(names), dtype=bool) if flagged is None else np.asarray(flagged, dtype=bool),
+        'name_order': name_order,
+        'sorted_names': normalized[name_order],
+        'sorted_tokens': tokens[token_order],
+        'token_rows': np.asarray(token_rows, dtype=np.int64)[token_order],
+        'trigram_codes': trigram_codes,
+        'trigram_offsets': np.r_[starts, len(codes)],
+        'trigram_rows': rows,
+        'trigram_counts': np.bincount(rows, minlength=len(names)),
+    }
+
+
+def save(index):
+    """Saves a search index to reports/search.npz, atomically replacing the previous one."""
+    os.makedirs(os.path.dirname(SEARCH_PATH), exist_ok=True)
+    tmp_path = SEARCH_PATH + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, SEARCH_PATH)
+    _cache['index'] = (SEARCH_PATH, os.path.getmtime(SEARCH_PATH), index)
+
+
+def load(path=SEARCH_PATH):
+    """Returns the saved search index, or None if pistachio.py hasn't exported one yet."""
+    if not os.path.exists(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    cached = _cache.get('index')
+    if cached is not None and cached[:2] == (path, mtime):
+        return cached[2]
+
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    _cache['index'] = (path, mtime, index)
+    return index
+
+
+def _prefix_rows(sorted_values, rows, prefix):
+    start = np.searchsorted(sorted_values, prefix, 'left')
+    stop = np.searchsorted(sorted_values, prefix + '\x7f', 'left')
+    return rows[start:stop]
+
+
+def _query_trigrams(normalized):
+    chars = _CODES[np.frombuffer(('  ' + normalized + ' ').encode(), dtype=np.uint8)]
+    base = len(_ALPHABET)
+    return np.unique((chars[:-2] * base + chars[1:-1]) * base + chars[2:])
+
+
+def similarity(index, query):
+    """Returns the trigram similarity (0-1) of a query to every name in the index."""
+    normalized = normalize(query)
+    n = len(index['name'])
+    if not normalized:
+        return np.zeros(n)
+
+    query_codes = _query_trigrams(normalized)
+    codes = index['trigram_codes']
+    pos = np.clip(np.searchsorted(codes, query_codes), 0, max(len(codes) - 1, 0))
+    found = pos[codes[pos] == query_codes] if len(codes) else pos[:0]
+    offsets = index['trigram_offsets']
+    postings = [index['trigram_rows'][offsets[p]:offsets[p + 1]] for p in found]
+    shared = np.bincount(np.concatenate(postings), minlength=n) if postings else np.zeros(n)
+    return shared / (len(query_codes) + index['trigram_counts'] - shared)
+
+
+def scores(index, query):
+    """
+    Returns a match score for every name in the index: 3 for an exact match, 2 if the name starts with the query,
+    1 if one of its names does, plus the trigram similarity.
+    """
+    normalized = normalize(query)
+    score = similarity(index, query)
+    if not normalized:
+        return score
+    score[_prefix_rows(index['sorted_tokens'], index['token_rows'], normalized)] += 1
+    score[_prefix_rows(index['sorted_names'], index['name_order'], normalized)] += 1
+    sorted_names = index['sorted_names']
+    score[index['name_order'][np.searchsorted(sorted_names, normalized, 'left'):np.searchsorted(sorted_names, normalized, 'right')]] += 1
+    return score
+
+
+def search(index, query, limit=DEFAULT_LIMIT):
+    """Returns the index rows best matching a query, best first. The FLAG_KEYWORD lists the flagged players instead."""
+    if normalize(query) == FLAG_KEYWORD:
+        return np.flatnonzero(index['flagged'])[:limit]
+
+    score = scores(index, query)
+    rows = np.flatnonzero(score >= MIN_SIMILARITY)
+    order = np.lexsort((index['normalized'][rows], -score[rows]))
+    return rows[order][:limit]
+
+
+def flagged_mask(names, flagged_names):
+    """
+    Returns a boolean mask of the names (display names, one per player) listed in flagged.txt.
+    Names are compared normalized, so case and accents don't matter - misspellings flag nobody (see unmatched()).
+    """
+    normalized_names = set(normalize(name) for name in flagged_names) - {''}
+    return np.array([normalize(name) in normalized_names for name in names], dtype=bool)
+
+
+def unmatched(index, flagged_names, limit=SUGGESTIONS):
+    """Returns the flagged.txt names matching no player in the index, each with the names of its closest matches."""
+    found = set(index['normalized'])
+    return {name: list(dict.fromkeys(str(index['name'][row]) for row in search(index, name, limit)))
+            for name in dict.fromkeys(flagged_names) if normalize(name) and normalize(name) not in found}
@@ -0,0 +1,167 @@
+# comparable players: nearest neighbours over the players' rating profiles
+# each export standardizes the 20-80 ratings (current and potential) into one vector per player, for a batter profile and a
+# pitcher profile, and sorts each profile's players into the leaves of a KD-tree saved to reports/similar.npz - a query bounds
+# its distance to every leaf's box in one step, then scans leaves nearest box first and stops once no leaf left can hold a
+# closer player
+import os
+import numpy as np
+
+
+SIMILAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'similar.npz')
+
+# the merged_df columns making up each profile - every player gets a vector in both, but only position players are in the
+# batter tree and only pitchers (position 1) in the pitcher one
+FEATURES = {
+    'batter': ['eye2080', 'avK2080', 'pow2080', 'gap2080', 'babip2080', 'eye2080p', 'avK2080p', 'pow2080p', 'gap2080p', 'babip2080p',
+               'cabi2080', 'carm2080', 'ifrng2080', 'iferr2080', 'ifarm2080', 'turndp2080', 'ofarm2080', 'ofrng2080', 'oferr2080'],
+    'pitcher': ['stuff2080', 'ctrl2080', 'mvt2080', 'hra2080', 'pbabip2080', 'stuff2080p', 'ctrl2080p', 'mvt2080p', 'hra2080p', 'pbabip2080p',
+                'stam2080', 'pitching_ratings_misc_ground_fly'],
+}
+
+# what the comparables went on to do, returned with them
+OUTCOMES = ['OPS+_mlb', 'sWAR_actual', 'sWAR_actual_p']
+
+# the columns pistachio.py hands to build()
+COLUMNS = ['player_id', 'name', 'age', 'club', 'position'] + FEATURES['batter'] + FEATURES['pitcher'] + OUTCOMES
+
+PITCHER_POSITION = 1
+
+# players per leaf: a leaf is scanned in one go, so fewer, bigger leaves trade a little extra distance work for less walking
+LEAF_SIZE = 32
+
+DEFAULT_K = 10
+
+# loaded index, checked against the file it was loaded from and its modification time
+_cache = {}
+
+
+def _tree(vectors, rows):
+    # KD-tree over vectors[rows]: runs of the order are split at the median of their widest dimension until they fit in a leaf -
+    # returns the order and each leaf's run and bounding box (a query bounds every leaf at once, so inner nodes aren't kept)
+    order = np.array(rows, dtype=np.int64)
+    starts, stops = [], []
+    stack = [(0, len(order))] if len(order) else []
+    while stack:
+        start, stop = stack.pop()
+        if stop - start <= LEAF_SIZE:
+            starts.append(start)
+            stops.append(stop)
+            continue
+        run = order[start:stop]
+        points = vectors[run]
+        middle = (stop - start) // 2
+        order[start:stop] = run[np.argpartition(points[:, np.argmax(points.max(axis=0) - points.min(axis=0))], middle)]
+        stack.append((start + middle, stop))
+        stack.append((start, start + middle))
+    dims = vectors.shape[1]
+    boxes = [vectors[order[start:stop]] for start, stop in zip(starts, stops)]
+    return {
+        'order': order,
+        'start': np.array(starts, dtype=np.int64),
+        'stop': np.array(stops, dtype=np.int64),
+        'low': np.array([box.min(axis=0) for box in boxes], dtype=float).reshape(-1, dims),
+        'high': np.array([box.max(axis=0) for box in boxes], dtype=float).reshape(-1, dims),
+    }
+
+
+def build(frame):
+    """
+    Returns the comparables index for a frame of COLUMNS (one row per player).
+    Each rating is standardized over the league, so every rating counts the same; a missing rating is taken as the league average.
+    """
+    index = {
+        'player_id': frame['player_id'].to_numpy(dtype=np.int64),
+        'name': frame['name'].fillna('').to_numpy(dtype=str),
+        'age': frame['age'].to_numpy(dtype=float),
+        'club': frame['club'].fillna('').to_numpy(dtype=str),
+        **{'outcome_' + column: frame[column].to_numpy(dtype=float) for column in OUTCOMES},
+    }
+    pitcher = frame['position'].to_numpy() == PITCHER_POSITION
+    for kind, columns in FEATURES.items():
+        ratings = frame[columns].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vectors = (ratings - np.nanmean(ratings, axis=0)) / np.nanstd(ratings, axis=0)
+        vectors = np.where(np.isfinite(vectors), vectors, 0)
+        index[kind + '_vectors'] = vectors
+        for name, values in _tree(vectors, np.flatnonzero(pitcher if kind == 'pitcher' else ~pitcher)).items():
+            index[kind + '_' + name] = values
+    return index
+
+
+def save(index):
+    """Saves a comparables index to reports/similar.npz, atomically replacing the previous one."""
+    os.makedirs(os.path.dirname(SIMILAR_PATH), exist_ok=True)
+    tmp_path = SIMILAR_PATH + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, SIMILAR_PATH)
+    _cache['index'] = (SIMILAR_PATH, os.path.getmtime(SIMILAR_PATH), index)
+
+
+def load(path=SIMILAR_PATH):
+    """Returns the saved comparables index, or None if pistachio.py hasn't exported one yet."""
+    if not os.path.exists(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    cached = _cache.get('index')
+    if cached is not None and cached[:2] == (path, mtime):
+        return cached[2]
+
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    _cache['index'] = (path, mtime, index)
+    return index
+
+
+def row_of(index, player_id):
+    """Returns the index row of a player_id, or None if the player isn't in the index."""
+    rows = np.flatnonzero(index['player_id'] == player_id)
+    return int(rows[0]) if len(rows) else None
+
+
+def nearest(index, kind, row, k=DEFAULT_K):
+    """
+    Returns the index rows of the k players in a kind's tree with the closest profile to row's, nearest first, and their
+    distances (in standard deviations) - row itself is left out.
+    """
+    vectors = index[kind + '_vectors']
+    order, start, stop = index[kind + '_order'], index[kind + '_start'], index[kind + '_stop']
+    point = vectors[row]
+    found_rows, found_distances = np.empty(0, dtype=np.int64), np.empty(0)
+    if not len(order) or k <= 0:
+        return found_rows, found_distances
+
+    # the smallest squared distance from the point to each leaf's box, and the leaves nearest box first
+    gap = np.maximum(index[kind + '_low'] - point, 0) + np.maximum(point - index[kind + '_high'], 0)
+    bounds = (gap ** 2).sum(axis=1)
+    leaves = np.argsort(bounds, kind='stable')
+    # leaves are scanned a few at a time until the next box is further away than the k-th nearest player found
+    scanned, batch = 0, 4
+    while scanned < len(leaves):
+        if len(found_rows) == k and bounds[leaves[scanned]] > found_distances[-1]:
+            break
+        rows = np.concatenate([order[start[leaf]:stop[leaf]] for leaf in leaves[scanned:scanned + batch]])
+        rows = rows[rows != row]
+        found_rows = np.concatenate([found_rows, rows])
+        found_distances = np.concatenate([found_distances, ((vectors[rows] - point) ** 2).sum(axis=1)])
+        best = np.lexsort((found_rows, found_distances))[:k]
+        found_rows, found_distances = found_rows[best], found_distances[best]
+        scanned += batch
+        batch *= 2
+    return found_rows, np.sqrt(found_distances)
+
+
+def similar(index, kind, player_id, k=DEFAULT_K):
+    """Returns the k players most like player_id in a kind's profile, nearest first, with their outcomes - None if player_id isn't in the index."""
+    row = row_of(index, player_id)
+    if row is None:
+        return None
+    rows, distances = nearest(index, kind, row, k)
+    return [{
+        'player_id': int(index['player_id'][match]),
+        'name': str(index['name'][match]),
+        'age': None if np.isnan(index['age'][match]) else float(index['age'][match]),
+        'club': str(index['club'][match]),
+        'distance': round(float(distance), 3),
+        **{column: None if np.isnan(index['outcome_' + column][match]) else float(index['outcome_' + column][match]) for column in OUTCOMES},
+    } for match, distance in zip(rows, distances)]
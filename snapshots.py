@@ -0,0 +1,88 @@
+# immutable, versioned snapshots of the published reports
+# once a run has published its reports and changes.record has given them a version, publish() links the report files and the
+# indexes derived from them into reports/snapshots/v<version>, which is never written to again, and then repoints
+# reports/snapshots/latest.json at it - so a snapshot can be served at a versioned URL with long-lived cache headers, and the
+# server swaps from one snapshot to the next in one step while a run in progress never touches what readers are served
+import json
+import os
+import re
+import shutil
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(BASE_DIR, 'reports')
+SNAPSHOTS_DIR = os.path.join(REPORTS_DIR, 'snapshots')
+LATEST_PATH = os.path.join(SNAPSHOTS_DIR, 'latest.json')
+
+# the files in each snapshot, by the name they are served under
+FILES = {
+    'batter': 'batter_sWAR.csv',
+    'pitcher': 'pitcher_sWAR.csv',
+    'leaderboards': 'leaderboards.npz',
+    'search': 'search.npz',
+    'pitcher_sweep': 'pitcher_sweep.parquet',
+    'similar': 'similar.npz',
+}
+
+# number of snapshots kept - a client holding an older versioned URL gets a 404 and follows 'latest' again
+KEEP_VERSIONS = 5
+
+
+def _dir(version):
+    return os.path.join(SNAPSHOTS_DIR, f'v{version}')
+
+
+def versions():
+    """Returns the retained snapshot versions, oldest first."""
+    if not os.path.isdir(SNAPSHOTS_DIR):
+        return []
+    found = (re.fullmatch(r'v(\d+)', name) for name in os.listdir(SNAPSHOTS_DIR))
+    return sorted(int(match.group(1)) for match in found if match)
+
+
+def latest_version():
+    """Returns the version latest.json points at, or 0 if nothing has been published."""
+    try:
+        with open(LATEST_PATH) as file:
+            return int(json.load(file)['version'])
+    except FileNotFoundError:
+        return 0
+
+
+def path(version, name):
+    """Returns the path of one of a snapshot's FILES, or None if the snapshot or file isn't there."""
+    if name not in FILES:
+        return None
+    file_path = os.path.join(_dir(version), FILES[name])
+    return file_path if os.path.exists(file_path) else None
+
+
+def publish(version):
+    """
+    Snapshots the files currently in the reports folder as a new version (one already published is never overwritten) and
+    makes it the latest.
+    Files are hard-linked where possible (each export replaces the reports with new files rather than rewriting them, so a
+    link keeps the old contents) and copied otherwise.
+    """
+    if os.path.exists(_dir(version)):
+        raise FileExistsError(f'snapshot v{version} has already been published')
+    tmp_dir = _dir(version) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for file in FILES.values():
+        source = os.path.join(REPORTS_DIR, file)
+        if not os.path.exists(source):
+            continue
+        try:
+            os.link(source, os.path.join(tmp_dir, file))
+        except OSError:
+            shutil.copy2(source, os.path.join(tmp_dir, file))
+    os.replace(tmp_dir, _dir(version))
+
+    tmp_path = LATEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'version': version, 'files': sorted(name for name in FILES if path(version, name))}, file)
+    os.replace(tmp_path, LATEST_PATH)
+
+    for old in versions()[:-KEEP_VERSIONS]:
+        shutil.rmtree(_dir(old), ignore_errors=True)
@@ -0,0 +1,172 @@
+# Monte Carlo uncertainty bands for the projections
+# scouted ratings are noisy, so each player's ratings are redrawn around the scouted values and the model is re-run for every draw;
+# the 10th, 50th and 90th percentiles over the draws show how firm each projection is
+# draws are integer ratings, so every rating's contribution to the model is read from a table over the 1-250 scale built from the
+# model.py curves, and players are processed in memory-bounded chunks spread over a thread pool (NumPy releases the GIL)
+import os
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
+import numpy as np
+import model
+
+
+PERCENTILES = [10, 50, 90]
+
+# projections that get bands, as <column>_p10, <column>_p50 and <column>_p90
+BAND_COLUMNS = ['best_sWAR', 'OPS+', 'OPS+_p', 'FIP', 'sp_sWAR', 'rp_sWAR']
+
+BATTING_RATINGS = ['eye', 'avoidk', 'power', 'gap', 'babip']
+FIELDING_RATINGS = ['framing', 'catcher_arm', 'if_range', 'if_error', 'if_arm', 'turn_dp', 'of_arm', 'of_range', 'of_error']
+PITCHING_RATINGS = ['stuff', 'control', 'hra', 'pbabip']
+
+MAX_RATING = 250
+# table index used for a missing rating, which reads as NaN
+MISSING = MAX_RATING + 1
+
+# 1-250 rating points per point of the 20-80 scale (eg 50 -> 101, 55 -> 117), used to scale the noise on the 20-80 pitching ratings
+POINTS_PER_2080 = 16 / 5
+
+# working memory allowed per chunk of players (one chunk is in flight per thread), and a generous estimate of the bytes held
+# per player per draw
+CHUNK_MEMORY = 64 * 2 ** 20
+BYTES_PER_DRAW = 256
+
+# resolution of the noise quantile table
+NOISE_LEVELS = 4096
+
+
+def _noise_table(rating_sd):
+    # rounded normal quantiles, so noise is drawn as a uniform integer and a table lookup rather than a float normal
+    quantiles = NormalDist(0, rating_sd)
+    return np.array([round(quantiles.inv_cdf((i + 0.5) / NOISE_LEVELS)) for i in range(NOISE_LEVELS)], dtype=np.int16)
+
+
+def _with_missing(table):
+    # float32 is plenty for percentiles and halves the memory traffic of every draw
+    return np.append(table, np.nan).astype(np.float32)
+
+
+def rating_tables(parts=model.RATE_PARTS):
+    """
+    Returns the model's per-rating tables over the 0-250 scale (plus a NaN entry for missing ratings):
+    rates maps each batting rate to a list of (batting rating, table) whose sum is the rate, and defence maps each position to
+    (positional adjustment, list of (fielding rating, tdWAR table)). Height, which isn't scouted, is left out of defence.
+    """
+    grid = np.arange(MAX_RATING + 1, dtype=float)
+    inputs = model.batting_inputs(grid, grid, grid, grid, grid)
+    rates = {}
+    for rate, rate_parts in parts.items():
+        by_rating = {}
+        for name, offset, segments in rate_parts:
+            rating = model.INPUT_RATINGS[name]
+            part = model.piecewise(inputs[name], segments) - offset
+            by_rating[rating] = by_rating[rating] + part if rating in by_rating else part
+        rates[rate] = [(rating, _with_missing(table)) for rating, table in by_rating.items()]
+
+    defence = {}
+    for pos, (adjustment, parts) in model.DEFENCE_PARTS.items():
+        tables = [(name, _with_missing(((model.LEAGUE_DEF - model.piecewise(grid, segments)) * model.GAMES) / model.RUNS_PER_WIN))
+                  for name, segments in parts if name != 'height']
+        defence[pos] = (adjustment, tables)
+    return {'rates': rates, 'defence': defence}
+
+
+def _height_war(height):
+    # the 1B height part, per player - it isn't perturbed
+    for name, segments in model.DEFENCE_PARTS['1b'][1]:
+        if name == 'height':
+            return ((model.LEAGUE_DEF - model.piecewise(height, segments)) * model.GAMES) / model.RUNS_PER_WIN
+    return np.zeros(len(height))
+
+
+def _draw(values, draws, noise, rng):
+    # integer ratings drawn around each player's scouted value, clipped to the scale, with missing ratings kept missing
+    missing = np.isnan(values)
+    base = np.where(missing, 0, np.rint(values)).astype(np.int16)
+    drawn = base[:, None] + noise[rng.integers(0, NOISE_LEVELS, size=(len(values), draws), dtype=np.uint16)]
+    np.clip(drawn, 1, MAX_RATING, out=drawn)
+    drawn[missing] = MISSING
+    return drawn
+
+
+def _rates(tables, ratings, draws, noise, rng):
+    drawn = {name: _draw(ratings[name], draws, noise, rng) for name in BATTING_RATINGS}
+    rates = {}
+    for rate, parts in tables['rates'].items():
+        total = None
+        for rating, table in parts:
+            part = table[drawn[rating]]
+            total = part if total is None else total + part
+        rates[rate] = total
+    return rates
+
+
+def _bands(values):
+    return np.percentile(values, PERCENTILES, axis=1).T
+
+
+def _simulate_chunk(tables, ratings, rows, draws, noise, rng):
+    current = {name: ratings['current'][name][rows] for name in BATTING_RATINGS}
+    talent = {name: ratings['talent'][name][rows] for name in BATTING_RATINGS}
+    fielding = {name: ratings['fielding'][name][rows] for name in FIELDING_RATINGS}
+    pitching = {name: ratings['pitching'][name][rows].astype(np.float32) for name in PITCHING_RATINGS}
+    result = {}
+
+    rates = _rates(tables, current, draws, noise, rng)
+    result['OPS+'] = _bands(model.batting_summary(rates)['ops_plus'])
+    offence = model.offensive_war(rates)
+    del rates
+
+    # best sWAR is offence plus the best defensive WAR over the positions, DH (0) included
+    drawn = {name: _draw(fielding[name], draws, noise, rng) for name in FIELDING_RATINGS}
+    best_defence = np.zeros_like(offence)
+    for pos, (adjustment, parts) in tables['defence'].items():
+        war = _height_war(ratings['height'][rows]).astype(np.float32)[:, None] + adjustment if pos == '1b' else adjustment
+        for rating, table in parts:
+            war = war + table[drawn[rating]]
+        best_defence = np.fmax(best_defence, war)
+    result['best_sWAR'] = _bands(offence + best_defence)
+    del drawn, offence, best_defence
+
+    rates = _rates(tables, talent, draws, noise, rng)
+    result['OPS+_p'] = _bands(model.batting_summary(rates)['ops_plus'])
+    del rates
+
+    # pitching ratings are on the 20-80 scale and aren't clipped, as the FIP mapping is linear either side of 50
+    drawn = {name: pitching[name][:, None] + noise[rng.integers(0, NOISE_LEVELS, size=(len(rows), draws), dtype=np.uint16)] / np.float32(POINTS_PER_2080)
+             for name in PITCHING_RATINGS}
+    fip = model.fip(model.pitcher_rating(drawn['stuff'], drawn['control'], drawn['hra'], drawn['pbabip']))
+    war = model.pitcher_war(fip)
+    result['FIP'] = _bands(fip)
+    result['sp_sWAR'] = _bands(war * ratings['is_sp'][rows].astype(np.float32)[:, None])
+    result['rp_sWAR'] = _bands((war / 3) * ratings['is_rp'][rows].astype(np.float32)[:, None])
+    return rows, result
+
+
+def simulate(ratings, draws=1000, rating_sd=10, seed=0, workers=None, parts=model.RATE_PARTS):
+    """
+    Returns a dict of BAND_COLUMNS -> players x PERCENTILES array of projections over draws of noisy ratings.
+    ratings is a dict with 'current' and 'talent' (dicts of BATTING_RATINGS on the 1-250 scale), 'fielding' (FIELDING_RATINGS),
+    'height', 'pitching' (PITCHING_RATINGS on the 20-80 scale) and the 'is_sp' and 'is_rp' role flags, all per player.
+    rating_sd is the scouting noise in 1-250 rating points; roles are held fixed. Results depend only on seed, not on workers.
+    parts is the batting model's coefficient table (see model.RATE_PARTS).
+    """
+    ratings = {
+        group: ({name: np.asarray(values, dtype=float) for name, values in ratings[group].items()} if isinstance(ratings[group], dict)
+                else np.asarray(ratings[group], dtype=float))
+        for group in ['current', 'talent', 'fielding', 'height', 'pitching', 'is_sp', 'is_rp']
+    }
+    n = len(ratings['height'])
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, CHUNK_MEMORY // (draws * BYTES_PER_DRAW))
+    chunks = [np.arange(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+    rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(len(chunks))]
+
+    tables = rating_tables(parts)
+    noise = _noise_table(rating_sd)
+    bands = {column: np.full((n, len(PERCENTILES)), np.nan) for column in BAND_COLUMNS}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rows, result in pool.map(lambda args: _simulate_chunk(tables, ratings, args[0], draws, noise, args[1]), zip(chunks, rngs)):
+            for column, values in result.items():
+                bands[column][rows] = values
+    return bands
@@ -0,0 +1,121 @@
+# what-if projections of hypothetical ratings, for the server's /whatIf endpoint
+# a request holds one set of ratings, a list of them, or one object of equal-length lists (the fastest form for big batches);
+# each rating goes straight into a NumPy array and through model.projections, the kernels pistachio.py runs, with no DataFrame
+import os
+import numpy as np
+
+import model
+
+
+# the ratings a what-if can be given, by name: on the 20-80 scale (20-100 with super-ratings) as in the OOTP 26 export, apart
+# from height (cm), ground_fly (the groundball percentage) and pitches (the number of pitches rated 45 or more) - the _pot
+# ratings default to the current ones
+BATTING = ['eye', 'avoidk', 'power', 'gap', 'babip']
+FIELDING = ['framing', 'catcher_arm', 'if_range', 'if_error', 'if_arm', 'turn_dp', 'of_arm', 'of_range', 'of_error']
+PITCHING = ['stuff', 'control', 'hra', 'pbabip']
+
+# coefficient tables loaded from rate_coefficients, checked against the file's modification time
+_cache = {}
+
+
+def rate_parts(path):
+    """Returns the rate coefficients in a table written by model.save_rate_parts, or model.RATE_PARTS if path is blank."""
+    if not path:
+        return model.RATE_PARTS
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(path)
+    if cached is None or cached['mtime'] != mtime:
+        cached = _cache[path] = {'mtime': mtime, 'parts': model.load_rate_parts(path)}
+    return cached['parts']
+
+
+def _columns(body):
+    # returns one array per rating (NaN where a rating wasn't given), the number of sets of ratings, and the shape they came in
+    if isinstance(body, dict) and body and all(isinstance(value, list) for value in body.values()):
+        size = len(next(iter(body.values())))
+        if any(len(value) != size for value in body.values()):
+            raise ValueError('Every rating needs the same number of values')
+        rows, shape = None, 'columns'
+    elif isinstance(body, dict):
+        rows, shape = [body], 'object'
+    elif isinstance(body, list) and all(isinstance(row, dict) for row in body):
+        rows, shape = body, 'list'
+    else:
+        raise ValueError('Expected a set of ratings, a list of them, or an object of lists')
+
+    def floats(values):
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+    if rows is None:
+        return {name: floats(values) for name, values in body.items()}, size, shape
+    names = set().union(*rows)
+    return {name: floats(row.get(name) for row in rows) for name in names}, len(rows), shape
+
+
+def project(columns, size, min_gb, parts=model.RATE_PARTS):
+    """
+    Returns the projections (unrounded) for a dict of rating arrays keyed by the names above: the rates, toWAR, OPS+, HR,
+    OBP, positional tdWAR and sWAR, best_sWAR and its position, FIP, p_sWAR and sp/rp sWAR, with their potential versions.
+    """
+    missing = np.full(size, np.nan)
+    rating = lambda name: columns.get(name, missing)
+    potential = lambda name: np.where(np.isnan(rating(name + '_pot')), rating(name), rating(name + '_pot'))
+
+    # everything on the model's scale is mapped in one interp
+    scaled = BATTING + FIELDING + ['stamina']
+    model_scale = model.to_model_scale(np.stack([rating(name) for name in scaled] + [potential(name) for name in BATTING]))
+    batting = dict(zip(BATTING, model_scale[:len(BATTING)]))
+    fielding = dict(zip(FIELDING, model_scale[len(BATTING):len(scaled) - 1]))
+    fielding['height'] = rating('height')
+    stamina = model_scale[len(scaled) - 1]
+    talent = dict(zip(BATTING, model_scale[len(scaled):]))
+    pitching = {name: rating(name) for name in PITCHING}
+    pitching_talent = {name: potential(name) for name in PITCHING}
+    result = model.projections(batting, talent, fielding, pitching, pitching_talent, parts=parts, with_rates=True)
+
+    for suffix in ['', '_pot']:
+        positions = np.stack([result[pos + '_sWAR' + suffix] for pos in model.SWAR_POSITIONS])
+        best = np.where(np.isnan(positions).all(axis=0), -1, np.where(np.isnan(positions), -np.inf, positions).argmax(axis=0))
+        result['best_sWAR' + suffix + '_pos'] = np.array(model.SWAR_POSITIONS + [None], dtype=object)[best]
+
+    # roles, as in pistachio.py: a pitcher needs to be a groundball pitcher and meet the starter or reliever criteria
+    groundball = rating('ground_fly') >= min_gb
+    for suffix, pbabip in [('', pitching['pbabip']), ('_pot', pitching_talent['pbabip'])]:
+        # the pitch count if it was given, otherwise the pitches rated model.PITCH_MINIMUM or more if any pitch was, otherwise (for
+        # the potential count) the current count
+        pitches = columns.get('pitches' + suffix)
+        if pitches is None and any(pitch in columns or pitch + suffix in columns for pitch in model.PITCHES):
+            arsenal = [potential(pitch) if suffix else rating(pitch) for pitch in model.PITCHES]
+            pitches = (np.stack(arsenal) >= model.PITCH_MINIMUM).sum(axis=0)
+        if pitches is None:
+            pitches = rating('pitches')
+        criteria = model.role_criteria(stamina, pbabip, pitches, potential=suffix == '_pot')
+        is_sp = (groundball & criteria['sp']).astype(int)
+        is_rp = (groundball & criteria['rp'] & (is_sp == 0)).astype(int)
+        result['sp_sWAR' + suffix] = result['p_sWAR' + suffix] * is_sp
+        result['rp_sWAR' + suffix] = (result['p_sWAR' + suffix] / 3) * is_rp
+    return result
+
+
+def _json(result):
+    # every projection as a list, NaN (eg from a rating that wasn't given) as null - the numeric ones are converted together, as
+    # converting each on its own costs more than the model does for a single set of ratings
+    numeric = [name for name, values in result.items() if values.dtype != object]
+    values = np.stack([result[name] for name in numeric]).astype(float)
+    converted = values.astype(object)
+    converted[np.isnan(values)] = None
+    lists = dict(zip(numeric, converted.tolist()))
+    return {name: lists[name] if name in lists else values.tolist() for name, values in result.items()}
+
+
+def what_if(body, min_gb, parts=model.RATE_PARTS):
+    """
+    Returns the JSON-ready projections for a /whatIf request body, in the shape it came in: an object for one set of ratings, a
+    list of objects for a list, and an object of lists for an object of lists.
+    """
+    columns, size, shape = _columns(body)
+    result = _json(project(columns, size, min_gb, parts=parts))
+    if shape == 'columns':
+        return result
+    rows = [dict(zip(result, values)) for values in zip(*result.values())]
+    return rows[0] if shape == 'object' else rows